@@ -0,0 +1 @@
+default_app_config = 'battle_wizard.apps.battle_wizardConfig'
@@ -1,8 +1,14 @@
 from battle_wizard.models import Deck
+from battle_wizard.models import GameMove
 from battle_wizard.models import GameRecord
 from battle_wizard.models import GlobalDeck
+from battle_wizard.models import MatchQueueEntry
+from battle_wizard.models import PlayerRating
 from django.contrib import admin
 
 admin.site.register(Deck)
+admin.site.register(GameMove)
 admin.site.register(GameRecord)
 admin.site.register(GlobalDeck)
+admin.site.register(MatchQueueEntry)
+admin.site.register(PlayerRating)
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class battle_wizardConfig(AppConfig):
     name = 'battle_wizard'
+
+    def ready(self):
+        # the game engine runs without Django, so the server tells it to read cards and decks from the database
+        from battle_wizard.game.django_sources import use_database_sources
+        use_database_sources()
@@ -0,0 +1,128 @@
+import asyncio
+import collections
+
+from battle_wizard.game.engine_pool import run_in_engine
+
+
+class RoomJob:
+
+    def __init__(self, consumer, work, args, done):
+        self.consumer = consumer
+        self.work = work
+        self.args = args
+        self.done = done
+        # what work left in the consumer's outbox
+        self.outbox = []
+        self.error = None
+
+
+class RoomActor:
+    """
+        Applies a live game's moves one at a time, in the order its consumers submit them, and sends
+        what each move broadcasts in the same order.
+
+        Consumers submit their engine work, such as a client's move or the AI's, instead of running it
+        themselves. The actor's task runs up to batch_moves queued jobs in one trip to the EnginePool,
+        with the session's lock held, then sends their outboxes. Consecutive broadcasts are coalesced
+        into one game_messages event, so a burst of moves costs one group_send.
+
+        The task only runs while there's work queued. depth() is how many jobs are queued or running,
+        and metrics() reports the most there have been.
+    """
+
+    def __init__(self, session, batch_moves=16):
+        self.session = session
+        self.batch_moves = batch_moves
+        self.pending = collections.deque()
+        self.running = 0
+        self.task = None
+        self.jobs = 0
+        self.batches = 0
+        self.group_sends = 0
+        self.max_depth = 0
+
+    def depth(self):
+        return len(self.pending) + self.running
+
+    async def submit(self, consumer, work, *args):
+        """
+            Queues work(*args) for consumer, and waits until it's been applied and its outbox sent.
+
+            work runs on the EnginePool with the session's lock held, and leaves what it sends in consumer.outbox.
+        """
+        loop = asyncio.get_running_loop()
+        job = RoomJob(consumer, work, args, loop.create_future())
+        self.pending.append(job)
+        self.max_depth = max(self.max_depth, self.depth())
+        if self.task is None or self.task.done():
+            self.task = loop.create_task(self.run())
+        await job.done
+
+    async def run(self):
+        while self.pending:
+            batch = []
+            while self.pending and len(batch) < self.batch_moves:
+                batch.append(self.pending.popleft())
+            self.running = len(batch)
+            batch_error = None
+            try:
+                await run_in_engine(self.apply, batch)
+                await self.send(batch)
+            except Exception as e:
+                print(f"Error sending the moves of game {self.session.game_record.id}: {e}")
+                # the jobs whose own work didn't fail get the error too, so their consumers don't carry on as if they were sent
+                batch_error = e
+            finally:
+                self.running = 0
+                self.jobs += len(batch)
+                self.batches += 1
+                for job in batch:
+                    if job.done.done():
+                        continue
+                    if job.error is not None:
+                        job.done.set_exception(job.error)
+                    elif batch_error is not None:
+                        job.done.set_exception(batch_error)
+                    else:
+                        job.done.set_result(None)
+
+    def apply(self, batch):
+        with self.session.lock:
+            # if somebody else saved the game, the moves are played on what they saved
+            self.session.reload_if_stale()
+            for job in batch:
+                try:
+                    job.work(*job.args)
+                except Exception as e:
+                    job.error = e
+                job.outbox = job.consumer.outbox
+                job.consumer.outbox = []
+
+    async def send(self, batch):
+        broadcasts = []
+        for job in batch:
+            for kind, value in job.outbox:
+                if kind == "group":
+                    broadcasts.append(value)
+                    continue
+                await self.broadcast(job.consumer, broadcasts)
+                broadcasts = []
+                await job.consumer.send_outbox_item(kind, value)
+        await self.broadcast(batch[-1].consumer, broadcasts)
+
+    async def broadcast(self, consumer, events):
+        if not events:
+            return
+        self.group_sends += 1
+        if len(events) > 1:
+            events = [{'type': 'game_messages', 'events': events}]
+        await consumer.channel_layer.group_send(consumer.room_group_name, events[0])
+
+    def metrics(self):
+        return {
+            "depth": self.depth(),
+            "max_depth": self.max_depth,
+            "jobs": self.jobs,
+            "batches": self.batches,
+            "group_sends": self.group_sends,
+        }
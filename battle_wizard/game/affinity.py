@@ -0,0 +1,227 @@
+import asyncio
+import hashlib
+import threading
+import time
+
+from battle_wizard.game.engine_pool import run_in_engine
+from battle_wizard.game.session import GameSessions
+from django.conf import settings
+
+try:
+    from redis import asyncio as aioredis
+except ImportError:
+    # only needed by several workers, which share a Redis server
+    aioredis = None
+
+
+def rendezvous_worker(game_record_id, worker_ids):
+    """
+        Returns the worker in worker_ids that ranks first for game_record_id, the same in every process.
+
+        When a worker leaves, only its rooms move, and they spread over the workers left.
+    """
+    def rank(worker_id):
+        return hashlib.sha1(f"{worker_id}:{game_record_id}".encode("utf-8")).digest()
+    return max(worker_ids, key=rank) if worker_ids else None
+
+
+class RoomAffinity:
+    """
+        Decides which server process, or worker, owns each game room, when several share a Redis server.
+
+        Only a room's owner keeps its GameSession live, so every consumer for room_<game_record_id> has to
+        be on it. The owner is whichever worker holds the room's lease in the Redis server at GAME_WORKER_REDIS_URL,
+        the channel layer's server. A room without one goes to the live worker that rendezvous_worker() picks,
+        which every worker works out the same, and that worker claims the lease when a consumer connects to it.
+        Consumers that connect to another worker redirect their clients to the owner's GAME_WORKER_URL.
+
+        Workers renew their rooms' leases every heartbeat, so a room only moves when its worker dies, and its
+        lease runs out, or when the worker drains. A worker that stalls past its leases can find a room taken
+        by another worker at its next heartbeat, and then drops its session and redirects the room's clients. The drain_worker command tells a worker to drain: it
+        stops taking rooms, saves every live session, releases their leases, and redirects the rooms'
+        clients to their new owners, which load the sessions from the database.
+
+        Without GAME_WORKER_ID, or a Redis server, there's one worker, which owns every room.
+    """
+
+    prefix = "deckzap:worker"
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, worker_id=None, worker_url=None, lease_seconds=None, heartbeat_seconds=None, sessions=None, redis=None):
+        self.worker_id = worker_id if worker_id is not None else getattr(settings, "GAME_WORKER_ID", "")
+        self.worker_url = worker_url if worker_url is not None else getattr(settings, "GAME_WORKER_URL", "")
+        self.lease_seconds = lease_seconds if lease_seconds else getattr(settings, "GAME_ROOM_LEASE_SECONDS", 15)
+        self.heartbeat_seconds = heartbeat_seconds if heartbeat_seconds else getattr(settings, "GAME_WORKER_HEARTBEAT_SECONDS", 3)
+        self.sessions = sessions if sessions else GameSessions.shared()
+        self.redis = redis if redis is not None else self.connect(getattr(settings, "GAME_WORKER_REDIS_URL", ""))
+        # the layer room_handover is sent on
+        self.channel_layer = None
+        self.task = None
+        self.draining = False
+        self.drained = False
+
+    @staticmethod
+    def shared():
+        if RoomAffinity._shared is None:
+            with RoomAffinity._shared_lock:
+                if RoomAffinity._shared is None:
+                    RoomAffinity._shared = RoomAffinity()
+        return RoomAffinity._shared
+
+    @staticmethod
+    def connect(redis_url):
+        """
+            Returns a client for the Redis server at redis_url, or None without one.
+        """
+        if not redis_url:
+            return None
+        if aioredis is None:
+            print("Error: GAME_WORKER_REDIS_URL is set, but the redis package isn't installed, so this worker owns every room")
+            return None
+        return aioredis.Redis.from_url(redis_url)
+
+    def enabled(self):
+        return bool(self.worker_id) and self.redis is not None
+
+    def key(self, *parts):
+        return ":".join([self.prefix] + [str(part) for part in parts])
+
+    async def start(self, channel_layer):
+        """
+            Starts the heartbeat on this event loop, the first time a consumer connects.
+        """
+        self.channel_layer = channel_layer
+        if self.task is not None or not self.enabled():
+            return
+        self.task = asyncio.get_running_loop().create_task(self.run())
+        await self.heartbeat()
+
+    async def run(self):
+        try:
+            while not self.drained:
+                await asyncio.sleep(self.heartbeat_seconds)
+                try:
+                    await self.heartbeat()
+                except (ConnectionError, OSError, aioredis.RedisError) as e:
+                    print(f"Error sending the heartbeat of worker {self.worker_id}: {e}")
+        except asyncio.CancelledError:
+            pass
+
+    async def heartbeat(self):
+        """
+            Keeps this worker live and renews its rooms' leases, or drains it if drain_worker asked.
+        """
+        if self.draining:
+            return
+        if await self.redis.get(self.key("draining", self.worker_id)):
+            await self.drain()
+            return
+        lease_milliseconds = int(self.lease_seconds * 1000)
+        game_record_ids = self.sessions.ids()
+        pipeline = self.redis.pipeline(transaction=False)
+        pipeline.zadd(self.key("live"), {self.worker_id: time.time()})
+        pipeline.set(self.key("url", self.worker_id), self.worker_url, px=lease_milliseconds)
+        for game_record_id in game_record_ids:
+            pipeline.get(self.key("room", game_record_id))
+        owners = (await pipeline.execute())[2:]
+
+        # only the leases this worker still holds get renewed, and the lapsed ones claimed again
+        pipeline = self.redis.pipeline(transaction=False)
+        # (game_record_id, whether the lease lapsed and is being claimed again) for each command in pipeline
+        renewals = []
+        lost_ids = []
+        for game_record_id, owner in zip(game_record_ids, owners):
+            lease_key = self.key("room", game_record_id)
+            if owner is None:
+                pipeline.set(lease_key, self.worker_id, nx=True, px=lease_milliseconds)
+                renewals.append((game_record_id, True))
+            elif owner.decode("utf-8") == self.worker_id:
+                # if the lease lapses between the GET and here, the next heartbeat finds out who has it
+                pipeline.pexpire(lease_key, lease_milliseconds)
+                renewals.append((game_record_id, False))
+            else:
+                lost_ids.append(game_record_id)
+        replies = await pipeline.execute()
+        lost_ids += [game_record_id for (game_record_id, claiming), reply in zip(renewals, replies) if claiming and not reply]
+        for game_record_id in lost_ids:
+            await self.lose_room(game_record_id)
+
+    async def lose_room(self, game_record_id):
+        """
+            Drops the session of a room another worker took the lease of, and sends the room's clients to that worker.
+        """
+        session = self.sessions.get(game_record_id)
+        if session is None:
+            return
+        print(f"Worker {self.worker_id} lost the lease of game {game_record_id}")
+        await run_in_engine(self.stop_session, session)
+        # the save is dropped as a conflict if the new owner has saved the game since
+        self.sessions.writer.request_flush(session)
+        self.sessions.evict(game_record_id)
+        await self.channel_layer.group_send(f"room_{game_record_id}", {"type": "room_handover", "game_record_id": game_record_id})
+
+    async def live_workers(self):
+        worker_ids = await self.redis.zrangebyscore(self.key("live"), time.time() - self.lease_seconds, "+inf")
+        return [worker_id.decode("utf-8") for worker_id in worker_ids]
+
+    async def owner(self, game_record_id):
+        """
+            Returns the id of the worker that owns the room, and claims it if that's this worker.
+        """
+        if not self.enabled():
+            return self.worker_id
+        lease_key = self.key("room", game_record_id)
+        owner = await self.redis.get(lease_key)
+        if owner is not None:
+            return owner.decode("utf-8")
+        worker_ids = [worker_id for worker_id in await self.live_workers() if not (self.draining and worker_id == self.worker_id)]
+        candidate = rendezvous_worker(game_record_id, worker_ids)
+        if candidate is None:
+            candidate = self.worker_id
+        if candidate != self.worker_id:
+            return candidate
+        if await self.redis.set(lease_key, self.worker_id, nx=True, px=int(self.lease_seconds * 1000)):
+            return self.worker_id
+        # another consumer claimed it first
+        return (await self.redis.get(lease_key) or self.worker_id.encode("utf-8")).decode("utf-8")
+
+    async def url(self, worker_id):
+        """
+            Returns the GAME_WORKER_URL of a live worker, which its clients connect to.
+        """
+        url = await self.redis.get(self.key("url", worker_id))
+        return url.decode("utf-8") if url else ""
+
+    async def drain(self):
+        """
+            Hands this worker's rooms over to the other live workers.
+
+            Every live session stops taking moves, then gets saved, then has its lease released, so
+            a new owner loads it with every move. Then its room gets a room_handover, which the consumers
+            pass on to their clients as a REDIRECT.
+        """
+        self.draining = True
+        await self.redis.zrem(self.key("live"), self.worker_id)
+        sessions = self.sessions.live()
+        for session in sessions:
+            await run_in_engine(self.stop_session, session)
+        await asyncio.get_running_loop().run_in_executor(None, self.sessions.writer.drain)
+        for session in sessions:
+            game_record_id = session.game_record.id
+            if await self.redis.get(self.key("room", game_record_id)) == self.worker_id.encode("utf-8"):
+                await self.redis.delete(self.key("room", game_record_id))
+            self.sessions.evict(game_record_id)
+            await self.channel_layer.group_send(f"room_{game_record_id}", {"type": "room_handover", "game_record_id": game_record_id})
+        pipeline = self.redis.pipeline(transaction=False)
+        pipeline.set(self.key("drained", self.worker_id), len(sessions), px=int(self.lease_seconds * 1000) * 10)
+        pipeline.delete(self.key("draining", self.worker_id))
+        await pipeline.execute()
+        self.drained = True
+        print(f"Worker {self.worker_id} handed over {len(sessions)} games")
+
+    def stop_session(self, session):
+        # waits for the move in progress, if any, and drops moves from here on
+        with session.lock:
+            session.handing_over = True
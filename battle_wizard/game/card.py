@@ -1,82 +1,346 @@
+import collections
 import copy
+import gzip
+import hashlib
 import json
 import math
-import random
+import threading
+import time
 
 from battle_wizard.game.data import Constants
-from create_cards.models import CustomCard
+from battle_wizard.game.schema import Field
+from battle_wizard.game.schema import Schema
+from battle_wizard.game.sources import CardSource
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# the effect types that trigger effects, each indexed into its own list in Card.effect_defs
+EFFECT_TYPES = frozenset([
+    "action_added_to_stack",
+    "activated",
+    "after_attack",
+    "after_deals_damage",
+    "after_deals_damage_opponent",
+    "after_declared_attack",
+    "after_card_resolves",
+    "after_shuffle",
+    "before_draw",
+    "before_is_damaged",
+    "check_mana",
+    "discarded_end_of_turn",
+    "draw",
+    "end_turn",
+    "enter_play",
+    "leave_play",
+    "mob_changes_zones",
+    "play_friendly_mob",
+    "select_mob_target",
+    "select_mob_target_override",
+    "sent_to_played_pile",
+    "spell",
+    "spend_mana",
+    "start_turn",
+    "was_drawn",
+])
+
+# maps effect ids to the Card method that resolves them, filled in by @effect_handler when this module loads
+EFFECT_HANDLERS = {}
+
+
+def effect_handler(*effect_ids):
+    """
+        Registers the decorated Card method as the handler for effect_ids.
+    """
+    def register(handler):
+        for effect_id in effect_ids:
+            if effect_id in EFFECT_HANDLERS:
+                print(f"effect id {effect_id} is already handled by {EFFECT_HANDLERS[effect_id].__name__}, not {handler.__name__}")
+            else:
+                EFFECT_HANDLERS[effect_id] = handler
+        return handler
+    return register
+
+
+def unsupported_effect_ids(card_info):
+    """
+        Returns the ids of effects on the card dict that trigger but have no handler.
+    """
+    unsupported_ids = []
+    effects = list(card_info["effects"]) if "effects" in card_info else []
+    while effects:
+        effect = effects.pop()
+        if "effect_type" in effect and effect["effect_type"] in EFFECT_TYPES and ("id" not in effect or effect["id"] not in EFFECT_HANDLERS):
+            unsupported_ids.append(effect["id"] if "id" in effect else None)
+        if "effects" in effect and effect["effects"]:
+            effects += effect["effects"]
+        if "effect_to_activate" in effect and effect["effect_to_activate"]:
+            effects.append(effect["effect_to_activate"])
+    return unsupported_ids
+
+
+CARD_SCHEMA = Schema([
+    Field("attacked", False),
+    Field("author_username", builder=True),
+    # use by artifacts with activated abilities
+    Field("can_activate_effects", True),
+    Field("can_attack_mobs", False),
+    Field("can_attack_players", False),
+    Field("can_be_clicked", False),
+    # used by artifacts such as Upgrade Chanber and Mana Coffin
+    Field("card_for_effect", load="Card(value, self.catalog)", dump="value.as_dict() if value else None"),
+    # the only current subtype in use is "tun-only" for spells that can't be cast as instants
+    Field("card_subtype"),
+    Field("card_type", Constants.mobCardType, builder=True),
+    Field("cost", 0, builder=True),
+    Field("damage", 0),
+    Field("damage_this_turn", 0),
+    Field("damage_to_show", 0),
+    Field("discipline"),
+    Field("description"),
+    # built from the definition on first use, see Card.effects
+    Field("effects", [], load="[CardEffect(e, self.id) for e in value]", dump="self.effects_as_dicts()", builder=True, builder_dump="[e.as_dict(for_card_builder=True) for e in value]", lazy=True, overlay_dump="self.effects_overlay()"),
+    # used by artifacts to say which effects are useable
+    Field("effects_can_be_clicked", []),
+    Field("id", -1),
+    Field("image", builder=True),
+    Field("is_custom", False, builder=True),
+    Field("is_token", False),
+    Field("level"),
+    Field("name", builder=True),
+    # used by artifacts with activated effects
+    Field("original_description"),
+    Field("owner_username"),
+    # set in __init__, because computing it needs the other fields
+    Field("power_points", hydrate=False, builder=True),
+    Field("strength", builder=True),
+    Field("show_level_up", False),
+    Field("tokens", [], load="[CardToken(t) for t in value]", dump="[t.as_dict() for t in value] if value else []"),
+    Field("hit_points", builder=True),
+    Field("turn_played", -1),
+], extra_slots=[
+    # card.effects get indexed into this dict of effect_type to a list of (effect_index, handler)
+    "effect_defs",
+    # the shared CardDefinition the card was made from, or None for cards hydrated from full dicts
+    "definition",
+    # the CardCatalog the card's definition, and the cards it makes, come from
+    "catalog",
+    # the card's own effects, or None while they are still the definition's
+    "_effects",
+    # [snapshot key, as_dict(), as_overlay_dict()] from the last game snapshot, see Card.snapshot_dict
+    "_snapshot_cache",
+])
+
+
+CARD_EFFECT_SCHEMA = Schema([
+    # the type of target the AI should prefer to play
+    Field("ai_target_types", [], builder=True),
+    # an integer to be used to size the effect
+    Field("amount", builder=True),
+    # a string to be used to size the effect
+    Field("amount_id", builder=True),
+    # a string that labels what the amount is of, i.e. damage, hit points, cards, etc
+    Field("amount_name", builder=True),
+    # the highest amount for an effect that disadvantageously affects the player, such as letting opponent draw cards
+    # these limits prevent turning disadvantageous effects into advantageous ones
+    Field("amount_disadvantage_limit", serialize=False, builder=True),
+    # the highest amount for an effect that advantageously affects the player, such as letting opponent draw cards
+    Field("amount_limit", 10, serialize=False, builder=True),
+    # only used for Tame Shop Demon
+    Field("card_descriptions", []),
+    # used for make_token and upgrade effects
+    Field("card_names", []),
+    # used for Lute and Akbar's Pan Pipes
+    Field("counters", -1),
+    # the cost in mana of the effect
+    Field("cost", 0, builder=True),
+    # this gets used in resolve_effect so maybe leave to level
+    Field("cost_hp", 0),
+    # a one word description to maybe show on the card, but definitely show on hover
+    Field("description", builder=True),
+    # a sentence description to show on hover
+    Field("description_expanded", builder=True),
+    # whether or not to show self.description as text on the card, or just on hover if False
+    Field("description_on_card", True),
+    Field("disadvantage_target_types", [], serialize=False, builder=True),
+    # a list of affects added by the effect, use for cards like Hide and WInd of Mercury
+    Field("effects", [], load="[CardEffect(e, idx) for idx, e in enumerate(value)]", dump="[e.as_dict() for e in value] if value else []"),
+    # only used for Lute
+    Field("effect_to_activate", load="CardEffect(value, value['id'] if 'id' in value else 0)", dump="value.as_dict() if value else None"),
+    # used to determine when the effect triggers, such as on draw or after target selection
+    Field("effect_type", builder=True),
+    # whether or not the effect is enabled and will trigger or can be activated
+    Field("enabled", True),
+    # this is set after an effect is used, so it can't be used again this turn
+    Field("exhausted", False),
+    # the id of the effect, which gets mapped to a def
+    Field("id", builder=True),
+    # seems a little specific to make cards
+    Field("make_type"),
+    # todo: move to other_info?
+    Field("multiplier"),
+    # the name of the effect
+    Field("name", builder=True),
+    # this effect can only occur once per card
+    Field("one_per_card", False, serialize=False, builder=True),
+    # set in __init__ from the effect_id argument
+    Field("id_for_game", hydrate=False),
+    # currently, only used for Resonant Frequency to set min_cost and max_cost for what gets killed
+    Field("other_info", {}),
+    # the calculated strength of the effect
+    Field("power_points", 0, builder=True),
+    # used for Mirror of Fate, Wish Stone, and Disk of Death
+    Field("sacrifice_on_activate", False),
+    # a flag to set on the effect to trigger an animation on the next repaint
+    Field("show_effect_animation", False),
+    # the target type for the effect, such as mob, enemy, artifact, self, etc
+    Field("target_type", builder=True),
+    # tokens that the effect adds
+    Field("tokens", [], load="[CardToken(t) for t in value]", dump="[t.as_dict() for t in value] if value else []"),
+    # info the UI needs to display or animate the effect
+    Field("ui_info"),
+])
+
+
+CARD_TOKEN_SCHEMA = Schema([
+    Field("strength_modifier", 0),
+    Field("set_can_act"),
+    Field("hit_points_modifier", 0),
+    Field("turns", -1),
+    Field("multiplier", 0),
+    Field("id"),
+])
+
 
 class Card:
-    
-    def __init__(self, info):
-        self.id = info["id"] if "id" in info else -1
-        self.attacked = info["attacked"] if "attacked" in info else False
-        self.author_username = info["author_username"] if "author_username" in info else None
-        # use by artifacts with activated abilities
-        self.can_activate_effects = info["can_activate_effects"] if "can_activate_effects" in info else True
-        self.can_attack_mobs = info["can_attack_mobs"] if "can_attack_mobs" in info else False
-        self.can_attack_players = info["can_attack_players"] if "can_attack_players" in info else False
-        self.can_be_clicked = info["can_be_clicked"] if "can_be_clicked" in info else False
-        # used by artifacts such as Upgrade Chanber and Mana Coffin
-        self.card_for_effect = Card(info["card_for_effect"]) if "card_for_effect" in info and info["card_for_effect"] else None
-        self.card_subtype = info["card_subtype"] if "card_subtype" in info else None
-        # the only current subtype in use is "tun-only" for spells that can't be cast as instants
-        self.card_type = info["card_type"] if "card_type" in info else Constants.mobCardType
-        self.cost = info["cost"] if "cost" in info else 0
-        self.damage = info["damage"] if "damage" in info else 0
-        self.damage_this_turn = info["damage_this_turn"] if "damage_this_turn" in info else 0
-        self.damage_to_show = info["damage_to_show"] if "damage_to_show" in info else 0
-        self.discipline = info["discipline"] if "discipline" in info else None
-        self.effects = [CardEffect(e, self.id) for _, e in enumerate(info["effects"])] if "effects" in info else []
-        # used by artifacts to say which effects are useable
-        self.effects_can_be_clicked = info["effects_can_be_clicked"] if "effects_can_be_clicked" in info else []
-        # used by artifacts to say which effects are un-useable
-        self.description = info["description"] if "description" in info else None
-        self.image = info["image"] if "image" in info else None
-        self.is_custom = info["is_custom"] if "is_custom" in info else False
-        self.is_token = info["is_token"] if "is_token" in info else False
-        self.level = info["level"] if "level" in info else None
-        self.name = info["name"] if "name" in info else None
-        # used by artifacts with activated effects
-        self.original_description = info["original_description"] if "original_description" in info else None
-        self.owner_username = info["owner_username"] if "owner_username" in info else None
-        self.strength = info["strength"] if "strength" in info else None
-        self.show_level_up = info["show_level_up"] if "show_level_up" in info else False
-        self.tokens = [CardToken(t) for t in info["tokens"]] if "tokens" in info else []
-        self.hit_points = info["hit_points"] if "hit_points" in info else None
-        self.turn_played = info["turn_played"] if "turn_played" in info else -1
 
+    __slots__ = CARD_SCHEMA.slots()
+    
+    def __init__(self, info, catalog=None):
+        self.catalog = catalog if catalog else CardCatalog.shared()
+        if "definition" in info:
+            definition = self.catalog.definition_for(info["definition"], info.get("definition_hash"))
+            if definition:
+                self.hydrate_from_definition(definition, info)
+                return
+            print(f"Error: no card definition for {info['definition']} with hash {info.get('definition_hash')}, hydrating the overlay as a full card")
+        self.definition = None
+        self._snapshot_cache = None
+        self.hydrate(info)
         self.power_points = info["power_points"] if "power_points" in info else self.power_points_value()
 
-        # card.effects get mapped into these lists of defs defined on Card
-        self.action_added_to_stack_effect_defs = []
-        self.activated_effect_defs = []        
-        self.after_attack_effect_defs = []
-        self.after_card_resolves_effect_defs = []
-        self.after_deals_damage_effect_defs = []
-        self.after_deals_damage_opponent_effect_defs = []
-        self.after_declared_attack_effect_defs = []
-        self.after_shuffle_effect_defs = []
-        self.before_draw_effect_defs = []
-        self.before_is_damaged_effect_defs = []
-        self.check_mana_effect_defs = []
-        self.discarded_end_of_turn_effect_defs = []
-        self.draw_effect_defs = []
-        self.enter_play_effect_defs = []
-        self.end_turn_effect_defs = []
-        self.leave_play_effect_defs = []
-        self.mob_changes_zones_effect_defs = []
-        self.play_friendly_mob_effect_defs = []
-        self.select_mob_target_effect_defs = []
-        self.select_mob_target_override_effect_defs = []
-        self.sent_to_played_piled_effect_defs = []
-        self.spell_effect_defs = []
-        self.spend_mana_effect_defs = []
-        self.start_turn_effect_defs = []
-        self.was_drawn_effect_defs = []
+        self.index_effects()
 
-        for effect in self.effects:
-            self.create_effect_def(effect)
+    @staticmethod
+    def from_definition(definition, catalog, card_id=-1, owner_username=None):
+        """
+            Returns a new Card that shares everything but its id and owner with definition, from catalog.
+        """
+        card = Card.__new__(Card)
+        card.catalog = catalog
+        card.hydrate_from_definition(definition, {"id": card_id, "owner_username": owner_username})
+        return card
+
+    def hydrate_from_definition(self, definition, overlay):
+        """
+            Sets the card's attributes from the definition, then from overlay, a dict from as_overlay_dict().
+        """
+        self.definition = definition
+        self._snapshot_cache = None
+        self.hydrate_overlay(overlay, definition.info)
+        if self._effects is None:
+            self.effect_defs = definition.effect_defs
+        else:
+            self.index_effects()
+
+    @property
+    def effects(self):
+        """
+            The card's effects, copied from its definition the first time they are needed.
+
+            Cards in the deck and played pile usually never need their effects, so they never build them.
+        """
+        if self._effects is None:
+            self._effects = [CardEffect(e, self.id) for e in copy_card_info(self.definition.info["effects"])] if self.definition else []
+        return self._effects
+
+    @effects.setter
+    def effects(self, effects):
+        self._effects = effects
+
+    def effects_as_dicts(self):
+        if self._effects is None and self.definition:
+            effects = copy_card_info(self.definition.info["effects"])
+            for e in effects:
+                e["id_for_game"] = self.id
+            return effects
+        return [e.as_dict() for e in self.effects]
+
+    def effects_overlay(self):
+        """
+            Returns the card's effects as dicts for as_overlay_dict, or None if they still match the definition.
+        """
+        if self._effects is None:
+            return None
+        effects = [e.as_dict() for e in self._effects]
+        base_effects = self.definition.info["effects"]
+        if len(effects) != len(base_effects):
+            return effects
+        for effect, base_effect in zip(effects, base_effects):
+            # id_for_game is the card's id, which isn't part of the definition
+            if {**effect, "id_for_game": base_effect["id_for_game"]} != base_effect:
+                return effects
+        return None
+
+    def has_overlay(self):
+        """
+            Returns True if the card can be saved as an overlay on its definition.
+
+            Overlays name their definition, so cards whose name changed, or whose definition is no longer the
+            one the catalog has for that name, such as cards loaded from a saved game's old definitions, get
+            saved as full dicts.
+        """
+        return self.definition is not None and self.catalog.definition_named(self.name) is self.definition
+
+    def snapshot_dict(self):
+        """
+            Returns as_dict() for a game snapshot, reusing the dict from the last snapshot if the card hasn't changed.
+
+            The dict may be shared by several snapshots, so it must not be changed.
+        """
+        return self.cached_dict(1, self.as_dict)
+
+    def snapshot_overlay_dict(self):
+        """
+            Returns as_overlay_dict() for a game snapshot, cached like snapshot_dict().
+        """
+        return self.cached_dict(2, self.as_overlay_dict)
+
+    def cached_dict(self, index, build):
+        # cards with their own effects, tokens, clickable effects, or a card_for_effect can change without
+        # any of their attributes being set, so only cards without those can be checked by their attributes
+        if self._effects is not None or self.tokens or self.effects_can_be_clicked or self.card_for_effect is not None:
+            return build()
+        key = CARD_SNAPSHOT_KEY(self)
+        cache = self._snapshot_cache
+        if cache is None or cache[0] != key:
+            cache = self._snapshot_cache = [key, None, None]
+        if cache[index] is None:
+            card_dict = build()
+            if "effects_can_be_clicked" in card_dict:
+                # as_dict shares the card's own list, which could be filled in after the dict is cached
+                card_dict["effects_can_be_clicked"] = []
+            cache[index] = card_dict
+        return cache[index]
+
+    def copy(self):
+        """
+            Returns an independent copy of the card, which shares the card's definition.
+        """
+        return Card(copy_card_info(self.as_overlay_dict()), self.catalog)
 
     def power_points_value(self):
         power_points = 0
@@ -94,287 +358,32 @@ class Card:
 
         return max(0, math.ceil(power_points))
 
-    def create_effect_def(self, effect):
-        if effect.effect_type == "action_added_to_stack":
-            self.action_added_to_stack_effect_defs.append(self.effect_def_for_id(effect))
-        if effect.effect_type == "activated":
-            self.activated_effect_defs.append(self.effect_def_for_id(effect))
-        if effect.effect_type == "after_attack": 
-            self.after_attack_effect_defs.append(self.effect_def_for_id(effect))
-        if effect.effect_type == "after_deals_damage": 
-            self.after_deals_damage_effect_defs.append(self.effect_def_for_id(effect))
-        if effect.effect_type == "after_deals_damage_opponent": 
-            self.after_deals_damage_opponent_effect_defs.append(self.effect_def_for_id(effect))
-        if effect.effect_type == "after_declared_attack":
-            self.after_declared_attack_effect_defs.append(self.effect_def_for_id(effect))
-        if effect.effect_type == "after_card_resolves": 
-            self.after_card_resolves_effect_defs.append(self.effect_def_for_id(effect))
-        if effect.effect_type == "after_shuffle": 
-            self.after_shuffle_effect_defs.append(self.effect_def_for_id(effect))
-        if effect.effect_type == "before_draw":
-            self.before_draw_effect_defs.append(self.effect_def_for_id(effect))
-        if effect.effect_type == "before_is_damaged":
-            self.before_is_damaged_effect_defs.append(self.effect_def_for_id(effect))
-        if effect.effect_type == "check_mana": 
-            self.check_mana_effect_defs.append(self.effect_def_for_id(effect))
-        if effect.effect_type == "discarded_end_of_turn": 
-            self.discarded_end_of_turn_effect_defs.append(self.effect_def_for_id(effect))
-        if effect.effect_type == "draw": 
-            self.draw_effect_defs.append(self.effect_def_for_id(effect))
-        if effect.effect_type == "end_turn": 
-            self.end_turn_effect_defs.append(self.effect_def_for_id(effect))
-        if effect.effect_type == "enter_play":
-            self.enter_play_effect_defs.append(self.effect_def_for_id(effect))
-        if effect.effect_type == "leave_play":
-             self.leave_play_effect_defs.append(self.effect_def_for_id(effect))
-        if effect.effect_type == "mob_changes_zones": 
-            self.mob_changes_zones_effect_defs.append(self.effect_def_for_id(effect))
-        if effect.effect_type == "play_friendly_mob": 
-            self.play_friendly_mob_effect_defs.append(self.effect_def_for_id(effect))
-        if effect.effect_type == "select_mob_target": 
-            self.select_mob_target_effect_defs.append(self.effect_def_for_id(effect))
-        if effect.effect_type == "select_mob_target_override": 
-            self.select_mob_target_override_effect_defs.append(self.effect_def_for_id(effect))
-        if effect.effect_type == "sent_to_played_pile": 
-            self.sent_to_played_piled_effect_defs.append(self.effect_def_for_id(effect))
-        if effect.effect_type == "spell":
-            self.spell_effect_defs.append(self.effect_def_for_id(effect))
-        if effect.effect_type == "spend_mana": 
-            self.spend_mana_effect_defs.append(self.effect_def_for_id(effect))
-        if effect.effect_type == "start_turn": 
-            self.start_turn_effect_defs.append(self.effect_def_for_id(effect))
-        if effect.effect_type == "was_drawn": 
-            self.was_drawn_effect_defs.append(self.effect_def_for_id(effect))
-
-    def __repr__(self):
-        return f"{self.as_dict()}"
-
-    def as_dict(self, for_card_builder=False):
-        if for_card_builder:
-            return {
-                "author_username": self.author_username,
-                "card_type": self.card_type,
-                "cost": self.cost,
-                "effects": [e.as_dict(for_card_builder=True) for e in self.effects],
-                "image": self.image,
-                "is_custom": self.is_custom,
-                "name": self.name,
-                "power_points": self.power_points,
-                "strength": self.strength,
-                "hit_points": self.hit_points
-            }
+    def index_effects(self):
+        """
+            Maps card.effects into effect_defs, a dict of effect_type to a list of (effect_index, handler),
+            in the same order as effects_for_type(effect_type).
 
-        return {
-            "attacked": self.attacked,
-            "author_username": self.author_username,
-            "can_activate_effects": self.can_activate_effects,
-            "can_attack_mobs": self.can_attack_mobs,
-            "can_attack_players": self.can_attack_players,
-            "can_be_clicked": self.can_be_clicked,
-            "card_for_effect": self.card_for_effect.as_dict() if self.card_for_effect else None,
-            "card_subtype": self.card_subtype,
-            "card_type": self.card_type,
-            "cost": self.cost,
-            "damage": self.damage,
-            "damage_this_turn": self.damage_this_turn,
-            "damage_to_show": self.damage_to_show,
-            "discipline": self.discipline,
-            "description": self.description,
-            "effects": [e.as_dict() for e in self.effects],
-            "effects_can_be_clicked": self.effects_can_be_clicked,
-            "id": self.id,
-            "image": self.image,
-            "is_custom": self.is_custom,
-            "is_token": self.is_token,
-            "level": self.level,
-            "name": self.name,
-            "original_description": self.original_description,
-            "owner_username": self.owner_username,
-            "power_points": self.power_points,
-            "strength": self.strength,
-            "show_level_up": self.show_level_up,
-            "tokens": [t.as_dict() for t in self.tokens] if self.tokens else [],
-            "hit_points": self.hit_points,
-            "turn_played": self.turn_played,
-        }
+            Call this again after changing card.effects.
+        """
+        effect_defs = {}
+        for effect_index, effect in enumerate(self.effects):
+            if effect.effect_type in EFFECT_TYPES:
+                effect_defs.setdefault(effect.effect_type, []).append((effect_index, EFFECT_HANDLERS.get(effect.id)))
+        self.effect_defs = effect_defs
 
+    def effect_def(self, effect_type, idx):
+        """
+            Returns the handler for the idx-th effect of effect_type, to pass to resolve_effect.
+        """
+        return self.effect_defs[effect_type][idx][1]
 
-    def effect_def_for_id(self, effect):
-        eid = effect.id
-        if eid == "ambush":
-            return self.do_ambush_effect          
-        elif eid == "add_fade":
-            return self.do_add_fade_effect          
-        elif eid == "add_fast":
-            return self.do_add_fast_effect          
-        elif eid == "add_mob_effects":
-            return self.do_add_mob_effects_effect
-        elif eid == "add_symbiotic_fast":
-            return self.do_add_symbiotic_fast_effect
-        elif eid == "add_tokens":
-            return self.do_add_tokens_effect
-        elif eid == "allow_instant_cast":
-            return self.do_allow_instant_cast_effect
-        elif eid == "allow_defend_response":
-            return self.do_allow_defend_response_effect
-        elif eid == "augment_mana":
-            return self.do_augment_mana_effect
-        elif eid == "buff_strength_hit_points_from_mana":
-            return self.do_buff_strength_hit_points_from_mana_effect
-        elif eid == "create_card":
-            return self.do_create_card_effect
-        elif eid == "create_random_townie":
-            return self.do_create_random_townie_effect
-        elif eid == "create_random_townie_cheap":
-            return self.do_create_random_townie_effect_cheap
-        elif eid == "damage":
-            return self.do_damage_effect
-        elif eid == "deal_excess_damage_to_controller":
-            return self.do_deal_excess_damage_to_controller_effect
-        elif eid == "decost_card_next_turn":
-            return self.do_decost_card_next_turn_effect
-        elif eid == "decrease_max_mana":
-            return self.do_decrease_max_mana_effect
-        elif eid == "discard_random":
-            return self.do_discard_random_effect_on_player
-        elif eid == "disappear":
-            return self.do_disappear_effect
-        elif eid in ["duplicate_card_next_turn", "store_for_decosting", "upgrade_card_next_turn"]:
-            return self.do_store_card_for_next_turn_effect
-        elif eid == "double_strength":
-            return self.do_double_strength_effect_on_mob
-        elif eid == "drain":
-            return self.do_drain_hp_effect
-        elif eid == "draw":
-            return self.do_draw_effect_on_player
-        elif eid == "draw_on_deal_damage":
-            return self.do_draw_on_deal_damage_effect            
-        elif eid == "draw_if_damaged_opponent":
-            return self.do_draw_if_damaged_opponent_effect_on_player
-        elif eid == "draw_or_resurrect":
-           return self.do_draw_or_resurrect_effect
-        elif eid == "duplicate_card_next_turn":
-            return self.do_duplicate_card_next_turn_effect
-        elif eid == "enable_activated_effect":
-            return self.do_enable_activated_effect_effect
-        elif eid == "entwine":
-            return self.do_entwine_effect
-        elif eid == "fetch_card":
-            return self.do_fetch_card_effect_on_player
-        elif eid == "fetch_card_into_play":
-            return self.do_fetch_card_into_play_effect_on_player
-        elif eid == "guard":
-            return self.do_guard_effect
-        elif eid == "gain_for_hit_points":
-            return self.do_gain_for_hit_points_effect
-        elif eid == "hp_damage_random":
-            return self.do_hp_damage_random_effect
-        elif eid == "heal":            
-            return self.do_heal_effect
-        elif eid == "improve_damage_all_effects_when_used":
-            return self.do_improve_damage_when_used_effect            
-        elif eid == "improve_damage_when_used":
-            return self.do_improve_damage_when_used_effect            
-        elif eid == "improve_effect_amount_when_cast":
-            return self.do_improve_effect_amount_when_cast_effect            
-        elif eid == "improve_effect_when_cast":
-            return self.do_improve_effect_when_cast_effect            
-        elif eid == "keep":
-            return self.do_keep_effect
-        elif eid == "kill":
-            return self.do_kill_effect
-        elif eid == "lose_lurker":
-            return self.do_lose_lurker_effect
-        elif eid == "make":
-            return self.do_make_effect
-        elif eid == "make_cheap_with_option":
-            return self.do_make_cheap_with_option_effect
-        elif eid == "make_from_deck":
-            return self.do_make_from_deck_effect
-        elif eid == "make_token":
-            return self.do_make_token_effect
-        elif eid == "make_untargettable":
-            return self.do_make_untargettable_effect
-        elif eid == "mana":
-            return self.do_mana_effect_on_player
-        elif eid == "mana_increase_max":
-            return self.do_mana_increase_max_effect_on_player
-        elif eid == "mana_reduce":
-            return self.do_mana_reduce_effect_on_player
-        elif eid == "mana_set_max":
-            return self.do_mana_set_max_effect
-        elif eid == "mob_to_artifact":
-            return self.do_mob_to_artifact_effect
-        elif eid == "preserve_stats":
-            return self.do_preserve_stats_effect
-        elif eid == "preserve_effect_improvement":
-            return self.do_preserve_effect_improvement_effect
-        elif eid == "pump_strength":
-            return self.do_pump_strength_effect_on_mob
-        elif eid == "redirect_mob_spell":
-           return self.do_redirect_mob_spell_effect
-        elif eid == "reduce_cost":
-           return self.do_reduce_cost_effect
-        elif eid == "reduce_draw":
-           return self.do_reduce_draw_effect
-        elif eid == "refresh_mana":
-            return self.do_refresh_mana_effect
-        elif eid == "remove_symbiotic_fast":
-            return self.do_remove_symbiotic_fast_effect
-        elif eid == "remove_tokens":
-            return self.do_remove_tokens_effect
-        elif eid == "restrict_effect_targets_min_cost":
-            return self.do_restrict_effect_targets_min_cost_effect
-        elif eid == "restrict_effect_targets_mob_targetter":
-            return self.do_restrict_effect_targets_mob_targetter_effect
-        elif eid == "restrict_effect_targets_mob_with_guard":
-            return self.do_restrict_effect_targets_mob_with_guard_effect
-        elif eid == "restrict_effect_targets_mob_with_strength":
-            return self.do_restrict_effect_targets_mob_with_strength_effect            
-        elif eid == "riffle":
-            return self.do_riffle_effect
-        elif eid == "set_can_attack":
-            return self.do_set_can_attack_effect           
-        elif eid == "set_token":
-            return self.do_set_token_effect
-        elif eid == "shield":
-            return self.do_shield_effect
-        elif eid == "slow_artifact":
-            return self.do_slow_artifact_effect           
-        elif eid == "spell_from_yard":
-            return self.do_spell_from_yard_effect           
-        elif eid == "stack_counter":
-           return  self.do_counter_card_effect
-        elif eid == "start_in_hand":
-           return  self.do_start_in_hand_effect
-        elif eid == "start_in_play":
-           return  self.do_start_in_play_effect
-        elif eid == "store_mana":
-            return  self.do_store_mana_effect            
-        elif eid == "summon_from_deck":
-            return self.do_summon_from_deck_effect_on_player
-        elif eid == "summon_from_deck_artifact":
-            return self.do_summon_from_deck_artifact_effect_on_player
-        elif eid == "summon_from_hand":
-            return self.do_summon_from_hand_effect
-        elif eid == "switch_hit_points":
-            return self.do_switch_hit_points_effect
-        elif eid == "take_extra_turn":
-            return self.do_take_extra_turn_effect_on_player
-        elif eid == "take_control":
-            return self.do_take_control_effect
-        elif eid == "unwind":
-            return self.do_unwind_effect
-        elif eid == "upgrade_card_next_turn":
-            return self.do_upgrade_card_next_turn_effect
-        elif eid == "use_stored_mana":
-            return self.do_use_stored_mana_effect
-        else:
-            print(f"UNSUPPORTED EFFECT ID: {eid}")
+    def __repr__(self):
+        return f"{self.as_dict()}"
 
     @staticmethod
     def all_card_objects(require_images=False, include_tokens=True):
-        return [Card(c_info) for c_info in all_cards(require_images, include_tokens)]
+        catalog = CardCatalog.shared()
+        return [catalog.instantiate_info(c_info) for c_info in catalog.cards(require_images, include_tokens)]
     
     @staticmethod  
     def player_for_username(game, username):
@@ -384,14 +393,7 @@ class Card:
 
     @staticmethod
     def factory_reset_card(card, player):
-        new_card = None
-        # hax
-        for c in Card.all_card_objects():
-            if c.name == card.name:
-                new_card = copy.deepcopy(c)
-        new_card.id = card.id
-        new_card.owner_username = player.username
-        return new_card
+        return player.game.catalog.instantiate(card.name, card.id, player.username)
 
     def resolve(self, player, spell_to_resolve):
         print(f"resolving {self.name}")
@@ -409,7 +411,7 @@ class Card:
             if not "effect_targets" in spell_to_resolve:
                 spell_to_resolve["effect_targets"] = self.effect_targets(player, "spell")
 
-            for idx, effect_def in enumerate(self.spell_effect_defs):
+            for idx, (_, effect_def) in enumerate(self.effect_defs.get("spell", [])):
                 target_info = spell_to_resolve["effect_targets"][idx]
                 if "target_type" in target_info and target_info["target_type"] == "mob":
                     target_mob, _ = player.game.get_in_play_for_id(target_info["id"])
@@ -427,7 +429,7 @@ class Card:
             if not "effect_targets" in spell_to_resolve:
                 spell_to_resolve["effect_targets"] = self.effect_targets(player, "enter_play")
 
-            for idx, effect_def in enumerate(self.enter_play_effect_defs):
+            for idx, (_, effect_def) in enumerate(self.effect_defs.get("enter_play", [])):
                 target_info = spell_to_resolve["effect_targets"][idx]
                 if "target_type" in target_info and target_info["target_type"] == "mob":
                     target_mob, _ = player.game.get_in_play_for_id(target_info["id"])
@@ -444,7 +446,7 @@ class Card:
         if self.card_type == Constants.spellCardType:
             player.played_pile.append(self)
 
-        for idx, effect_def in enumerate(self.after_card_resolves_effect_defs):
+        for idx, (_, effect_def) in enumerate(self.effect_defs.get("after_card_resolves", [])):
             spell_to_resolve["log_lines"].append(
                 self.resolve_effect(effect_def, player, self.effects_for_type("after_card_resolves")[idx], spell_to_resolve["effect_targets"][idx])
             )
@@ -474,9 +476,9 @@ class Card:
             elif e.target_type == "all" or e.target_type == "all_players" or e.target_type == "all_mobs" or e.target_type == "friendly_mobs" or e.target_type == "enemy_mobs":           
                 effect_targets.append({"target_type": e.target_type})
             elif e.target_type == "enemy_mob_random":           
-                effect_targets.append({"id": random.choice(player.my_opponent().in_play).id, "target_type":"mob"})
+                effect_targets.append({"id": player.game.rng.choice(player.my_opponent().in_play).id, "target_type":"mob"})
             elif e.target_type == "friendly_mob_random":           
-                effect_targets.append({"id": random.choice(player.in_play).id, "target_type":"mob"})
+                effect_targets.append({"id": player.game.rng.choice(player.in_play).id, "target_type":"mob"})
             elif e.target_type == None: # improve_damage_when_used has no target_type           
                 effect_targets.append({})
             elif selected_card and e.target_type in ["friendly_mob", "enemy_mob", "mob", "any", "mob_or_artifact"]:
@@ -489,7 +491,7 @@ class Card:
         # print(f"Resolve effect: {effect.name}");
         if effect.counters >= 1 and effect.id != "store_mana":
             effect.counters -= 1
-        log_lines = effect_def(effect_owner, effect, target_info)
+        log_lines = effect_def(self, effect_owner, effect, target_info)
         mana_log_lines = None
         if effect.cost > 0:
             mana_log_lines = effect_owner.spend_mana(effect.cost)
@@ -505,6 +507,7 @@ class Card:
                 all_log_lines += mana_log_lines
         return all_log_lines
 
+    @effect_handler("ambush")
     def do_ambush_effect(self, effect_owner, effect, target_info):
         self.can_attack_mobs = True
         # clone the game so we can do a move in the cloned game to select the mob with Ambush
@@ -519,10 +522,12 @@ class Card:
                 found_attackable_mob = True
         self.can_attack_mobs = found_attackable_mob
 
+    @effect_handler("add_fast")
     def do_add_fast_effect(self, effect_owner, effect, target_info):
         self.can_attack_players = True
         self.can_attack_mobs = True
 
+    @effect_handler("add_fade")
     def do_add_fade_effect(self, effect_owner, effect, target_info):
         token = {
             "turns": -1,
@@ -535,6 +540,7 @@ class Card:
         }
         return self.do_add_token_effect_on_mob(CardEffect(effect, 0), effect_owner, self, effect_owner)
 
+    @effect_handler("add_mob_effects")
     def do_add_mob_effects_effect(self, effect_owner, effect, target_info):
         target_id = target_info["id"]
         target_mob, controller = effect_owner.game.get_in_play_for_id(target_id)
@@ -547,11 +553,12 @@ class Card:
                 existing_effect.enabled = True
             else:
                 target_mob.effects.append(e)
-                target_mob.create_effect_def(e)
+                target_mob.index_effects()
                 if e.effect_type == "enter_play":
-                    self.resolve_effect(target_mob.enter_play_effect_defs[-1], effect_owner, e, {}) 
+                    target_mob.resolve_effect(target_mob.effect_def("enter_play", -1), effect_owner, e, {}) 
         return [f"{target_mob.name} gets {effect.name}."]
 
+    @effect_handler("add_tokens")
     def do_add_tokens_effect(self, effect_owner, effect, target_info):
         print("do_add_tokens_effect")
         if effect.target_type == 'friendly_mobs':
@@ -581,13 +588,16 @@ class Card:
         return [f"{target_mob.name} gets {token}."]
 
 
+    @effect_handler("allow_defend_response")
     def do_allow_defend_response_effect(self, effect_owner, effect, target_info):
         self.can_be_clicked = True
 
+    @effect_handler("allow_instant_cast")
     def do_allow_instant_cast_effect(self, effect_owner, effect, target_info):
         if effect_owner.current_mana() >= self.cost:
                 self.can_be_clicked = True
  
+    @effect_handler("augment_mana")
     def do_augment_mana_effect(self, effect_owner, effect, target_info):
         store_effect = None
         for e in self.effects:
@@ -595,6 +605,7 @@ class Card:
                 store_effect = e
         effect_owner.card_mana += store_effect.counters
 
+    @effect_handler("buff_strength_hit_points_from_mana")
     def do_buff_strength_hit_points_from_mana_effect(self, effect_owner, effect, target_info):
         mana_count = effect_owner.current_mana()
 
@@ -606,6 +617,7 @@ class Card:
         self.hit_points += mana_count
         return log_lines
 
+    @effect_handler("stack_counter")
     def do_counter_card_effect(self, effect_owner, effect, target_info):
         effect_owner.game.actor_turn += 1
         stack_spell = None
@@ -619,10 +631,11 @@ class Card:
             return None
 
         effect_owner.game.stack.remove(stack_spell)
-        card = Card(stack_spell[1])
+        card = Card(stack_spell[1], self.catalog)
         effect_owner.game.current_player().send_card_to_played_pile(card, did_kill=False)
         return [f"{card.name} was countered by {effect_owner.game.opponent().username}."]
 
+    @effect_handler("create_card")
     def do_create_card_effect(self, effect_owner, effect, target_info):
         if effect.target_type == "self":
             player = Card.player_for_username(effect_owner.game, target_info["id"])            
@@ -630,12 +643,7 @@ class Card:
             for x in range(0, effect.amount):
                 if len(player.hand) == player.game.max_hand_size:
                     return
-                card_to_create = None
-                for card in Card.all_card_objects():
-                    if card.name == effect.card_names[0]:
-                        card_to_create = card
-                player.hand.append(copy.deepcopy(card_to_create))
-                player.hand[-1].id = player.game.next_card_id
+                player.hand.append(player.game.catalog.instantiate(effect.card_names[0], player.game.next_card_id))
                 player.game.next_card_id += 1
 
             return [f"{self.name} creates {effect.amount} {effect.card_names[0]}."]
@@ -643,17 +651,19 @@ class Card:
             print(f"unsupported target_type {effect.target_type} for create_card effect")
             return None
 
+    @effect_handler("create_random_townie")
     def do_create_random_townie_effect(self, effect_owner, effect, target_info):
         log_lines = self.do_create_random_townie_effect_with_reduce_cost(effect_owner, effect, target_info, 0)
         if effect.counters == 0:
             self.effects.pop(0)
-            self.activated_effect_defs.pop(0)
+            self.index_effects()
             for a in self.effects:
                 if a.effect_type == "activated":
                     a.enabled = True
             self.description = self.original_description
         return log_lines
         
+    @effect_handler("create_random_townie_cheap")
     def do_create_random_townie_effect_cheap(self, effect_owner, effect, target_info):
         return self.do_create_random_townie_effect_with_reduce_cost(effect_owner, effect, target_info, 1)
 
@@ -661,18 +671,15 @@ class Card:
         player = Card.player_for_username(effect_owner.game, target_info["id"])            
         if len(player.hand) >= player.game.max_hand_size:
             return
-        townies = []
-        for c in Card.all_card_objects():
-            for e in c.effects:
-                if e.id == "is_townie":
-                    townies.append(c)
+        townies = self.catalog.cards_with_effect("is_townie")
         for x in range(0, effect.amount):
-            t = random.choice(townies)
-            player.add_to_deck(t.name, 1, add_to_hand=True, reduce_cost=reduce_cost)
+            t = player.game.rng.choice(townies)
+            player.add_to_deck(t["name"], 1, add_to_hand=True, reduce_cost=reduce_cost)
         if effect.amount == 1:
             return [f"{player.username} makes {effect.amount} Townie."]
         return [f"{player.username} makes {effect.amount} Townies."]
 
+    @effect_handler("damage")
     def do_damage_effect(self, effect_owner, effect, target_info):
         damage_amount = effect.amount 
 
@@ -691,7 +698,7 @@ class Card:
             return self.damage_mobs(effect_owner.game, effect_owner.game.opponent().in_play, damage_amount, effect_owner.username, f"{effect_owner.game.opponent().username}'s mobs")
         elif effect.target_type == "enemy_mob_random":
             if len(effect_owner.my_opponent().in_play) > 0:
-                mob = random.choice(effect_owner.my_opponent().in_play)
+                mob = effect_owner.game.rng.choice(effect_owner.my_opponent().in_play)
                 _, controller = effect_owner.game.get_in_play_for_id(mob.id)
                 log_lines = [f"{effect_owner.username} deals {damage_amount} damage to {mob.name}."]
                 self.do_damage_effect_on_mob(effect, mob, controller, effect.amount, effect.amount_id)
@@ -732,7 +739,7 @@ class Card:
 
         target_player.damage(actual_amount)
         for idx, e in enumerate(self.effects_for_type("after_deals_damage_opponent")):
-            self.resolve_effect(self.after_deals_damage_opponent_effect_defs[idx], effect_owner, e, {"damage": actual_amount}) 
+            self.resolve_effect(self.effect_def("after_deals_damage_opponent", idx), effect_owner, e, {"damage": actual_amount}) 
         return [f"{self.name} deals {actual_amount} damage to {target_player.username}."]            
 
     def do_damage_effect_on_mob(self, effect, target_card, controller, amount, amount_id=None):
@@ -744,11 +751,12 @@ class Card:
 
         target_card.deal_damage_with_effects(damage_amount, controller)
         for idx, e in enumerate(self.effects_for_type("after_deals_damage")):
-            self.resolve_effect(self.after_deals_damage_effect_defs[idx], effect_owner, e, {"damage": actual_amount}) 
+            self.resolve_effect(self.effect_def("after_deals_damage", idx), effect_owner, e, {"damage": actual_amount}) 
 
         if target_card.damage >= target_card.hit_points_with_tokens():
             controller.send_card_to_played_pile(target_card, did_kill=True)
 
+    @effect_handler("deal_excess_damage_to_controller")
     def do_deal_excess_damage_to_controller_effect(self, effect_owner, effect, target_info):
         if effect_owner.username != effect_owner.game.current_player().username:
             return
@@ -760,12 +768,15 @@ class Card:
         excess_damage = target_info["damage_possible"] - target_info["damage"]
         effect_owner.my_opponent().damage(excess_damage)
 
+    @effect_handler("decost_card_next_turn")
     def do_decost_card_next_turn_effect(self, effect_owner, effect, target_info):
         if self.card_for_effect:                     
             self.card_for_effect.cost = max(0, self.card_for_effect.cost - 1)
             effect_owner.hand.append(self.card_for_effect)
             self.card_for_effect = None
     
+    # todo: not registered, because Duplication and Upgrade Chamber use one effect id for both their
+    # activated and start_turn effects, and do_store_card_for_next_turn_effect handles that id
     def do_duplicate_card_next_turn_effect(self, effect_owner, effect, target_info):
         if self.card_for_effect:
             new_card = effect_owner.add_to_deck(self.card_for_effect.name, 1, add_to_hand=True)
@@ -773,22 +784,22 @@ class Card:
             new_card.cost = self.card_for_effect.cost
             self.card_for_effect = None
 
+    # todo: not registered, same as do_duplicate_card_next_turn_effect
     def do_upgrade_card_next_turn_effect(self, effect_owner, effect, target_info):
         if self.card_for_effect:
-            previous_card = None
-            for c in Card.all_card_objects():
-                if self.card_for_effect.name == c.name:
-                    previous_card = c
-            previous_card.upgrade(previous_card)
+            previous_card = self.catalog.instantiate(self.card_for_effect.name)
+            previous_card.upgrade(previous_card, effect_owner.game.rng)
             effect_owner.hand.append(previous_card)
             self.card_for_effect = None
 
+    @effect_handler("decrease_max_mana")
     def do_decrease_max_mana_effect(self, effect_owner, effect, target_info):
         # Mana Shrub leaves play
         if effect.enabled:
             effect_owner.max_mana -= effect.amount
             effect_owner.mana = min(effect_owner.max_mana, effect_owner.mana)
 
+    @effect_handler("discard_random")
     def do_discard_random_effect_on_player(self, effect_owner, effect, target_info):
         if effect.target_type == "opponent":
             target_player = effect_owner.my_opponent()
@@ -806,7 +817,7 @@ class Card:
 
         while discard_amount > 0 and len(target_player.hand) > 0:
             discard_amount -= 1
-            card = random.choice(target_player.hand)
+            card = effect_owner.game.rng.choice(target_player.hand)
             target_player.hand.remove(card)
             target_player.send_card_to_played_pile(card, did_kill=False)
 
@@ -815,6 +826,7 @@ class Card:
         elif amount_to_log > 0:
             return [f"{target_player.username} discards {amount_to_log} cards from {self.name}."]
 
+    @effect_handler("disappear")
     def do_disappear_effect(self, effect_owner, effect, target_info):
         print("do_disappear_effect")
         if self in effect_owner.hand:
@@ -824,15 +836,18 @@ class Card:
         self.show_level_up = True
         return [f"{self.name} disappears from the game instead of going to {effect_owner.username}'s yard."]
 
+    @effect_handler("double_strength")
     def do_double_strength_effect_on_mob(self, effect_owner, effect, target_info):
         target_mob, controller = effect_owner.game.get_in_play_for_id(target_info['id'])
         target_mob.strength += target_mob.strength_with_tokens(controller)
         return [f"{self.name} doubles the strength of {target_mob.name}."]
 
+    @effect_handler("drain")
     def do_drain_hp_effect(self, effect_owner, effect, target_info):
         effect_owner.hit_points += target_info["damage"]
         effect_owner.hit_points = min(effect_owner.max_hit_points, effect_owner.hit_points)
     
+    @effect_handler("draw")
     def do_draw_effect_on_player(self, effect_owner, effect, target_info):
         if effect.target_type == "self":
             target_id = effect_owner.username
@@ -845,9 +860,11 @@ class Card:
         target_player.draw(amount_to_draw)
         return [f"{target_player.username} draws {amount_to_draw} from {self.name}."]
 
+    @effect_handler("draw_on_deal_damage")
     def do_draw_on_deal_damage_effect(self, effect_owner, effect, target_info):
         effect_owner.draw(effect.amount)
 
+    @effect_handler("draw_if_damaged_opponent")
     def do_draw_if_damaged_opponent_effect_on_player(self, effect_owner, effect, target_info):
         target_player = effect_owner
         if target_player.game.opponent().damage_this_turn > 0:
@@ -855,6 +872,7 @@ class Card:
             return [f"{target_player.username} draws {effect.amount} from {self.name}."]
         return None
     
+    @effect_handler("draw_or_resurrect")
     def do_draw_or_resurrect_effect(self, effect_owner, effect, target_info):
         # effect_owner
         amount = effect_owner.mana 
@@ -863,10 +881,10 @@ class Card:
         for card in effect_owner.played_pile:
             if card.card_type == Constants.mobCardType:
                 dead_mobs.append(card)
-        random.shuffle(dead_mobs)
+        effect_owner.game.rng.shuffle(dead_mobs)
         choices = ["draw", "resurrect"]
         for x in range(0, amount):
-            if len(dead_mobs) == 0 or random.choice(choices) == 'draw' or len(effect_owner.in_play) == 7:
+            if len(dead_mobs) == 0 or effect_owner.game.rng.choice(choices) == 'draw' or len(effect_owner.in_play) == 7:
                 effect_owner.draw(1)
             else:
                 mob = dead_mobs.pop()
@@ -879,6 +897,7 @@ class Card:
             log_lines = [ritual_line]
         return log_lines
 
+    @effect_handler("enable_activated_effect")
     def do_enable_activated_effect_effect(self, effect_owner, effect, target_info):
         # todo don't hardcode turning them all off, only needed for Arsenal, which doesn't even equip anymore
         for e in self.effects_for_type("activated"):
@@ -889,10 +908,11 @@ class Card:
         activated_effect.enabled = True
         self.description = activated_effect.description
         self.effects.insert(0, activated_effect)
-        self.activated_effect_defs.insert(0,self.effect_def_for_id(activated_effect))
+        self.index_effects()
         self.can_activate_effects = True
         return [f"{effect_owner.username} activates {self.name}."]
 
+    @effect_handler("entwine")
     def do_entwine_effect(self, effect_owner, effect, target_info):
         for p in effect_owner.game.players:
             for pile in [p.hand, p.played_pile]:
@@ -902,26 +922,28 @@ class Card:
                     pile_cards.append(c)
                 for c in pile_cards:
                     pile.remove(c)
-            random.shuffle(p.deck)
+            effect_owner.game.rng.shuffle(p.deck)
             p.draw(3)
         return [f"{effect_owner.username} casts {self.name}."]
  
-    def upgrade(self, previous_card, upgrader_card=None):
+    def upgrade(self, previous_card, rng, upgrader_card=None):
         upgrade_cards = []
-        for c in Card.all_card_objects():
-            if not c.is_token and c.cost > previous_card.cost and c.cost < previous_card.cost + 2 and c.card_type == self.card_type:
+        for c in self.catalog.cards_with_cost(previous_card.cost + 1):
+            if not c["is_token"] and c["card_type"] == self.card_type:
                 upgrade_cards.append(c)
         if len(upgrade_cards) > 0:
-            upgraded_card = random.choice(upgrade_cards)
+            upgraded_card = self.catalog.instantiate_info(rng.choice(upgrade_cards))
             self.name = upgraded_card.name
             self.image = upgraded_card.image
             self.description = upgraded_card.description
             self.effects = upgraded_card.effects
             if upgrader_card:
                 self.effects.append(upgrader_card.effects[0])
+            self.index_effects()
             self.strength = upgraded_card.strength
             self.hit_points = upgraded_card.hit_points
 
+    @effect_handler("fetch_card")
     def do_fetch_card_effect_on_player(self, effect_owner, effect, target_info):
         if Constants.artifactCardType in effect.target_type:
             self.display_deck_artifacts(effect_owner, "fetch_artifact_into_hand")
@@ -935,6 +957,7 @@ class Card:
 
         return [f"{effect_owner.username} fetches a card with {self.name}."]
 
+    @effect_handler("fetch_card_into_play")
     def do_fetch_card_into_play_effect_on_player(self, effect_owner, effect, target_info):
         if Constants.artifactCardType in effect.target_type:
             self.display_deck_artifacts(effect_owner, "fetch_artifact_into_play")
@@ -965,6 +988,7 @@ class Card:
         else:
             return None
 
+    @effect_handler("guard")
     def do_guard_effect(self, effect_owner, effect, target_info):
         guard_mobs = []
         for mob in effect_owner.in_play:
@@ -976,6 +1000,7 @@ class Card:
                 mob.can_be_clicked = mob in guard_mobs
             effect_owner.can_be_clicked = False
 
+    @effect_handler("gain_for_hit_points")
     def do_gain_for_hit_points_effect(self, effect_owner, effect, target_info):
         target_mob, controller = effect_owner.game.get_in_play_for_id(target_info['id'])
         if target_mob:
@@ -985,11 +1010,13 @@ class Card:
             if controller.hit_points > old_hp:
                 return [f"{controller.username} gained {controller.hit_points - old_hp} from {self.name}."]
 
+    @effect_handler("lose_lurker")
     def do_lose_lurker_effect(self, effect_owner, effect, target_info):
         for effect in self.effects:
             if effect.id == "make_untargettable":
                 effect.enabled = False
 
+    @effect_handler("heal")
     def do_heal_effect(self, effect_owner, effect, target_info):
         if effect.target_type == "self":
             return self.do_heal_effect_on_player(effect_owner, effect)
@@ -1026,20 +1053,22 @@ class Card:
         target_mob.damage_this_turn = max(target_mob.damage_this_turn, 0)
         return [f"{self.name} healed {target_mob.name} for {amount}."]
 
+    @effect_handler("hp_damage_random")
     def do_hp_damage_random_effect(self, effect_owner, effect, target_info):
-        choice = random.choice(["hp", "damage"])
+        choice = effect_owner.game.rng.choice(["hp", "damage"])
         if choice == "hp":
             return self.do_heal_effect_on_player(effect_owner, CardEffect({"amount": 1}, self.id))
         elif choice == "damage":
             targets = [effect_owner.my_opponent()]
             for m in effect_owner.my_opponent().in_play:
                 targets.append(m)
-            choice = random.choice(targets)
+            choice = effect_owner.game.rng.choice(targets)
             if choice == targets[0]:
                 self.do_damage_effect_on_player(effect, targets[0], choice, 1)
             else:
                 self.do_damage_effect_on_mob(effect, choice, effect_owner.my_opponent(), 1)
 
+    @effect_handler("improve_damage_all_effects_when_used", "improve_damage_when_used")
     def do_improve_damage_when_used_effect(self, effect_owner, effect, target_info):
         # Rolling Thunder
         self.effects[0].amount += 1
@@ -1054,12 +1083,14 @@ class Card:
         self.show_level_up = True
         return [f"{self.name} gets improved to deal {self.effects[0].amount} damage."]
 
+    @effect_handler("improve_effect_amount_when_cast")
     def do_improve_effect_amount_when_cast_effect(self, effect_owner, effect, target_info):
         # Tech Crashhouse
         self.effects[0].amount += 1
         self.show_level_up = True
         return [f"{self.name} gets improved to {self.effects[0].amount} Townies made."]
 
+    @effect_handler("improve_effect_when_cast")
     def do_improve_effect_when_cast_effect(self, effect_owner, effect, target_info):
         # Tame Shop Demon
         old_level = self.level
@@ -1069,6 +1100,7 @@ class Card:
             self.show_level_up = True
         return [f"{self.name} levels up."]
 
+    @effect_handler("keep")
     def do_keep_effect(self, effect_owner, effect, target_info):
         log_lines = [f"{effect_owner.username} kept a card."]
         if effect.amount and not effect.amount_id:
@@ -1093,6 +1125,7 @@ class Card:
         effect_owner.played_pile.remove(c)
         return log_lines
 
+    @effect_handler("kill")
     def do_kill_effect(self, effect_owner, effect, target_info):
         if effect.target_type == "mob" or effect.target_type == "artifact" or effect.target_type == "mob_or_artifact":
             target_mob, controller = effect_owner.game.get_in_play_for_id(target_info['id'])
@@ -1119,6 +1152,7 @@ class Card:
     def do_kill_effect_on_mob(self, target_mob, controller):
         controller.send_card_to_played_pile(target_mob, did_kill=True)
 
+    @effect_handler("mob_to_artifact")
     def do_mob_to_artifact_effect(self, effect_owner, effect, target_info):
         target_mob, controller = effect_owner.game.get_in_play_for_id(target_info['id'])
         if not target_mob:
@@ -1132,12 +1166,15 @@ class Card:
         effect_owner.game.players[1].update_for_mob_changes_zones()
         return [f"{effect_owner.username} turns {target_mob.name} into an artifact."]
 
+    @effect_handler("make")
     def do_make_effect(self, effect_owner, effect, target_info):
         return self.make(1, effect.make_type, effect_owner)
 
+    @effect_handler("make_cheap_with_option")
     def do_make_cheap_with_option_effect(self, effect_owner, effect, target_info):
         return self.make(1, effect.make_type, effect_owner, reduce_cost=1, option=True)
 
+    @effect_handler("make_from_deck")
     def do_make_from_deck_effect(self, effect_owner, effect, target_info):
         return self.make_from_deck(effect_owner)
 
@@ -1149,18 +1186,19 @@ class Card:
         if player.game.turn <= 10 and make_type == Constants.mobCardType:
             requiredMobCost = math.floor(player.game.turn / 2) + 1
 
-        all_game_cards = Card.all_card_objects(require_images=True, include_tokens=False)
+        catalog = self.catalog
+        all_game_cards = catalog.cards(require_images=True, include_tokens=False)
         banned_cards = ["Make Spell", "Make Spell+", "Make Mob", "Make Mob+"]
         card1 = None 
-        while not card1 or card1.name in banned_cards or (make_type != "any" and card1.card_type != make_type) or (requiredMobCost and make_type == Constants.mobCardType and card1.cost != requiredMobCost): 
-            card1 = random.choice(all_game_cards)
+        while not card1 or card1["name"] in banned_cards or (make_type != "any" and card1["card_type"] != make_type) or (requiredMobCost and make_type == Constants.mobCardType and card1["cost"] != requiredMobCost): 
+            card1 = player.game.rng.choice(all_game_cards)
         card2 = None
-        while not card2 or card2.name in banned_cards or (make_type != "any" and card2.card_type != make_type) or card2 == card1:
-            card2 = random.choice(all_game_cards)
+        while not card2 or card2["name"] in banned_cards or (make_type != "any" and card2["card_type"] != make_type) or card2 is card1:
+            card2 = player.game.rng.choice(all_game_cards)
         card3 = None
-        while not card3 or card3.name in banned_cards or (make_type != "any" and card3.card_type != make_type) or card3 in [card1, card2]:
-            card3 = random.choice(all_game_cards)
-        player.card_choice_info = {"cards": [card1, card2, card3], "choice_type": "make"}
+        while not card3 or card3["name"] in banned_cards or (make_type != "any" and card3["card_type"] != make_type) or card3 is card1 or card3 is card2:
+            card3 = player.game.rng.choice(all_game_cards)
+        player.card_choice_info = {"cards": [catalog.instantiate_info(c) for c in [card1, card2, card3]], "choice_type": "make"}
         
         if option:
             player.card_choice_info["choice_type"] = "make_with_option"
@@ -1184,15 +1222,15 @@ class Card:
         card1 = None 
         if len(player.deck) > 0:
             while not card1:
-                card1 = random.choice(player.deck)
+                card1 = player.game.rng.choice(player.deck)
         card2 = None
         if len(player.deck) > 1:
             while not card2 or card2 == card1:
-                card2 = random.choice(player.deck)
+                card2 = player.game.rng.choice(player.deck)
         card3 = None
         if len(player.deck) > 2:
             while not card3 or card3 in [card1, card2]:
-                card3 = random.choice(player.deck)
+                card3 = player.game.rng.choice(player.deck)
         
         if card3:
             player.card_choice_info = {"cards": [card1, card2, card3], "choice_type": "make_from_deck"}
@@ -1203,11 +1241,13 @@ class Card:
 
         return [f"{player.username} made a card from their deck with {self.name}."]
 
+    @effect_handler("mana")
     def do_mana_effect_on_player(self, effect_owner, effect, target_info):
         target_player = Card.player_for_username(effect_owner.game, target_info["id"])
         target_player.mana += effect.amount
         return [f"{target_player.username} gets {effect.amount} mana."]
 
+    @effect_handler("make_token")
     def do_make_token_effect(self, effect_owner, effect, target_info):
         if "did_kill" in target_info and not target_info["did_kill"]:
             return
@@ -1215,14 +1255,10 @@ class Card:
         for x in range(0, effect.amount):
             if len(player.in_play) == 7:
                 return
-            card_to_create = None
             card_name = effect.card_names[0]
             if self.level != None:
                 card_name = effect.card_names[self.level]
-            for card in Card.all_card_objects():
-                if card.name == card_name:
-                    card_to_create = card
-            new_card = copy.deepcopy(card_to_create)
+            new_card = self.catalog.instantiate(card_name)
             player.in_play.append(new_card)
             player.update_for_mob_changes_zones()
             new_card.id = player.game.next_card_id
@@ -1235,6 +1271,7 @@ class Card:
         else:
             return [f"{self.name} makes {effect.amount} tokens for {player.username}."]
 
+    @effect_handler("make_untargettable")
     def do_make_untargettable_effect(self, effect_owner, effect, target_info):
         if effect.enabled:
             if effect_owner.card_info_to_target["card_id"] != None or effect_owner.username != effect_owner.game.current_player().username:
@@ -1250,6 +1287,7 @@ class Card:
                         card.can_be_clicked = True
                         break
     
+    @effect_handler("mana_increase_max")
     def do_mana_increase_max_effect_on_player(self, effect_owner, effect, target_info):
         target_player = Card.player_for_username(effect_owner.game, target_info["id"])
         old_max_mana = target_player.max_mana
@@ -1261,6 +1299,7 @@ class Card:
                 self.effects[1].enabled = False
         return [f"{target_player.username} increases their max mana by {effect.amount}."]
 
+    @effect_handler("mana_set_max")
     def do_mana_set_max_effect(self, effect_owner, effect, target_info):
         for p in effect_owner.game.players:
             p.max_mana = effect.amount
@@ -1268,40 +1307,43 @@ class Card:
             p.mana = min(p.mana, p.max_mana)
         return [f"{self.name} sets max mana to {effect.amount}."]
 
+    @effect_handler("mana_reduce")
     def do_mana_reduce_effect_on_player(self, effect_owner, effect, target_info):
         target_player = Card.player_for_username(effect_owner.game, target_info["id"])
         target_player.max_mana -= max(effect.amount, 0)
         target_player.mana = min(target_player.mana, target_player.max_mana)
         return [f"{target_player.username} decreases max mana by {effect.amount}."]
 
+    @effect_handler("preserve_effect_improvement")
     def do_preserve_effect_improvement_effect(self, effect_owner, effect, target_info):
         new_card = Card.factory_reset_card(self, effect_owner)
         old_effect_amount = self.effects[0].amount 
         old_level = self.level
-        for a in dir(self):
-            if not a.startswith('__') and not callable(getattr(self, a)):
-                setattr(self, a, getattr(new_card, a))
+        for a in Card.__slots__:
+            setattr(self, a, getattr(new_card, a))
         self.effects[0].amount = old_effect_amount
         # hax - does this more belong in factory_reset_card?
         self.level = old_level
 
+    @effect_handler("preserve_stats")
     def do_preserve_stats_effect(self, effect_owner, effect, target_info):
         new_card = Card.factory_reset_card(self, effect_owner)
         old_strength = self.strength
         old_hit_points = self.hit_points
         old_level = self.level
-        for a in dir(self):
-            if not a.startswith('__') and not callable(getattr(self, a)):
-                setattr(self, a, getattr(new_card, a))
+        for a in Card.__slots__:
+            setattr(self, a, getattr(new_card, a))
         self.strength = old_strength
         self.hit_points = old_hit_points
         self.level = old_level
 
+    @effect_handler("pump_strength")
     def do_pump_strength_effect_on_mob(self, effect_owner, effect, target_info):
         target_mob, _ = effect_owner.game.get_in_play_for_id(target_info['id'])
         target_mob.strength += effect.amount
         return [f"{effect_owner.username} pumps the strength of {target_mob.name} by {effect.amount}."]
 
+    @effect_handler("redirect_mob_spell")
     def do_redirect_mob_spell_effect(self, effect_owner, effect, target_info):
         card_id = target_info["id"]
         if len(effect_owner.in_play) >= 7:
@@ -1314,7 +1356,7 @@ class Card:
                 stack_spell = spell
                 break
 
-        villager_card = Card({})
+        villager_card = Card({}, self.catalog)
         villager_card.id = effect_owner.game.next_card_id
 
         token_card_name = "Willing Villager"
@@ -1329,6 +1371,7 @@ class Card:
         return[f"{stack_spell[1]['name']} was redirected to a newly summoned {villager_card.name}."]
 
 
+    @effect_handler("restrict_effect_targets_min_cost")
     def do_restrict_effect_targets_min_cost_effect(self, effect_owner, effect, target_info):
         if self == effect_owner.selected_spell():
             for player in effect_owner.game.players:
@@ -1349,10 +1392,11 @@ class Card:
                             has_targets = True
             self.can_be_clicked = has_targets
 
+    @effect_handler("restrict_effect_targets_mob_targetter")
     def do_restrict_effect_targets_mob_targetter_effect(self, effect_owner, effect, target_info):
         if self == effect_owner.selected_spell():
             for spell in effect_owner.game.stack:
-                card = Card(spell[1])
+                card = Card(spell[1], self.catalog)
                 if card.card_type == Constants.spellCardType:
                     action = spell[0]
                     if "effect_targets" in action and action["effect_targets"][0]["target_type"] == Constants.mobCardType:
@@ -1369,6 +1413,7 @@ class Card:
                         has_targets = True
             self.can_be_clicked = has_targets
 
+    @effect_handler("restrict_effect_targets_mob_with_guard")
     def do_restrict_effect_targets_mob_with_guard_effect(self, effect_owner, effect, target_info):
         if self.id == effect_owner.selected_mob():
             for player in effect_owner.game.players:
@@ -1385,6 +1430,7 @@ class Card:
                         has_targets = True
             self.can_be_clicked = has_targets
 
+    @effect_handler("restrict_effect_targets_mob_with_strength")
     def do_restrict_effect_targets_mob_with_strength_effect(self, effect_owner, effect, target_info):
         if self.id == effect_owner.selected_mob():
             for player in effect_owner.game.players:
@@ -1401,6 +1447,7 @@ class Card:
                         has_targets = True
             self.can_be_clicked = has_targets
 
+    @effect_handler("remove_tokens")
     def do_remove_tokens_effect(self, effect_owner, effect, target_info):
         if effect.target_type == "friendly_mobs":
             for mob in effect_owner.in_play:
@@ -1410,18 +1457,22 @@ class Card:
                         tokens_to_keep.append(token)
                 mob.tokens = tokens_to_keep
 
+    @effect_handler("reduce_cost")
     def do_reduce_cost_effect(self, effect_owner, effect, target_info):
         if not effect.target_type or self.card_type == effect.target_type:
             self.cost -= 1
             self.cost = max(0, self.cost)
 
+    @effect_handler("reduce_draw")
     def do_reduce_draw_effect(self, effect_owner, effect, target_info):
         effect_owner.about_to_draw_count -= effect.amount
 
+    @effect_handler("refresh_mana")
     def do_refresh_mana_effect(self, effect_owner, effect, target_info):
         if effect_owner.mana == 0 and target_info["amount_spent"] > 0:
             effect_owner.mana = effect_owner.max_mana
 
+    @effect_handler("use_stored_mana")
     def do_use_stored_mana_effect(self, effect_owner, effect, target_info):
         amount_to_spend = target_info["amount_to_spend"]
         store_effect = None
@@ -1437,6 +1488,7 @@ class Card:
         return log_lines
 
     
+    @effect_handler("riffle")
     def do_riffle_effect(self, effect_owner, effect, target_info):
         player = effect_owner
         top_cards = []
@@ -1446,6 +1498,7 @@ class Card:
         player.card_choice_info = {"cards": top_cards, "choice_type": "riffle"}
         return [f"{player.username} riffled for {effect.amount} and chose a card."]
 
+    @effect_handler("set_can_attack")
     def do_set_can_attack_effect(self, effect_owner, effect, target_info):
         if effect.target_type == "friendly_mobs":
             player = effect_owner
@@ -1457,10 +1510,12 @@ class Card:
         else:
             print(f"e.target_type {target_type} not supported for set_can_attack")
 
+    @effect_handler("slow_artifact")
     def do_slow_artifact_effect(self, effect_owner, effect, target_info):
         for effect in self.effects:
             effect.exhausted = True
 
+    @effect_handler("spell_from_yard")
     def do_spell_from_yard_effect(self, effect_owner, effect, target_info):
         spells = []
         for card in effect_owner.played_pile:
@@ -1470,21 +1525,24 @@ class Card:
             return
         else:
             if len(effect_owner.hand) < effect_owner.game.max_hand_size:
-                spell = random.choice(spells)
+                spell = effect_owner.game.rng.choice(spells)
                 effect_owner.hand.append(spell)
                 effect_owner.played_pile.remove(spell)
                 return [f"{self.name} returns {spell.name} to {effect_owner.username}'s hand."]
 
+    @effect_handler("start_in_hand")
     def do_start_in_hand_effect(self, effect_owner, effect, target_info):
         effect_owner.hand.append(self)
         effect_owner.deck.remove(self)   
 
+    @effect_handler("start_in_play")
     def do_start_in_play_effect(self, effect_owner, effect, target_info):
         if len(effect_owner.artifacts) == 0:
             effect_owner.artifacts.append(self)
             effect_owner.deck.remove(self)   
             self.turn_played = 0
 
+    @effect_handler("duplicate_card_next_turn", "store_for_decosting", "upgrade_card_next_turn")
     def do_store_card_for_next_turn_effect(self, effect_owner, effect, target_info):
         for c in effect_owner.hand:
             if "id" in target_info and c.id == target_info["id"]:
@@ -1492,6 +1550,7 @@ class Card:
                 effect_owner.hand.remove(c)
                 break
 
+    @effect_handler("store_mana")
     def do_store_mana_effect(self, effect_owner, effect, target_info):
         counters = max(effect.counters, 0)
         new_counters = min(3 - counters, effect_owner.mana)
@@ -1504,6 +1563,7 @@ class Card:
             effect.counters = min(effect.counters, 3)
         return log_lines
 
+    @effect_handler("summon_from_deck")
     def do_summon_from_deck_effect_on_player(self, effect_owner, effect, target_info):
         if effect.target_type == "self" and effect.amount == 1:
             mobs = []
@@ -1513,20 +1573,17 @@ class Card:
                     mobs.append(c)
 
             if len(mobs) > 0:
-                mob_to_summon = random.choice(mobs)
+                mob_to_summon = effect_owner.game.rng.choice(mobs)
                 target_player.deck.remove(mob_to_summon)
                 target_player.in_play.append(mob_to_summon)
                 target_player.update_for_mob_changes_zones()
                 mob_to_summon.turn_played = target_player.game.turn   
         elif effect.target_type == "all_players" and effect.amount == -1:
-            mobs = []
-            for c in Card.all_card_objects():
-                if c.card_type == Constants.mobCardType:
-                    mobs.append(c)
+            mobs = self.catalog.cards_of_type(Constants.mobCardType)
             for p in effect_owner.game.players:
                 while len(p.in_play) < 7:
-                    mob_to_summon = copy.deepcopy(random.choice(mobs))
-                    mob_to_summon.id = self.game.next_card_id
+                    mob_to_summon = self.catalog.instantiate_info(effect_owner.game.rng.choice(mobs))
+                    mob_to_summon.id = effect_owner.game.next_card_id
                     effect_owner.game.next_card_id += 1
                     p.in_play.append(mob_to_summon)
                     p.update_for_mob_changes_zones()
@@ -1536,6 +1593,7 @@ class Card:
         else:
             return [f"Both players fill their boards."]
 
+    @effect_handler("summon_from_deck_artifact")
     def do_summon_from_deck_artifact_effect_on_player(self, effect_owner, effect, target_info):
         target_player = effect_owner
         if effect.target_type == "self" and effect.amount == 1:
@@ -1546,7 +1604,7 @@ class Card:
 
             if len(artifacts) > 0:
                 target_player = effect_owner
-                artifact_to_summon = random.choice(artifacts)
+                artifact_to_summon = effect_owner.game.rng.choice(artifacts)
                 target_player.deck.remove(artifact_to_summon)
                 target_player.play_artifact(artifact_to_summon)
                 target_player.update_for_mob_changes_zones()
@@ -1556,6 +1614,7 @@ class Card:
         
         print(f"unsupported target_type {effect.target_type} for summon_from_deck_artifact effect for {self.name}")
 
+    @effect_handler("summon_from_hand")
     def do_summon_from_hand_effect(self, effect_owner, effect, target_info):
         target_player = Card.player_for_username(effect_owner.game, target_info["id"])
         nonspells = []
@@ -1563,12 +1622,13 @@ class Card:
             if card.card_type != Constants.spellCardType:
                 nonspells.append(card)
         if len(nonspells) > 0:
-            to_summon = random.choice(nonspells)
+            to_summon = effect_owner.game.rng.choice(nonspells)
             target_player.hand.remove(to_summon)
             message = effect_owner.play_mob_or_artifact(to_summon, {"log_lines":[]}, do_effects=False)
             message["log_lines"].append(f"{to_summon.name} was summoned for {effect_owner.username}.")
             return message["log_lines"]
 
+    @effect_handler("switch_hit_points")
     def do_switch_hit_points_effect(self, effect_owner, effect, target_info):
         # effect_owner
         cp_hp = effect_owner.hit_points
@@ -1576,6 +1636,7 @@ class Card:
         effect_owner.game.opponent().hit_points = cp_hp
         return [f"{effect_owner.username} uses {self.name} to switch hit points with {effect_owner.game.opponent().username}."]
 
+    @effect_handler("shield")
     def do_shield_effect(self, effect_owner, effect, target_info):
         if not effect.enabled:
             return
@@ -1583,6 +1644,7 @@ class Card:
         damage = target_info["damage"]
         self.deal_damage(-damage)
 
+    @effect_handler("add_symbiotic_fast")
     def do_add_symbiotic_fast_effect(self, effect_owner, effect, target_info):
         anything_friendly_has_fast = False
         for e in effect_owner.in_play:
@@ -1613,6 +1675,7 @@ class Card:
         }        
 
     # todo fix that this doesn't check for an ID or something?
+    @effect_handler("remove_symbiotic_fast")
     def do_remove_symbiotic_fast_effect(self, effect_owner, effect, target_info):
         effects_to_remove = []
         for effect in self.effects:
@@ -1624,7 +1687,9 @@ class Card:
                 break 
         for effect in effects_to_remove:
             self.effects.remove(effect)
+        self.index_effects()
 
+    @effect_handler("set_token")
     def do_set_token_effect(self, effect_owner, effect, target_info):
         tokens_to_remove = []
         for t in self.tokens:
@@ -1650,6 +1715,7 @@ class Card:
             for mob in effect_owner.in_play:
                 mob.do_add_token_effect_on_mob(effect, effect_owner, mob, effect_owner)
 
+    @effect_handler("take_control")
     def do_take_control_effect(self, effect_owner, effect, target_info):
         # e, effect_owner, target_mob
         opponent = effect_owner.game.opponent()
@@ -1661,7 +1727,7 @@ class Card:
             log_lines = [f"{effect_owner.username} takes control everything."]
         elif effect.target_type == "enemy_mob_random": # song dragon
             if len(opponent.in_play) > 0:
-                mob_to_target = random.choice(opponent.in_play)
+                mob_to_target = effect_owner.game.rng.choice(opponent.in_play)
                 self.do_take_control_effect_on_mob(effect_owner, mob_to_target, opponent)
                 log_lines = [f"{effect_owner.username} takes control of {mob_to_target.name}."]
         else:
@@ -1684,7 +1750,7 @@ class Card:
         def_index = 0
         for e in target_mob.effects:
             if e.effect_type == "enter_play" and e.target_type == None:
-                self.resolve_effect(target_mob.enter_play_effect_defs[def_index], effect_owner, e, {}) 
+                target_mob.resolve_effect(target_mob.effect_def("enter_play", def_index), effect_owner, e, {}) 
                 def_index += 1
 
     def do_take_control_effect_on_artifact(self, effect_owner, target_artifact, controller):
@@ -1695,6 +1761,7 @@ class Card:
         target_artifact.turn_played = effect_owner.game.turn
         target_artifact.do_leaves_play_effects(controller, did_kill=False)
     
+    @effect_handler("take_extra_turn")
     def do_take_extra_turn_effect_on_player(self, effect_owner, effect, target_info):
         target_player = Card.player_for_username(effect_owner.game, target_info["id"])
         target_player.remove_temporary_tokens()
@@ -1705,6 +1772,7 @@ class Card:
         log_lines += message["log_lines"]
         return log_lines
 
+    @effect_handler("unwind")
     def do_unwind_effect(self, effect_owner, effect, target_info):
         if effect.target_type == "all_mobs":
             mobs_to_unwind = []
@@ -1835,7 +1903,7 @@ class Card:
     def has_stack_target(self, game):
         e = self.effects[0]
         for spell in game.stack:
-            card = Card(spell[1])
+            card = Card(spell[1], self.catalog)
             if spell[0]["move_type"] == "ATTACK":
                 continue
             if e.target_type == "being_cast":
@@ -1908,7 +1976,7 @@ class Card:
         return False
 
     def do_leaves_play_effects(self, player, did_kill=True):
-        for idx, effect_def in enumerate(self.leave_play_effect_defs):
+        for idx, (_, effect_def) in enumerate(self.effect_defs.get("leave_play", [])):
             target_info = {"id": player.username, "did_kill": did_kill}
             if self.effects_for_type("leave_play")[idx].target_type == "self":
                 target_info = {"id": player.username, "target_type": "player", "did_kill": did_kill}
@@ -1917,11 +1985,14 @@ class Card:
             self.resolve_effect(effect_def, player, self.effects_for_type("leave_play")[idx], target_info)
 
     def effects_for_type(self, effect_type):
+        if self._effects is None and effect_type in EFFECT_TYPES and effect_type not in self.effect_defs:
+            # the definition has no such effects, so don't build the card's effects to find that out
+            return []
         return [e for e in self.effects if e.effect_type == effect_type]
 
     def deal_damage_with_effects(self, amount, controller):
         for idx, effect in enumerate(self.effects_for_type("before_is_damaged")):
-            self.resolve_effect(self.before_is_damaged_effect_defs[idx], controller, effect, {"damage": amount})         
+            self.resolve_effect(self.effect_def("before_is_damaged", idx), controller, effect, {"damage": amount})         
         self.deal_damage(amount)
 
     def deal_damage(self, amount):
@@ -1931,140 +2002,23 @@ class Card:
 
 
 class CardEffect:
+
+    __slots__ = CARD_EFFECT_SCHEMA.slots()
+
     def __init__(self, info, effect_id):
         self.id_for_game = effect_id
-        # an integer to be used to size the effect
-        self.amount = info["amount"] if "amount" in info else None
-        # a string to be used to size the effect
-        self.amount_id = info["amount_id"] if "amount_id" in info else None
-        # a string that labels what the amount is of, i.e. damage, hit points, cards, etc
-        self.amount_name = info["amount_name"] if "amount_name" in info else None
-        # the highest amount for an effect that disadvantageously affects the player, such as letting opponent draw cards
-        # these limits prevent turning disadvantageous effects into advantageous ones
-        self.amount_disadvantage_limit = info["amount_disadvantage_limit"] if "amount_disadvantage_limit" in info else None
-        # the highest amount for an effect that advantageously affects the player, such as letting opponent draw cards
-        self.amount_limit = info["amount_limit"] if "amount_limit" in info else 10
-        self.disadvantage_target_types = info["disadvantage_target_types"] if "disadvantage_target_types" in info else []
-        # the cost in mana of the effect
-        self.cost = info["cost"] if "cost" in info else 0
-        # a one word description to maybe show on the card, but definitely show on hover
-        self.description = info["description"] if "description" in info else None
-        # a sentence description to show on hover
-        self.description_expanded = info["description_expanded"] if "description_expanded" in info else None
-        # whether or not to show self.description as text on the card, or just on hover if False
-        self.description_on_card = info["description_on_card"] if "description_on_card" in info else True
-        # used to determine when the effect triggers, such as on draw or after target selection
-        self.effect_type = info["effect_type"] if "effect_type" in info else None
-        # whether or not the effect is enabled and will trigger or can be activated
-        self.enabled = info["enabled"] if "enabled" in info else True
-        # this is set after an effect is used, so it can't be used again this turn
-        self.exhausted = info["exhausted"] if "exhausted" in info else False
-        # the id of the effect, which gets mapped to a def
-        self.id = info["id"] if "id" in info else None         
-        # the name of the effect
-        self.name = info["name"] if "name" in info else None         
-        # this effect can only occur once per card
-        self.one_per_card = info["one_per_card"] if "one_per_card" in info else False         
-        # the calculated strength of the effect
-        self.power_points = info["power_points"] if "power_points" in info else 0         
-        # a flag to set on the effect to trigger an animation on the next repaint
-        self.show_effect_animation = info["show_effect_animation"] if "show_effect_animation" in info else False
-        # the target type for the effect, such as mob, enemy, artifact, self, etc
-        self.target_type = info["target_type"] if "target_type" in info else None
-        # tokens that the effect adds
-        self.tokens = [CardToken(t) for t in info["tokens"]] if "tokens" in info else []
-        # info the UI needs to display or animate the effect
-        self.ui_info = info["ui_info"] if "ui_info" in info else None
-
-        # currently, only used for Resonant Frequency to set min_cost and max_cost for what gets killed
-        self.other_info = info["other_info"] if "other_info" in info else {}
-
-        # todo: move all of these below to other_info? only used sparsely
-        # the type of target the AI should prefer to play
-        self.ai_target_types = info["ai_target_types"] if "ai_target_types" in info else []
-        # only used for Tame Shop Demon
-        self.card_descriptions = info["card_descriptions"] if "card_descriptions" in info else []
-        # used for make_token and upgrade effects
-        self.card_names = info["card_names"] if "card_names" in info else []
-        # this gets used in resolve_effect so maybe leave to level
-        self.cost_hp = info["cost_hp"] if "cost_hp" in info else 0
-        # used for Lute and Akbar's Pan Pipes
-        self.counters = info["counters"] if "counters" in info else -1
-        # a list of affects added by the effect, use for cards like Hide and WInd of Mercury
-        self.effects = [CardEffect(e, idx) for idx, e in enumerate(info["effects"])] if "effects" in info else []
-        # only used for Lute
-        self.effect_to_activate = CardEffect(info["effect_to_activate"], info["effect_to_activate"]["id"] if "id" in info["effect_to_activate"] else 0) if "effect_to_activate" in info and info["effect_to_activate"] else None
-        # seems a little specific to make cards
-        self.make_type = info["make_type"] if "make_type" in info else None
-        # todo: move to other_info?
-        self.multiplier = info["multiplier"] if "multiplier" in info else None
-        # used for Mirror of Fate, Wish Stone, and Disk of Death
-        self.sacrifice_on_activate = info["sacrifice_on_activate"] if "sacrifice_on_activate" in info else False
+        self.hydrate(info)
 
     def __repr__(self):
         return f"{self.as_dict()}"
 
-    def as_dict(self, for_card_builder=False):
-        if for_card_builder:
-            return {
-                "ai_target_types": self.ai_target_types,
-                "amount": self.amount,
-                "amount_id": self.amount_id,
-                "amount_name": self.amount_name,
-                "amount_disadvantage_limit": self.amount_disadvantage_limit,
-                "amount_limit": self.amount_limit,
-                "cost": self.cost,
-                "description": self.description,
-                "description_expanded": self.description_expanded,
-                "disadvantage_target_types": self.disadvantage_target_types,
-                "effect_type": self.effect_type,
-                "id": self.id,
-                "name": self.name,
-                "one_per_card": self.one_per_card,
-                "power_points": self.power_points,
-                "target_type": self.target_type
-            }
-        return {
-            "ai_target_types": self.ai_target_types,
-            "amount": self.amount,
-            "amount_id": self.amount_id,
-            "amount_name": self.amount_name,
-            "card_descriptions": self.card_descriptions,
-            "card_names": self.card_names,
-            "counters": self.counters,
-            "cost": self.cost,
-            "cost_hp": self.cost_hp,
-            "description": self.description,
-            "description_expanded": self.description_expanded,
-            "description_on_card": self.description_on_card,
-            "effects": [e.as_dict() for e in self.effects] if self.effects else [],
-            "effect_to_activate": self.effect_to_activate.as_dict() if self.effect_to_activate else None,
-            "effect_type": self.effect_type,
-            "enabled": self.enabled,
-            "exhausted": self.exhausted,
-            "id": self.id,
-            "make_type": self.make_type,
-            "multiplier": self.multiplier,
-            "name": self.name,
-            "id_for_game": self.id_for_game,
-            "other_info": self.other_info,
-            "power_points": self.power_points,
-            "sacrifice_on_activate": self.sacrifice_on_activate,
-            "show_effect_animation": self.show_effect_animation,
-            "target_type": self.target_type,
-            "tokens": [t.as_dict() for t in self.tokens] if self.tokens else [],
-            "ui_info": self.ui_info,
-        }
-
 
 class CardToken:
+
+    __slots__ = CARD_TOKEN_SCHEMA.slots()
+
     def __init__(self, info):
-        self.strength_modifier = info["strength_modifier"] if "strength_modifier" in info else 0
-        self.set_can_act = info["set_can_act"] if "set_can_act" in info else None
-        self.hit_points_modifier = info["hit_points_modifier"] if "hit_points_modifier" in info else 0
-        self.turns = info["turns"] if "turns" in info else -1
-        self.multiplier = info["multiplier"] if "multiplier" in info else 0
-        self.id = info["id"] if "id" in info else None
+        self.hydrate(info)
 
     def __repr__(self):
         if self.set_can_act is not None:
@@ -2073,49 +2027,374 @@ class CardToken:
             return f"id: {self.id} - +{self.strength_modifier}/+{self.hit_points_modifier}"
         return f"+{self.strength_modifier}/+{self.hit_points_modifier}"
 
-    def as_dict(self):
-        return {
-            "strength_modifier": self.strength_modifier,
-            "set_can_act": self.set_can_act,
-            "hit_points_modifier": self.hit_points_modifier,
-            "turns": self.turns,
-            "multiplier": self.multiplier,
-            "id": self.id,
-        }
+
+CARD_SCHEMA.compile(Card, globals())
+CARD_SNAPSHOT_KEY = CARD_SCHEMA.snapshot_key()
+CARD_EFFECT_SCHEMA.compile(CardEffect, globals())
+CARD_TOKEN_SCHEMA.compile(CardToken, globals())
+
 
 def all_cards(require_images=False, include_tokens=True, include_old_cards=True):
     """
         Returns a list of all possible cards in the game. 
+
+        The list comes from the process-wide CardCatalog, so callers must not mutate the returned dicts.
     """
-    subset = []
-
-    if include_old_cards:
-        json_data = open('battle_wizard/game/battle_wizard_cards.json')
-        all_cards = json.load(json_data)
-        for c in all_cards:
-            if include_tokens or ("is_token" not in c or c["is_token"] == False):
-                if "image" in c or not require_images:
-                    subset.append(Card(c).as_dict())
-
-        json_data = open('battle_wizard/game/old_cards.json')
-        all_cards = json.load(json_data)
-        for c in all_cards:
-            if include_tokens or ("is_token" not in c or c["is_token"] == False):
-                if "image" in c or not require_images:
-                    subset.append(Card(c).as_dict())
-
-    json_data = open('create_cards/cards_and_effects.json')
-    cards_and_effects = json.load(json_data)
-    for c in cards_and_effects["cards"]:
-        if include_tokens or ("is_token" not in c or c["is_token"] == False):
-            if "image" in c or not require_images:
-                c["discipline"] = "magic"
-                subset.append(Card(c).as_dict())
-
-    custom_cards = CustomCard.objects.all().exclude(card_json__name__startswith="Unnamed")
-    for card in custom_cards:
-        card.card_json["discipline"] = "magic"
-        subset.append(Card(card.card_json).as_dict())
-
-    return subset
+    return CardCatalog.shared().cards(require_images=require_images, include_tokens=include_tokens, include_old_cards=include_old_cards)
 
+
+class CardCatalog:
+    """
+        A cache of every card definition from a CardSource, one per source.
+
+        The source's cards are read once per process, instead of on every all_cards() call, and the
+        resulting card dicts are indexed by name, card_type, cost, and discipline. The server's catalog
+        is for the shared CardSource, which reads the CustomCard table, and is invalidated whenever a
+        CustomCard is saved or deleted in this process, or reloaded once the source's version() changes.
+    """
+
+    # CardSource -> its CardCatalog
+    _catalogs = {}
+    _catalogs_lock = threading.Lock()
+
+    def __init__(self, card_source=None):
+        self.card_source = card_source if card_source else CardSource()
+        self.lock = threading.RLock()
+        self.loaded = False
+        # the source's version() when it was loaded, and when that was last checked
+        self.version = None
+        self.version_checked_at = None
+        # a list of (card_dict, is_old_card, is_token, has_image, is_custom) tuples, in all_cards() order
+        self.entries = []
+        self.variants = {}
+        self.by_name = {}
+        # id() of each card dict to its CardDefinition, card names to the definition by_name has, and content hashes to definitions
+        self.definitions = {}
+        self.definitions_by_name = {}
+        self.definitions_by_hash = {}
+        # content hashes to the definitions saved games were made on, which may since have changed, see definition_for(),
+        # least recently used first, and at most the source's saved_definitions_limit of them
+        self.saved_definitions = collections.OrderedDict()
+        self.by_type = {}
+        self.by_cost = {}
+        self.by_discipline = {}
+        self.by_effect_id = {}
+        self.published_variants = {}
+
+    @staticmethod
+    def shared():
+        """
+            Returns the catalog shared by everything in this process, for CardSource.shared().
+        """
+        return CardCatalog.for_source(CardSource.shared())
+
+    @staticmethod
+    def for_source(card_source):
+        """
+            Returns the catalog for card_source, or the shared catalog if card_source is None.
+        """
+        if card_source is None:
+            return CardCatalog.shared()
+        catalog = CardCatalog._catalogs.get(card_source)
+        if catalog is None:
+            with CardCatalog._catalogs_lock:
+                catalog = CardCatalog._catalogs.get(card_source)
+                if catalog is None:
+                    catalog = CardCatalog._catalogs[card_source] = CardCatalog(card_source)
+        return catalog
+
+    def invalidate(self):
+        """
+            Drops the cached cards, so they get re-read on next use.
+        """
+        with self.lock:
+            self.loaded = False
+            self.entries = []
+            self.variants = {}
+            self.by_name = {}
+            self.definitions = {}
+            self.definitions_by_name = {}
+            self.definitions_by_hash = {}
+            self.by_type = {}
+            self.by_cost = {}
+            self.by_discipline = {}
+            self.by_effect_id = {}
+            self.published_variants = {}
+
+    def version_is_due(self):
+        seconds = self.card_source.version_seconds
+        return seconds is not None and time.monotonic() - self.version_checked_at >= seconds
+
+    def check_version(self):
+        """
+            Drops the cached cards if the source's version() changed since they were loaded, and returns whether it did.
+        """
+        with self.lock:
+            if not self.loaded:
+                return False
+            self.version_checked_at = time.monotonic()
+            if self.card_source.version() == self.version:
+                return False
+            # the cards were changed by another process
+            self.invalidate()
+            return True
+
+    def load(self):
+        if self.loaded and not self.version_is_due():
+            return
+        with self.lock:
+            if self.loaded and self.version_is_due():
+                self.check_version()
+            if self.loaded:
+                return
+            # read before the cards, so a change made while they're read gets noticed by the next check
+            version = self.card_source.version()
+            entries = []
+            for c, is_old_card, is_custom in self.card_source.card_infos():
+                entries.append(self.entry_for_info(c, is_old_card=is_old_card, is_custom=is_custom))
+
+            by_name, by_type, by_cost, by_discipline, by_effect_id = {}, {}, {}, {}, {}
+            definitions, definitions_by_name, definitions_by_hash = {}, {}, {}
+            for entry in entries:
+                card_info = entry[0]
+                definitions[id(card_info)] = CardDefinition(card_info)
+                # report effects that can't resolve now, instead of when they come up in a game
+                for effect_id in unsupported_effect_ids(card_info):
+                    print(f"UNSUPPORTED EFFECT ID: {effect_id} on {card_info['name']}")
+                # later cards win, same as the old linear scans over all_cards()
+                by_name[card_info["name"]] = card_info
+                definitions_by_name[card_info["name"]] = definitions[id(card_info)]
+                definitions_by_hash[definitions[id(card_info)].content_hash] = definitions[id(card_info)]
+                by_type.setdefault(card_info["card_type"], []).append(card_info)
+                by_cost.setdefault(card_info["cost"], []).append(card_info)
+                by_discipline.setdefault(card_info["discipline"], []).append(card_info)
+                for effect_id in set([e["id"] for e in card_info["effects"]]):
+                    by_effect_id.setdefault(effect_id, []).append(card_info)
+
+            self.entries = entries
+            self.variants = {}
+            self.by_name = by_name
+            self.definitions = definitions
+            self.definitions_by_name = definitions_by_name
+            self.definitions_by_hash = definitions_by_hash
+            self.by_type = by_type
+            self.by_cost = by_cost
+            self.by_discipline = by_discipline
+            self.by_effect_id = by_effect_id
+            self.published_variants = {}
+            self.version = version
+            self.version_checked_at = time.monotonic()
+            self.loaded = True
+
+    def entry_for_info(self, info, is_old_card=False, is_custom=False):
+        is_token = "is_token" in info and info["is_token"] != False
+        return (Card(info, self).as_dict(), is_old_card, is_token, "image" in info, is_custom)
+
+    def cards(self, require_images=False, include_tokens=True, include_old_cards=True):
+        """
+            Returns the card dicts for the given all_cards() options, computed once per set of options.
+        """
+        self.load()
+        key = (require_images, include_tokens, include_old_cards)
+        with self.lock:
+            if key not in self.variants:
+                subset = []
+                for card_info, is_old_card, is_token, has_image, is_custom in self.entries:
+                    # custom cards were never filtered by all_cards()
+                    if not is_custom:
+                        if is_old_card and not include_old_cards:
+                            continue
+                        if is_token and not include_tokens:
+                            continue
+                        if require_images and not has_image:
+                            continue
+                    subset.append(card_info)
+                self.variants[key] = subset
+            return self.variants[key]
+
+    def published(self, require_images=False, include_tokens=True, include_old_cards=True):
+        """
+            Returns the PublishedCards for the given all_cards() options, serialized and compressed once per catalog load.
+        """
+        cards = self.cards(require_images=require_images, include_tokens=include_tokens, include_old_cards=include_old_cards)
+        key = (require_images, include_tokens, include_old_cards)
+        with self.lock:
+            if key not in self.published_variants:
+                self.published_variants[key] = PublishedCards(cards)
+            return self.published_variants[key]
+
+    def published_for_hash(self, cards_hash):
+        """
+            Returns the PublishedCards variant with the given hash, or None if no current variant has it.
+
+            A hash can come from another process whose catalog already has cards this one hasn't loaded,
+            so an unknown hash makes the catalog check its version, and look again if the cards changed.
+        """
+        published = self.current_published_for_hash(cards_hash)
+        if published is None and self.check_version():
+            published = self.current_published_for_hash(cards_hash)
+        return published
+
+    def current_published_for_hash(self, cards_hash):
+        for require_images in [False, True]:
+            for include_tokens in [False, True]:
+                for include_old_cards in [False, True]:
+                    published = self.published(require_images=require_images, include_tokens=include_tokens, include_old_cards=include_old_cards)
+                    if published.cards_hash == cards_hash:
+                        return published
+        return None
+
+    def card_named(self, name):
+        self.load()
+        return self.by_name.get(name)
+
+    def definition_named(self, name):
+        self.load()
+        return self.definitions_by_name.get(name)
+
+    def definition_for(self, name, content_hash=None):
+        """
+            Returns the definition an overlay was made on: the card named name, if it still has content_hash,
+            or else the definition with content_hash that a saved game brought along, or None.
+
+            Overlays saved before they had a content_hash get the card named name.
+        """
+        definition = self.definition_named(name)
+        if content_hash is None or (definition is not None and definition.content_hash == content_hash):
+            return definition
+        return self.definition_with_hash(content_hash)
+
+    def definition_with_hash(self, content_hash):
+        self.load()
+        definition = self.definitions_by_hash.get(content_hash)
+        if definition:
+            return definition
+        with self.lock:
+            definition = self.saved_definitions.get(content_hash)
+            if definition:
+                self.saved_definitions.move_to_end(content_hash)
+            return definition
+
+    def add_saved_definitions(self, definition_infos):
+        """
+            Keeps the definitions from a saved game's "definitions", a dict of content hashes to card dicts,
+            so its overlays still load the same after their cards change or get deleted.
+
+            The cards made from a definition keep it, so dropping the least recently used ones past the
+            source's saved_definitions_limit only costs the games loaded after that the parsing of them again.
+        """
+        with self.lock:
+            for content_hash, info in definition_infos.items():
+                if content_hash in self.saved_definitions:
+                    self.saved_definitions.move_to_end(content_hash)
+                else:
+                    self.saved_definitions[content_hash] = CardDefinition(info)
+            while len(self.saved_definitions) > self.card_source.saved_definitions_limit:
+                self.saved_definitions.popitem(last=False)
+
+    def cards_of_type(self, card_type):
+        self.load()
+        return self.by_type.get(card_type, [])
+
+    def cards_with_cost(self, cost):
+        self.load()
+        return self.by_cost.get(cost, [])
+
+    def cards_in_discipline(self, discipline):
+        self.load()
+        return self.by_discipline.get(discipline, [])
+
+    def cards_with_effect(self, effect_id):
+        self.load()
+        return self.by_effect_id.get(effect_id, [])
+
+    def instantiate(self, name, card_id=-1, owner_username=None):
+        """
+            Returns a new Card for the named card, or None if there is no such card.
+
+            The Card shares the card's CardDefinition, so only its id and owner are set up per instance.
+        """
+        card_info = self.card_named(name)
+        if card_info is None:
+            print(f"Error: no card named {name} in the card catalog")
+            return None
+        return self.instantiate_info(card_info, card_id, owner_username)
+
+    def instantiate_info(self, card_info, card_id=-1, owner_username=None):
+        """
+            Returns a new Card for one of the catalog's card dicts.
+        """
+        self.load()
+        definition = self.definitions.get(id(card_info))
+        if definition is None:
+            # not one of the catalog's own dicts
+            card = Card(copy_card_info(card_info), self)
+            card.id = card_id
+            card.owner_username = owner_username
+            return card
+        return Card.from_definition(definition, self, card_id, owner_username)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        # copies of a Game or Card keep using the same catalog
+        return self
+
+
+class CardDefinition:
+    """
+        The immutable part of a card, shared by every Card made from the same catalog dict.
+
+        info is the catalog's full card dict, and effect_defs is the index of its effects, which Cards
+        use as is until they change their effects. Nothing may mutate either. content_hash identifies
+        info, so an overlay saved on this definition isn't loaded onto a changed card with the same name.
+    """
+
+    __slots__ = ("info", "effect_defs", "content_hash")
+
+    def __init__(self, info):
+        self.info = info
+        self.content_hash = hashlib.sha256(json.dumps(info, sort_keys=True).encode("utf-8")).hexdigest()[:20]
+        effect_defs = {}
+        for effect_index, effect in enumerate(info["effects"]):
+            if effect["effect_type"] in EFFECT_TYPES:
+                effect_defs.setdefault(effect["effect_type"], []).append((effect_index, EFFECT_HANDLERS.get(effect["id"])))
+        self.effect_defs = effect_defs
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        # definitions are shared, so copies of a Game or Card keep pointing at the same one
+        return self
+
+    def __repr__(self):
+        return f"CardDefinition({self.info['name']})"
+
+
+class PublishedCards:
+    """
+        One all_cards() variant, pre-serialized and pre-compressed for the /cards/<hash>.json endpoint.
+
+        Cards are sorted by cost, card_type, and name, the order the deck views show them in.
+        The hash is of the JSON body, so it changes whenever the cards do.
+    """
+
+    def __init__(self, cards):
+        cards = sorted(cards, key = lambda i: (i['cost'], i['card_type'], i['name']))
+        self.json_bytes = json.dumps(cards).encode("utf-8")
+        self.cards_hash = hashlib.sha256(self.json_bytes).hexdigest()[:20]
+        self.gzip_bytes = gzip.compress(self.json_bytes, compresslevel=9, mtime=0)
+        self.brotli_bytes = brotli.compress(self.json_bytes) if brotli else None
+
+
+def copy_card_info(info):
+    """
+        Copies a card dict made of plain JSON values, without the memo bookkeeping of copy.deepcopy.
+    """
+    if type(info) is dict:
+        return {key: copy_card_info(value) for key, value in info.items()}
+    if type(info) is list:
+        return [copy_card_info(value) for value in info]
+    return info
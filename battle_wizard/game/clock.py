@@ -0,0 +1,109 @@
+import asyncio
+import datetime
+import time
+
+from battle_wizard.game.frames import FRAME_ENCODING
+from battle_wizard.game.frames import encode_frame
+from django.conf import settings
+
+
+class TurnClock:
+    """
+        Pushes a live game's turn clock to its room, from a task on the server's event loop.
+
+        The clock is checked every tick_seconds, and the room gets the time the current turn has taken
+        when the turn changes, when the rope starts for the turn's last rope_seconds, and every
+        rope_tick_seconds during the rope, which is all the clients show. Once a turn has taken
+        max_turn_seconds, the room gets a turn_timeout event, and the first consumer to claim it ends
+        the turn. The clients used to poll for this with GET_TIME.
+    """
+
+    def __init__(self, game, max_turn_seconds=None, rope_seconds=None, tick_seconds=None, rope_tick_seconds=None):
+        self.game = game
+        self.max_turn_seconds = max_turn_seconds if max_turn_seconds is not None else getattr(settings, "GAME_MAX_TURN_SECONDS", 60)
+        self.rope_seconds = rope_seconds if rope_seconds is not None else getattr(settings, "GAME_ROPE_SECONDS", 10)
+        self.tick_seconds = tick_seconds if tick_seconds is not None else getattr(settings, "GAME_CLOCK_TICK_SECONDS", 0.5)
+        self.rope_tick_seconds = rope_tick_seconds if rope_tick_seconds is not None else getattr(settings, "GAME_ROPE_TICK_SECONDS", 1)
+        self.task = None
+        self.loop = None
+        # the last turn a turn_timeout was sent for, and the last one a consumer claimed
+        self.timed_out_turn = None
+        self.claimed_turn = None
+        # the last tick pushed to the room, and when
+        self.pushed_tick = None
+        self.pushed_at = None
+        self.pushes = 0
+
+    def tick(self):
+        """
+            Returns the clock as sent to the room, which is also the answer to GET_TIME.
+        """
+        turn_time = (datetime.datetime.now() - self.game.turn_start_time).total_seconds()
+        return {
+            "turn": self.game.turn,
+            "turn_time": int(turn_time),
+            "max_turn_time": self.max_turn_seconds,
+            "show_rope": turn_time >= self.max_turn_seconds - self.rope_seconds,
+        }
+
+    def push_is_due(self, tick, now):
+        """
+            Returns True if the turn changed or the rope started since the last push, or the rope has shown for rope_tick_seconds since.
+        """
+        if self.pushed_tick is None or tick["turn"] != self.pushed_tick["turn"] or tick["show_rope"] != self.pushed_tick["show_rope"]:
+            return True
+        return tick["show_rope"] and now - self.pushed_at >= self.rope_tick_seconds
+
+    async def start(self, channel_layer, room_group_name):
+        """
+            Starts pushing the clock to room_group_name, unless it's already running or turned off.
+        """
+        if self.task is not None or not self.max_turn_seconds:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.task = self.loop.create_task(self.run(channel_layer, room_group_name))
+
+    def stop(self):
+        """
+            Stops the clock, from any thread.
+        """
+        if self.task is None:
+            return
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.task.cancel)
+        self.task = None
+
+    async def run(self, channel_layer, room_group_name):
+        try:
+            while True:
+                await asyncio.sleep(self.tick_seconds)
+                tick = self.tick()
+                now = time.monotonic()
+                if self.push_is_due(tick, now):
+                    self.pushed_tick = tick
+                    self.pushed_at = now
+                    self.pushes += 1
+                    await channel_layer.group_send(room_group_name, {
+                        'type': 'clock_tick',
+                        'frame': encode_frame(tick),
+                        'frames': None,
+                        'encoding': FRAME_ENCODING,
+                    })
+                if tick["turn_time"] >= self.max_turn_seconds and self.timed_out_turn != tick["turn"]:
+                    self.timed_out_turn = tick["turn"]
+                    await channel_layer.group_send(room_group_name, {'type': 'turn_timeout', 'turn': tick["turn"]})
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"Error running the turn clock: {e}")
+
+    def claim_timeout(self, turn):
+        """
+            Returns True for the first consumer to handle a turn_timeout for turn, which gets to end the turn.
+
+            Call this with the session's lock held.
+        """
+        if self.claimed_turn == turn or self.game.turn != turn:
+            return False
+        self.claimed_turn = turn
+        return True
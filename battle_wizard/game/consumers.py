@@ -1,136 +1,283 @@
+import asyncio
 import datetime
 import json
 import copy
-import os
 import random
 import time
 
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import WebsocketConsumer
-from battle_wizard.game.card import all_cards
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from battle_wizard.game.affinity import RoomAffinity
+from battle_wizard.game.card import CardCatalog
 from battle_wizard.game.data import hash_for_deck
-from battle_wizard.game.game import Game
-from battle_wizard.models import GameRecord
+from battle_wizard.game.engine_pool import run_in_engine
+from battle_wizard.game.frames import FRAME_ENCODING
+from battle_wizard.game.frames import encode_frame
+from battle_wizard.game.frames import frame_text
+from battle_wizard.game.matchmaking import MatchQueue
+from battle_wizard.game.projection import project_game
+from battle_wizard.game.rating import rate_game
+from battle_wizard.game.rating import rating_for_username
+from battle_wizard.game.projection import viewer_key
+from battle_wizard.game.replay import GameReplay
+from battle_wizard.game.session import GameSessions
 from battle_wizard.models import GlobalDeck
 from deckzap.settings import DEBUG
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist
 
-class BattleWizardMatchFinderConsumer(WebsocketConsumer):
+class BattleWizardMatchFinderConsumer(AsyncWebsocketConsumer):
+    """
+        A client waiting for a pvp match, through the MatchQueue, which pairs players by rating.
 
-    def connect(self):
-        print(f"Connected to Match Finder")
-        self.room_group_name = 'match_finder'
+        While the player is queued, the consumer checks in with the queue every third of its
+        expiry_seconds, so the queue only drops players whose consumer went away without disconnecting.
+        The first consumer to connect starts the queue's sweeps, which pair players whose rating windows
+        have widened while they waited. A match is only sent to its two players, at the channel_name each
+        queued from, so announcing it costs the same however many players are waiting.
+    """
 
-        async_to_sync(self.channel_layer.group_add)(
-            self.room_group_name,
-            self.channel_name
-        )
-        self.accept()
-
-    def disconnect(self, close_code):
-        queue_database = self.queue_database()
-        if self.username in queue_database["pvp"]["waiting_players"]:
-            queue_database["pvp"]["waiting_players"].remove(self.username)
-            with open("database/queue_database.json", 'w') as outfile:
-                json.dump(queue_database, outfile)
+    async def connect(self):
+        print(f"Connected to Match Finder")
+        self.username = None
+        # touches the player's queue entry while they wait
+        self.keepalive = None
+
+        await self.accept()
+        await MatchQueue.shared().start(self.announce_match)
+
+    async def disconnect(self, close_code):
+        if self.keepalive is not None:
+            self.keepalive.cancel()
+        if self.username is not None:
+            await database_sync_to_async(MatchQueue.shared().dequeue)(self.username, self.channel_name)
         print("Disconnected from Match Finder")
-        async_to_sync(self.channel_layer.group_discard)(
-            self.room_group_name,
-            self.channel_name
-        )
 
-    def receive(self, text_data):
+    async def receive(self, text_data):
         message = json.loads(text_data)
 
         self.username = message["username"]
 
-        queue_database = self.queue_database()
-        if not self.username in queue_database["pvp"]["waiting_players"]:
-            queue_database["pvp"]["waiting_players"].append(self.username)
-            with open("database/queue_database.json", 'w') as outfile:
-                json.dump(queue_database, outfile)
-
-        if len(queue_database["pvp"]["waiting_players"]) == 2:
-            game_record = GameRecord.objects.create(date_created=datetime.datetime.now())
-            game_record.save()
-            game_record_id = game_record.id
-            async_to_sync(self.channel_layer.group_send)(
-                self.room_group_name,
+        # shielded, so a client that disconnects while its player is paired doesn't take the Match,
+        # and the opponent's start_match, down with its consumer
+        matches = await asyncio.shield(self.join_and_announce())
+        if not matches:
+            print("waiting for match")
+            if self.keepalive is None:
+                self.keepalive = asyncio.get_running_loop().create_task(self.keep_queued())
+
+    async def join_and_announce(self):
+        # not on the thread the consumers' other database calls share, since a DatabaseMatchQueue's enqueue
+        # waits for its batch, and the joins waiting alongside it have to get into the same batch
+        matches = await database_sync_to_async(self.join_queue, thread_sensitive=False)()
+        for match in matches:
+            await self.announce_match(match)
+        return matches
+
+    def join_queue(self):
+        """
+            Adds this consumer's player to the queue at their rating, and returns the Matches that made.
+        """
+        return MatchQueue.shared().enqueue(self.username, self.channel_name, rating_for_username(self.username))
+
+    async def announce_match(self, match):
+        """
+            Sends start_match to the two players' channels, each with the seat they play from.
+        """
+        for seat, player in enumerate(match.players):
+            await self.channel_layer.send(
+                player.channel_name,
                 {
                     'type': 'matchfinder_message',
-                    'message': {"message_type": "start_match", "game_record_id": game_record_id}
+                    'frame': encode_frame({"message_type": "start_match", "game_record_id": match.game_record_id, "seat": seat}),
+                    'encoding': FRAME_ENCODING,
                 }
             )
-            queue_database["pvp"]["waiting_players"] = []
-            with open("database/queue_database.json", 'w') as outfile:
-                json.dump(queue_database, outfile)
-        else:
-            print("waiting for match")
 
-    def queue_database(self):
-        os.makedirs('database', exist_ok=True)
-        try:
-            json_data = open("database/queue_database.json")
-            queue_database = json.load(json_data)
-        except:
-            queue_database = {"pvp": {"waiting_players":[]}}
-        return queue_database
-
-    def matchfinder_message(self, event):
-        message = event['message']
-
-        # Send message to WebSocket
-        self.send(text_data=json.dumps({
-            'payload': message
-        }))
-
-
-class BattleWizardConsumer(WebsocketConsumer):
-
-    def connect(self):
+    async def keep_queued(self):
+        queue = MatchQueue.shared()
+        while True:
+            await asyncio.sleep(queue.expiry_seconds / 3)
+            if not await database_sync_to_async(queue.touch)(self.username, self.channel_name):
+                # matched, or enqueued again from another connection
+                self.keepalive = None
+                return
+
+    async def matchfinder_message(self, event):
+        # the frame was encoded by the sender, for this consumer's player
+        text = frame_text(event['frame'], event['encoding'])
+        if text is not None:
+            # Send message to WebSocket
+            await self.send(text_data=text)
+
+
+class BattleWizardConsumer(AsyncWebsocketConsumer):
+    """
+        A client's connection to a game room.
+
+        The consumer runs on the event loop, so it only takes a thread while it works: the engine work
+        is submitted to the session's RoomActor, which runs it on the EnginePool in order with the other
+        consumers' moves, and the database work runs through database_sync_to_async. What the engine work
+        sends, and the database work it leaves, is queued in the outbox, which the actor sends in order.
+    """
+
+    async def connect(self):
         self.player_type = self.scope['url_route']['kwargs']['player_type']
         self.ai = self.scope['url_route']['kwargs']['ai'] if 'ai' in self.scope['url_route']['kwargs'] else None
         self.game_record_id = self.scope['url_route']['kwargs']['game_record_id']
         self.room_group_name = 'room_%s' % self.game_record_id
         self.game = None
+        self.session = None
+        # the player this consumer's client sees the game as, from its first message and the logged in user, or "" for spectators
+        self.username = None
         self.moves = []
         self.is_reviewing = False
         self.decks = [[], []]
+        # (kind, value) pairs for send_outbox(), left by the engine work
+        self.outbox = []
+        # set once the client is sent to another worker, after which its messages are dropped
+        self.redirected = False
+        # runs the AI of a pvai game every GAME_AI_MOVE_SECONDS
+        self.ai_timer = None
+
+        affinity = RoomAffinity.shared()
+        await affinity.start(self.channel_layer)
+        owner = await affinity.owner(self.game_record_id)
+        if owner != affinity.worker_id:
+            # the room's live session is on another worker
+            await self.accept()
+            await self.redirect(owner)
+            return
 
-        async_to_sync(self.channel_layer.group_add)(
+        await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
-        self.accept()
+        await self.accept()
 
-    def disconnect(self, close_code):
+    async def disconnect(self, close_code):
         print("Disconnected")
-        async_to_sync(self.channel_layer.group_discard)(
+        if self.ai_timer is not None:
+            self.ai_timer.cancel()
+            self.ai_timer = None
+        if self.session:
+            await run_in_engine(self.leave_session)
+            self.session = None
+        await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
 
-    def receive(self, text_data):
-        message = json.loads(text_data)
-
-        if message["move_type"] == 'NAVIGATE_GAME':
-            message["log_lines"] = []
-            message = self.navigate_game(message)
-            self.send_game_message(self.game.as_dict(), message)
+    async def redirect(self, worker_id):
+        """
+            Sends the client to the worker that owns the room, and closes the connection.
+        """
+        self.redirected = True
+        url = await RoomAffinity.shared().url(worker_id)
+        await self.send(text_data=frame_text(encode_frame({"move_type": "REDIRECT", "url": url}), FRAME_ENCODING))
+        await self.close()
+
+    def leave_session(self):
+        with self.session.lock:
+            # so the GameWriter's last save of the session isn't dropped for a conflict
+            self.session.reload_if_stale()
+            if self.username is not None:
+                self.session.remove_viewer(self.username)
+        GameSessions.shared().close(self.session)
+
+    async def receive(self, text_data):
+        if self.redirected:
             return
+        message = json.loads(text_data)
 
         if message["move_type"] == 'NEXT_ROOM':
             self.send_game_message(None, message)
+            await self.send_outbox()
             return
 
-        game_object = GameRecord.objects.get(id=self.game_record_id)
+        if not self.session:
+            self.session = await database_sync_to_async(GameSessions.shared().open)(self.game_record_id, self.player_type, self.decks)
+            if self.player_type == "pvai":
+                self.ai_timer = asyncio.get_running_loop().create_task(self.pace_ai())
 
-        info = game_object.game_json
-        info["game_record_id"] = self.game_record_id
-
-        self.game = Game(self.player_type, info=info, player_decks=self.decks)
+        if message["move_type"] == 'GET_TIME' and self.username is not None:
+            # the clock gets pushed by the session's TurnClock, this is for clients that still poll for it
+            await self.send(text_data=frame_text(encode_frame(self.session.clock.tick()), FRAME_ENCODING))
+            return
 
+        await self.session.actor.submit(self, self.handle_message, message)
+
+    def handle_message(self, message):
+        """
+            Handles a message from the client or the AI, on the EnginePool.
+        """
+        with self.session.lock:
+            if self.session.handing_over:
+                print(f"{message['username']} can't {message['move_type']} while the game moves to another worker")
+                return
+            if self.username is None:
+                # only the first message is surely from the client, the AI's moves come through here too
+                self.username = self.viewer_username(message["username"])
+                self.session.add_viewer(self.username)
+                # after a handover, the game's new worker starts its clock when the clients reconnect
+                self.start_clock_if_playing()
+            if message["move_type"] == 'GET_SNAPSHOT':
+                self.send_snapshot()
+                return
+            if message["move_type"] == 'GET_TIME':
+                self.outbox.append(("client", frame_text(encode_frame(self.session.clock.tick()), FRAME_ENCODING)))
+                return
+            if message["move_type"] == 'NAVIGATE_GAME':
+                self.game = self.session.game
+                message["log_lines"] = []
+                message = self.navigate_game(message)
+                self.send_game_message(self.game.snapshot().full, message)
+                return
+            return self.play_move(message)
+
+    def viewer_username(self, claimed_username):
+        """
+            Returns the username the client sees the game as: the logged in user's, if that's who the client
+            claims to be, or "" for spectators, so a client can't see another player's hand by claiming their name.
+        """
+        user = self.scope.get("user")
+        if user is not None and user.is_authenticated and user.username == claimed_username:
+            return claimed_username
+        return ""
+
+    def play_ai_move(self, message):
+        """
+            Plays a move chosen by the AI, which runs on the EnginePool with the session's lock held.
+        """
+        self.handle_message(message)
+
+    async def send_outbox(self):
+        """
+            Sends what was queued in the outbox outside of the RoomActor, such as NEXT_ROOM.
+        """
+        outbox = self.outbox
+        self.outbox = []
+        for kind, value in outbox:
+            await self.send_outbox_item(kind, value)
+
+    async def send_outbox_item(self, kind, value):
+        if kind == "group":
+            await self.channel_layer.group_send(self.room_group_name, value)
+        elif kind == "client":
+            await self.send(text_data=value)
+        elif kind == "game_started":
+            await database_sync_to_async(self.save_to_database)(value)
+        elif kind == "game_over":
+            await database_sync_to_async(self.save_winner)(value)
+        elif kind == "start_clock":
+            await self.session.clock.start(self.channel_layer, self.room_group_name)
+
+    def play_move(self, message):
+        game_object = self.session.game_record
+        self.game = self.session.game
+
+        move_type = message["move_type"]
         message["log_lines"] = []
         save = message["move_type"] not in [
             "ATTACK",
@@ -148,63 +295,133 @@ class BattleWizardConsumer(WebsocketConsumer):
 
             if len(self.game.players) == 2:
                 if not self.is_reviewing:
-                    self.save_to_database(game_object)
+                    self.outbox.append(("game_started", game_object))
 
+        game_over = False
         if len(self.game.players) == 2 and not self.is_reviewing:
             if self.game.players[0].hit_points <= 0 or self.game.players[1].hit_points <= 0:
+                game_over = True
                 game_object.date_finished = datetime.datetime.now()
+                winner_username = None
                 if self.game.players[0].hit_points <= 0 and self.game.players[1].hit_points >= 0:
-                    game_object.winner = User.objects.get(username=self.game.players[1].username)
+                    winner_username = self.game.players[1].username
                 elif self.game.players[1].hit_points <= 0 and self.game.players[0].hit_points >= 0:
-                    game_object.winner = User.objects.get(username=self.game.players[0].username)
+                    winner_username = self.game.players[0].username
+                self.outbox.append(("game_over", winner_username))
 
-        game_object.game_json = self.game.as_dict()
-        game_object.save()
+        # the GameWriter saves the game in the background, right away if it just started, and save_winner saves it when it ends
+        game_started = move_type == "JOIN" and len(self.game.players) == 2
+        GameSessions.shared().writer.mark_dirty(self.session, flush=game_started)
+
+        if game_over:
+            self.session.clock.stop()
+        else:
+            self.start_clock_if_playing()
 
         if message:
-            self.send_game_message(self.game.as_dict(), message)
-            # if there is no move_type, it's a GET_TIME
-            if "move_type" not in message and not self.is_reviewing:
-                if self.player_type == "pvai":
-                    self.game.players[1].maybe_run_ai(self)
+            # the GameWriter saves the same snapshot, so the move's game gets serialized once
+            self.send_game_message(self.game.snapshot().full, message)
 
         return message
 
+    def start_clock_if_playing(self):
+        game = self.session.game
+        if len(game.players) == 2 and not self.is_reviewing and self.session.clock.task is None:
+            if game.players[0].hit_points > 0 and game.players[1].hit_points > 0:
+                self.outbox.append(("start_clock", None))
+
     def save_to_database(self, game_record):
-        game_record.date_started = datetime.datetime.now()
-        game_record.player_one = User.objects.get(username=self.game.players[0].username)
+        """
+            Sets who's playing the game that just started, and has the GameWriter save it.
+        """
+        player_one = User.objects.get(username=self.game.players[0].username)
         try:
-            game_record.player_two = User.objects.get(username=self.game.players[1].username)
+            player_two = User.objects.get(username=self.game.players[1].username)
         except ObjectDoesNotExist:
-            game_record.player_two = User.objects.create(username=self.game.players[1].username)
-            game_record.player_two.save()
-        game_record.player_one_deck = GlobalDeck.objects.get(cards_hash=hash_for_deck(self.game.players[0].deck_for_id_or_url(self.game.players[0].deck_id)))
-        game_record.player_two_deck = GlobalDeck.objects.get(cards_hash=hash_for_deck(self.game.players[1].deck_for_id_or_url(self.game.players[1].deck_id)))
-        game_record.save()
+            player_two = User.objects.create(username=self.game.players[1].username)
+            player_two.save()
+        player_one_deck = GlobalDeck.objects.get(cards_hash=hash_for_deck(self.game.players[0].deck_for_id_or_url(self.game.players[0].deck_id)))
+        player_two_deck = GlobalDeck.objects.get(cards_hash=hash_for_deck(self.game.players[1].deck_for_id_or_url(self.game.players[1].deck_id)))
+        # the session's GameRecord, since it's replaced if the session gets reloaded
+        with self.session.lock:
+            game_record = self.session.game_record
+            game_record.date_started = datetime.datetime.now()
+            game_record.player_one = player_one
+            game_record.player_two = player_two
+            game_record.player_one_deck = player_one_deck
+            game_record.player_two_deck = player_two_deck
+            # the GameWriter saves it with the game_json, checking its state_version
+            GameSessions.shared().writer.mark_dirty(self.session, flush=True)
+
+    def save_winner(self, winner_username):
+        """
+            Sets the winner of the game that just ended, has the GameWriter save it, and updates the players' ratings for a pvp game.
+        """
+        winner = User.objects.get(username=winner_username) if winner_username else None
+        with self.session.lock:
+            game_record = self.session.game_record
+            game_record.winner = winner
+            GameSessions.shared().writer.mark_dirty(self.session, flush=True)
+        if self.player_type == "pvp":
+            rate_game(game_record.id, game_record.player_one_id, game_record.player_two_id, game_record.winner_id)
 
     def send_game_message(self, game_dict, message):
         # send current-game-related message to players
-        if DEBUG and message and message["move_type"] != "GET_TIME":
+        if DEBUG and message:
             self.print_move(message)
         if message["move_type"] == "JOIN" and len(game_dict["players"]) == 1:
-            message[ "all_cards"] = json.dumps(all_cards())
+            message["all_cards_hash"] = CardCatalog.shared().published().cards_hash
         
-        if message["move_type"] == "GET_TIME":
-            if "game" in message:
-                del message["game"]
-            del message["move_type"]
-            del message["log_lines"]
-            del message["username"]
+        if game_dict is None:
+            message["game"] = None
+
+        # each frame is encoded once here, rather than once per consumer in the room
+        frame = None
+        frames = None
+        if game_dict is not None:
+            frames = {key: encode_frame(viewer_message) for key, viewer_message in self.projected_messages(game_dict, message).items()}
         else:
-            message["game"] = game_dict
+            frame = encode_frame(message)
 
-        async_to_sync(self.channel_layer.group_send)(
-            self.room_group_name,
-            {
-                'type': 'game_message',
-                'message': message
-            }
-        )
+        self.outbox.append(("group", {
+            'type': 'game_message',
+            'frame': frame,
+            'frames': frames,
+            'encoding': FRAME_ENCODING,
+        }))
+
+    def projected_messages(self, game_dict, message):
+        """
+            Returns a copy of message for each viewer_key in the room, with that viewer's projection of game_dict.
+
+            The projection is sent as a patch against the last one the viewer was sent, numbered by seq,
+            or whole for the viewer's first message.
+        """
+        messages = {}
+        for key in set([viewer_key(username, self.game) for username in self.session.viewers]):
+            viewer_message = dict(message)
+            projection = project_game(game_dict, key)
+            viewer_message["seq"], patch = self.session.deltas_for(key).next(projection)
+            if patch is None:
+                viewer_message["game"] = projection
+            else:
+                viewer_message["game_patch"] = patch
+            if "review_game" in message:
+                viewer_message["review_game"] = project_game(message["review_game"], key, is_reviewing=True)
+            messages[key] = viewer_message
+        return messages
+
+    def send_snapshot(self):
+        """
+            Sends this consumer's client its whole projection of the game as of its last message, for when it missed a patch.
+        """
+        key = viewer_key(self.username, self.session.game)
+        deltas = self.session.deltas_for(key)
+        if deltas.game_dict is None and self.session.game.players:
+            # nothing was sent to the viewer by this worker yet, such as after a handover
+            deltas.next(project_game(self.session.game.snapshot().full, key))
+        frame = encode_frame({"move_type": "SNAPSHOT", "seq": deltas.seq, "game": deltas.game_dict})
+        self.outbox.append(("client", frame_text(frame, FRAME_ENCODING)))
 
     def print_move(self, message):
         move_copy = copy.deepcopy(message)
@@ -220,34 +437,84 @@ class BattleWizardConsumer(WebsocketConsumer):
         self.moves.append(move_copy)
         print(f"send_game_message: {json.dumps(move_copy, indent=4)}")
 
-    def game_message(self, event):
+    async def game_message(self, event):
         '''
             Gets called once per recipient of a message.
         '''
-        message = event['message']
-        # Send message to WebSocket
-        self.send(text_data=json.dumps({
-            'payload': message
-        }))
+        frame = event['frame']
+        if event['frames'] is not None:
+            # players see their own projection, and spectators share the one at ""
+            frame = event['frames'].get(self.username, event['frames'].get(""))
+            if frame is None:
+                return
+        text = frame_text(frame, event['encoding'])
+        if text is not None:
+            # Send message to WebSocket
+            await self.send(text_data=text)
+
+    async def game_messages(self, event):
+        '''
+            Gets called once per recipient of the messages of several moves, which the RoomActor coalesces.
+        '''
+        for game_message in event['events']:
+            await self.game_message(game_message)
+
+    async def clock_tick(self, event):
+        '''
+            Gets called once per recipient of the TurnClock's ticks.
+        '''
+        await self.game_message(event)
+
+    async def pace_ai(self):
+        """
+            Gives the AI a chance to move every GAME_AI_MOVE_SECONDS, until the client disconnects.
+        """
+        ai_seconds = getattr(settings, "GAME_AI_MOVE_SECONDS", 0.5)
+        while True:
+            await asyncio.sleep(ai_seconds)
+            if self.is_reviewing:
+                continue
+            try:
+                await self.session.actor.submit(self, self.run_ai)
+            except Exception as e:
+                print(f"Error running the AI of game {self.game_record_id}: {e}")
+
+    def run_ai(self):
+        with self.session.lock:
+            if self.session.handing_over:
+                return
+            self.game = self.session.game
+            if len(self.game.players) == 2:
+                self.game.players[1].maybe_run_ai(self)
+
+    async def turn_timeout(self, event):
+        '''
+            Gets called once per recipient when a turn runs out of time, the first recipient ends the turn.
+        '''
+        if not self.session:
+            return
+        await self.session.actor.submit(self, self.end_timed_out_turn, event["turn"])
+
+    def end_timed_out_turn(self, turn):
+        with self.session.lock:
+            if self.session.clock.claim_timeout(turn):
+                username = self.session.game.current_player().username
+                print(f"{username} ran out of time")
+                self.play_move({"move_type": "END_TURN", "username": username})
+
+    async def room_handover(self, event):
+        '''
+            Gets called once per recipient when this worker drains, and the room moves to another worker.
+        '''
+        await self.redirect(await RoomAffinity.shared().owner(self.game_record_id))
 
     # todo move review_game and is_reviewing to consumer
     def navigate_game(self, original_message):
-        review_game = Game("pvp", info={}, player_decks=self.decks)
         self.is_reviewing = True
-        self.game.moves[0]["discipline"] = self.game.players[0].discipline
-        self.game.moves[1]["discipline"] = self.game.players[1].discipline
-        self.game.moves[0]["initial_deck"] = [c.as_dict() for c in self.game.players[0].initial_deck]
-        self.game.moves[1]["initial_deck"] = [c.as_dict() for c in self.game.players[1].initial_deck]
-        index = 0
-        log_lines = []
-        for move in self.game.moves:
-            if index > original_message["index"] - 1 and original_message["index"] > -1:
-                break
-            move["log_lines"] = []
-            message = review_game.play_move(move, is_reviewing=self.is_reviewing)
-            if message["log_lines"] != []:
-                log_lines += message["log_lines"]
-            index += 1
+        if not self.session.replay:
+            self.session.replay = GameReplay(self.game, self.decks)
+        move_count = original_message["index"] if original_message["index"] > -1 else len(self.game.moves)
+        review_game, log_lines = self.session.replay.game_at(move_count)
         original_message["log_lines"] = log_lines
         username = original_message['username']
         if original_message["index"] == -1:
@@ -1,5 +1,3 @@
-from create_cards.models import CustomCard
-
 class Constants:    
     spellCardType = "spell"
     mobCardType = "mob"
@@ -0,0 +1,114 @@
+def diff(old, new):
+    """
+        Returns an RFC 6902 JSON Patch, as a list of operations, that turns old into new.
+
+        Only add, remove and replace operations are made. Values that are the same object in old and new
+        are skipped without comparing them, which is what makes diffing two GameSnapshots cheap, since the
+        dicts of cards that didn't change are shared between them.
+    """
+    operations = []
+    diff_into(old, new, "", operations)
+    return operations
+
+
+def diff_into(old, new, path, operations):
+    if old is new:
+        return
+    if type(old) is dict and type(new) is dict:
+        for key in old:
+            if key not in new:
+                operations.append({"op": "remove", "path": f"{path}/{escape_token(key)}"})
+        for key, value in new.items():
+            if key in old:
+                diff_into(old[key], value, f"{path}/{escape_token(key)}", operations)
+            else:
+                operations.append({"op": "add", "path": f"{path}/{escape_token(key)}", "value": value})
+    elif type(old) is list and type(new) is list:
+        diff_lists(old, new, path, operations)
+    elif type(old) is not type(new) or old != new:
+        operations.append({"op": "replace", "path": path, "value": new})
+
+
+def diff_lists(old, new, path, operations):
+    # cards move in and out of zones at either end or one at a time, so skip the unchanged ends first,
+    # rather than diffing every card that shifted over by one
+    start = 0
+    while start < len(old) and start < len(new) and same_value(old[start], new[start]):
+        start += 1
+    old_end = len(old)
+    new_end = len(new)
+    while old_end > start and new_end > start and same_value(old[old_end - 1], new[new_end - 1]):
+        old_end -= 1
+        new_end -= 1
+
+    paired_end = min(old_end, new_end)
+    for index in range(start, paired_end):
+        diff_into(old[index], new[index], f"{path}/{index}", operations)
+    # removed from the back, so the indexes of the items still to be removed don't shift
+    for index in range(old_end - 1, paired_end - 1, -1):
+        operations.append({"op": "remove", "path": f"{path}/{index}"})
+    for index in range(paired_end, new_end):
+        operations.append({"op": "add", "path": f"{path}/{index}", "value": new[index]})
+
+
+def same_value(old, new):
+    return old is new or (type(old) is type(new) and old == new)
+
+
+def escape_token(key):
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+
+def unescape_token(token):
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+def apply_patch(document, patch):
+    """
+        Applies a patch from diff() to document in place, and returns the patched document.
+
+        The patched document shares the patch's values, so the patch mustn't be used again.
+    """
+    for operation in patch:
+        if operation["path"] == "":
+            document = operation["value"]
+            continue
+        tokens = [unescape_token(token) for token in operation["path"].split("/")[1:]]
+        parent = document
+        for token in tokens[:-1]:
+            parent = parent[int(token)] if type(parent) is list else parent[token]
+        key = tokens[-1]
+        if type(parent) is list:
+            key = len(parent) if key == "-" else int(key)
+            if operation["op"] == "add":
+                parent.insert(key, operation["value"])
+                continue
+        if operation["op"] == "remove":
+            del parent[key]
+        else:
+            parent[key] = operation["value"]
+    return document
+
+
+class GameDeltas:
+    """
+        Numbers the game dicts broadcast to a room, and turns each one into a patch against the one before.
+
+        Every broadcast gets the next seq, so a client that misses one sees a gap, and asks for the
+        whole game with GET_SNAPSHOT instead of applying a patch to the wrong state.
+    """
+
+    def __init__(self):
+        self.seq = 0
+        # the game dict of the last broadcast, which is a GameSnapshot's and must not be changed
+        self.game_dict = None
+
+    def next(self, game_dict):
+        """
+            Returns the seq for broadcasting game_dict, and a patch from the last game dict broadcast to it,
+            or None for the room's first broadcast.
+        """
+        patch = diff(self.game_dict, game_dict) if self.game_dict is not None else None
+        self.seq += 1
+        self.game_dict = game_dict
+        return self.seq, patch
@@ -0,0 +1,67 @@
+from battle_wizard.game.card import CardCatalog
+from battle_wizard.game.sources import CardSource
+from battle_wizard.game.sources import DeckProvider
+from battle_wizard.models import Deck
+from create_cards.models import CustomCard
+from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import Count
+from django.db.models import Max
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+
+class CustomCardSource(CardSource):
+    """
+        The built-in cards plus the named cards from the card builder, which the server's games use.
+
+        Saving a CustomCard only invalidates this process's catalog, so the catalogs of the other server
+        processes, such as the asgi workers, notice the change from version() within CARD_CATALOG_VERSION_SECONDS.
+    """
+
+    def __init__(self, cards=None):
+        super().__init__(cards)
+        self.version_seconds = getattr(settings, "CARD_CATALOG_VERSION_SECONDS", 5)
+        self.saved_definitions_limit = getattr(settings, "CARD_CATALOG_SAVED_DEFINITIONS", 1000)
+
+    def custom_cards(self):
+        custom_cards = CustomCard.objects.all().exclude(card_json__name__startswith="Unnamed")
+        return [card.card_json for card in custom_cards]
+
+    def version(self):
+        # a delete changes the count, and a save the latest date_updated
+        versions = CustomCard.objects.aggregate(count=Count("id"), date_updated=Max("date_updated"))
+        return (versions["count"], versions["date_updated"])
+
+
+class DatabaseDeckProvider(DeckProvider):
+    """
+        Looks up the Decks the player saved, which the server's games use.
+    """
+
+    def player_deck(self, username, deck_id):
+        try:
+            decks = Deck.objects.filter(owner=User.objects.get(username=username))
+        except ObjectDoesNotExist:
+            decks = []
+        deck_to_use = None
+        for d in decks:
+            if d.id == deck_id:
+                deck_to_use = d.global_deck.deck_json
+        return deck_to_use
+
+
+def use_database_sources():
+    """
+        Makes games that aren't given a CardSource or DeckProvider read the database, called when Django starts.
+    """
+    CardSource.set_shared(CustomCardSource())
+    DeckProvider.set_shared(DatabaseDeckProvider())
+
+
+@receiver(post_save, sender=CustomCard)
+@receiver(post_delete, sender=CustomCard)
+def invalidate_card_catalog(sender, **kwargs):
+    CardCatalog.shared().invalidate()
@@ -0,0 +1,52 @@
+import asyncio
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+
+
+class EnginePool:
+    """
+        The bounded thread pool the async consumers run game engine work on, such as Game.play_move.
+
+        Connections only take a thread while the engine works on one of their messages, so a process can hold
+        many more idle sockets than threads. The pool is threads rather than processes because live games are
+        GameSessions in this process's memory, guarded by their locks.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, threads=None):
+        self.threads = threads if threads else getattr(settings, "GAME_ENGINE_THREADS", 8)
+        self.executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="game-engine")
+
+    @staticmethod
+    def shared():
+        if EnginePool._shared is None:
+            with EnginePool._shared_lock:
+                if EnginePool._shared is None:
+                    EnginePool._shared = EnginePool()
+        return EnginePool._shared
+
+    async def run(self, function, *args):
+        """
+            Runs function(*args) on the pool, and returns its result.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.call, function, args)
+
+    def call(self, function, args):
+        # the engine still reads decks from the database when players join, so clean up connections like database_sync_to_async
+        close_old_connections()
+        try:
+            return function(*args)
+        finally:
+            close_old_connections()
+
+
+async def run_in_engine(function, *args):
+    """
+        Runs function(*args) on the shared EnginePool.
+    """
+    return await EnginePool.shared().run(function, *args)
@@ -0,0 +1,38 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# the encoding tag of frames made by encode_frame, which are UTF-8 JSON, sent to the websocket as text
+FRAME_ENCODING = "json"
+
+# orjson is picked when it's installed, it encodes game dicts several times faster than json
+if orjson is not None:
+    def dumps(value):
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+else:
+    def dumps(value):
+        return json.dumps(value).encode("utf-8")
+
+
+def encode_frame(message):
+    """
+        Returns {"payload": message} encoded for the websocket, once for every recipient of a group_send.
+
+        The frame is bytes, so it goes through the channel layer as is, instead of being encoded again
+        by each consumer the group_send reaches.
+    """
+    return dumps({"payload": message})
+
+
+def frame_text(frame, encoding):
+    """
+        Returns the text to send to a websocket for a frame from encode_frame, or None if encoding isn't known.
+    """
+    if encoding != FRAME_ENCODING:
+        print(f"Error: can't send a frame encoded as {encoding}")
+        return None
+    return frame.decode("utf-8")
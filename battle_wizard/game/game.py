@@ -3,6 +3,8 @@ import datetime
 import random
 
 from battle_wizard.game.card import Card
+from battle_wizard.game.card import CardCatalog
+from battle_wizard.game.card import copy_card_info
 from battle_wizard.game.data import Constants
 from battle_wizard.game.data import default_deck 
 from battle_wizard.game.data import default_deck_genie_wizard 
@@ -11,21 +13,36 @@ from battle_wizard.game.data import default_deck_dwarf_bard
 from battle_wizard.game.data import default_deck_vampire_lich
 from battle_wizard.game.player import Player
 from battle_wizard.game.player_ai import PlayerAI
+from battle_wizard.game.sources import DeckProvider
 
 
 class Game:
-    def __init__(self, player_type, info=None, player_decks=None):
-
+    def __init__(self, player_type, info=None, player_decks=None, card_source=None, deck_provider=None):
+        """
+            card_source and deck_provider default to the shared ones, which the server sets to read the
+            database. Pass in a CardSource and a DeckProvider to run the game without Django.
+        """
+        # the cards the game's cards are made from, and the decks the players join with
+        self.card_source = card_source
+        self.catalog = CardCatalog.for_source(card_source)
+        self.deck_provider = deck_provider if deck_provider else DeckProvider.shared()
         # player 0 always acts on even turns, player 1 acts on odd turns
         self.actor_turn = int(info["actor_turn"]) if info and "actor_turn" in info else 0
         # a list of all player-derived moves, sufficient to replay the game
         self.moves = info["moves"] if info and "moves" in info else []
         # the max number of cards a player can have
         self.max_hand_size = 10
+        # the game's randomness all comes from rng, which is reseeded from seed before each move, so the
+        # game can be rebuilt from its seed, decks, and moves
+        self.seed = int(info["seed"]) if info and "seed" in info else random.randrange(2 ** 32)
+        self.rng = random.Random(self.seed)
         # the next id to give a card when doing make_card effects, each card gets the next unusued integer
         self.next_card_id = int(info["next_card_id"]) if info and "next_card_id" in info else 0
         # either pvp (player vs player) or pvai (player vs ai)
         self.player_type = info["player_type"] if info and "player_type" in info else player_type
+        # the definitions the saved game's card overlays were made on, in case those cards changed since
+        if info and "definitions" in info:
+            self.catalog.add_saved_definitions(info["definitions"])
         # support 2 players
         self.players = []
         if info and "players" in info:
@@ -46,22 +63,52 @@ class Game:
         self.turn = int(info["turn"]) if info and "turn" in info else 0
         # the time the current turn started on, used to activate the rope to force turn end
         self.turn_start_time = datetime.datetime.strptime(info["turn_start_time"], "%Y-%m-%d %H:%M:%S.%f") if (info and "turn_start_time" in info and info["turn_start_time"] != None) else datetime.datetime.now()
+        # the GameSnapshot of the game since its last change, see snapshot()
+        self.current_snapshot = None
 
     def __repr__(self):
         return f"{self.as_dict()}"
 
-    def as_dict(self):
-        return {
+    def as_dict(self, compact=False, cached=False):
+        """
+            compact and cached are passed on to Player.as_dict, compact for the copy of the game that gets saved.
+            Only that copy has the seed, which would let players predict draws.
+        """
+        game_dict = {
             "actor_turn": self.actor_turn, 
             "moves": self.moves, 
             "next_card_id": self.next_card_id, 
-            "players": [p.as_dict() for p in self.players], 
+            "players": [p.as_dict(compact=compact, cached=cached) for p in self.players], 
             "player_type": self.player_type, 
             "show_rope": self.show_rope, 
             "stack": self.stack, 
             "turn": self.turn, 
             "turn_start_time": self.turn_start_time.__str__() if self.turn_start_time else None, 
         }
+        if compact:
+            game_dict["seed"] = self.seed
+            game_dict["definitions"] = self.overlay_definitions()
+        return game_dict
+
+    def overlay_definitions(self):
+        """
+            Returns the card dicts the players' card overlays are made on, by content hash, which the compact
+            copy saves once per game, so it loads the same after those cards change or get deleted.
+        """
+        definitions = {}
+        for p in self.players:
+            for card in p.artifacts + p.deck + p.hand + p.initial_deck + p.in_play + p.played_pile + p.card_choice_info["cards"]:
+                if card.definition is not None and card.definition.content_hash not in definitions and card.has_overlay():
+                    definitions[card.definition.content_hash] = card.definition.info
+        return definitions
+
+    def snapshot(self):
+        """
+            Returns the GameSnapshot of the game as it is now, which stays the same object until the game changes.
+        """
+        if self.current_snapshot is None:
+            self.current_snapshot = GameSnapshot(self)
+        return self.current_snapshot
 
     def current_player(self):
         return self.players[self.actor_turn % 2]
@@ -84,6 +131,11 @@ class Game:
             return message
         else:
             print(f"play_move: {move_type} {message['username']}")
+        self.current_snapshot = None
+
+        if should_add_to_move_list:
+            # each move gets its own random sequence, which only depends on the seed and the moves before it
+            self.rng.seed(f"{self.seed}:{len(self.moves)}")
 
         if should_add_to_move_list and (message["move_type"] != "JOIN" or len(self.moves) <= 2):
             move_copy = copy.deepcopy(message)
@@ -157,7 +209,7 @@ class Game:
                 if card.can_be_clicked:
                     anything_clickable = True
             for spell in self.stack:
-                if Card(spell[1]).can_be_clicked:
+                if Card(spell[1], self.catalog).can_be_clicked:
                     anything_clickable = True
             if not anything_clickable and not "bot" in cp.username and len(self.stack) > 0:
                 return self.play_move({"move_type": "RESOLVE_NEXT_STACK", "username": cp.username})
@@ -203,6 +255,7 @@ class Game:
         """
             highlight selectable cards for possible attacks/spells
         """
+        self.current_snapshot = None
 
         if len(self.players) != 2:
             return
@@ -266,7 +319,7 @@ class Game:
                         effect_can_be_used = False
                         if len(cp.in_play) > 0:
                             for mob in cp.in_play:
-                                card.effect_can_be_used = True
+                                effect_can_be_used = True
                     if effect.cost > cp.current_mana():
                         effect_can_be_used = False
                     if effect.exhausted:
@@ -326,20 +379,20 @@ class Game:
         target_info = {"move_type": move_type}
         for m in self.opponent().in_play:
             for idx, effect in enumerate(m.effects_for_type("select_mob_target")):
-                m.resolve_effect(m.select_mob_target_effect_defs[idx], self.opponent(), effect, target_info) 
+                m.resolve_effect(m.effect_def("select_mob_target", idx), self.opponent(), effect, target_info) 
         # this currently handles Lurker
         for m in self.opponent().in_play:
             for idx, effect in enumerate(m.effects_for_type("select_mob_target_override")):
-                m.resolve_effect(m.select_mob_target_override_effect_defs[idx], self.opponent(), effect, target_info) 
+                m.resolve_effect(m.effect_def("select_mob_target_override", idx), self.opponent(), effect, target_info) 
         for m in self.current_player().in_play:
             for idx, effect in enumerate(m.effects_for_type("select_mob_target_override")):
-                m.resolve_effect(m.select_mob_target_override_effect_defs[idx], self.current_player(), effect, target_info) 
+                m.resolve_effect(m.effect_def("select_mob_target_override", idx), self.current_player(), effect, target_info) 
         
         # this currently handles restricton effects like restrict_effect_targets_min_cost
         for m in self.current_player().hand:
             for idx, effect in enumerate(m.effects_for_type("select_mob_target_override")):
                 # check for move_type so we don't have infinite recursion on effects such as restrict_effect_targets_min_cost
-                m.resolve_effect(m.select_mob_target_override_effect_defs[idx], self.current_player(), effect, target_info) 
+                m.resolve_effect(m.effect_def("select_mob_target_override", idx), self.current_player(), effect, target_info) 
 
     def get_in_play_for_id(self, card_id):
         """
@@ -453,10 +506,10 @@ class Game:
     def do_after_shuffle_effects(self):
         for m in self.current_player().deck:
             for idx, effect in enumerate(m.effects_for_type("after_shuffle")):
-                m.resolve_effect(m.after_shuffle_effect_defs[idx], self.current_player(), effect, {}) 
+                m.resolve_effect(m.effect_def("after_shuffle", idx), self.current_player(), effect, {}) 
         for m in self.opponent().deck:
             for idx, effect in enumerate(m.effects_for_type("after_shuffle")):
-                m.resolve_effect(m.after_shuffle_effect_defs[idx], self.opponent(), effect, {}) 
+                m.resolve_effect(m.effect_def("after_shuffle", idx), self.opponent(), effect, {}) 
 
     def send_start_first_turn(self, message):
         new_message = copy.deepcopy(message)
@@ -484,7 +537,7 @@ class Game:
                 self.current_player().hand.remove(card)
                 self.current_player().played_pile.append(card)
                 for idx, effect in enumerate(card.effects_for_type("discarded_end_of_turn")):
-                    log_lines = card.resolve_effect(card.discarded_end_of_turn_effect_defs[idx], self.current_player(), effect, {})
+                    log_lines = card.resolve_effect(card.effect_def("discarded_end_of_turn", idx), self.current_player(), effect, {})
                     if log_lines:
                         for line in log_lines:
                              message["log_lines"].append(line)
@@ -493,7 +546,7 @@ class Game:
             # this works because all end_turn triggered effects dont have targets to choose
             effect_targets = mob.effect_targets(self.current_player(), "end_turn")            
             for idx, effect in enumerate(mob.effects_for_type("end_turn")):
-                log_lines = mob.resolve_effect(mob.end_turn_effect_defs[idx], self.current_player(), effect, effect_targets[idx])
+                log_lines = mob.resolve_effect(mob.effect_def("end_turn", idx), self.current_player(), effect, effect_targets[idx])
                 if log_lines:
                     effect.show_effect_animation = True
                     [message["log_lines"].append(line) for line in log_lines]
@@ -519,12 +572,12 @@ class Game:
             return None
 
         if card.needs_random_friendly_target_for_spell(): 
-            message["defending_card"] = random.choice(self.current_player().in_play).id
+            message["defending_card"] = self.rng.choice(self.current_player().in_play).id
             message = self.select_mob_target_for_spell(self.current_player().selected_spell(), message)
             return message
 
         if card.needs_random_enemy_target_for_spell(): 
-            message["defending_card"] = random.choice(self.opponent().in_play).id
+            message["defending_card"] = self.rng.choice(self.opponent().in_play).id
             message = self.select_mob_target_for_spell(self.current_player().selected_spell(), message)
             return message
 
@@ -546,7 +599,7 @@ class Game:
                 stack_spell = spell
         if selected_spell:
             effect = selected_spell.effects[0]
-            stack_spell_card = Card(stack_spell[1])
+            stack_spell_card = Card(stack_spell[1], self.catalog)
             if effect.target_type == "being_cast_mob" and stack_spell_card.card_type != Constants.mobCardType:
                 print(f"can't select non-mob with mob-counterspell")
                 return None
@@ -753,11 +806,11 @@ class Game:
 
         for card in self.current_player().in_play:
             for idx, effect in enumerate(card.effects_for_type("after_declared_attack")):
-                card.resolve_effect(card.after_declared_attack_effect_defs[idx], self.current_player(), effect, {}) 
+                card.resolve_effect(card.effect_def("after_declared_attack", idx), self.current_player(), effect, {}) 
 
         for card in self.current_player().hand:
             for idx, effect in enumerate(card.effects_for_type("action_added_to_stack")):
-                card.resolve_effect(card.action_added_to_stack_effect_defs[idx], self.current_player(), effect, {}) 
+                card.resolve_effect(card.effect_def("action_added_to_stack", idx), self.current_player(), effect, {}) 
 
         if not self.current_player().has_instants():
             message = self.attack(message)
@@ -810,12 +863,12 @@ class Game:
             move_to_complete["log_lines"].append(f"{attacking_card.name} attacks {self.opponent().username} for {damage}.")
             self.opponent().damage(damage)
             for idx, effect in enumerate(attacking_card.effects_for_type("after_deals_damage")):
-                attacking_card.resolve_effect(attacking_card.after_deals_damage_effect_defs[idx], self.current_player(), effect, {"damage": damage}) 
+                attacking_card.resolve_effect(attacking_card.effect_def("after_deals_damage", idx), self.current_player(), effect, {"damage": damage}) 
             for idx, effect in enumerate(attacking_card.effects_for_type("after_deals_damage_opponent")):
-                attacking_card.resolve_effect(attacking_card.after_deals_damage_opponent_effect_defs[idx], self.current_player(), effect, {"damage": damage}) 
+                attacking_card.resolve_effect(attacking_card.effect_def("after_deals_damage_opponent", idx), self.current_player(), effect, {"damage": damage}) 
 
         for idx, effect in enumerate(attacking_card.effects_for_type("after_attack")):
-            attacking_card.resolve_effect(attacking_card.after_attack_effect_defs[idx], self.current_player(), effect, {}) 
+            attacking_card.resolve_effect(attacking_card.effect_def("after_attack", idx), self.current_player(), effect, {}) 
 
         return move_to_complete
 
@@ -835,22 +888,22 @@ class Game:
             message["log_lines"].append(f"{self.current_player().username} uses {artifact.name} on {defending_card.name}")
             effect_targets = []
             effect_targets.append({"id": defending_card.id, "target_type": "mob"})
-            artifact.resolve_effect(artifact.activated_effect_defs[0], self.current_player(), e, effect_targets[0])
+            artifact.resolve_effect(artifact.effect_def("activated", 0), self.current_player(), e, effect_targets[0])
             self.current_player().reset_card_info_to_target()
         elif "hand_card" in message:
             hand_card = self.current_player().in_hand_card(message["hand_card"])
             message["log_lines"].append(f"{self.current_player().username} uses {artifact.name} on {hand_card.name}")
-            artifact.resolve_effect(artifact.activated_effect_defs[0], self.current_player(), e, {"id": hand_card.id, "target_type": "hand_card"})
+            artifact.resolve_effect(artifact.effect_def("activated", 0), self.current_player(), e, {"id": hand_card.id, "target_type": "hand_card"})
             self.current_player().reset_card_info_to_target()
         else:
             if e.target_type == "self":
-                message["log_lines"].append(artifact.resolve_effect(artifact.activated_effect_defs[0], self.current_player(), e, {"id": message["username"], "target_type": "player"}))
+                message["log_lines"].append(artifact.resolve_effect(artifact.effect_def("activated", 0), self.current_player(), e, {"id": message["username"], "target_type": "player"}))
             elif e.target_type == "opponent":
-                message["log_lines"].append(artifact.resolve_effect(artifact.activated_effect_defs[0], self.current_player(), e, {"id": self.opponent().username, "target_type": "player"}))
+                message["log_lines"].append(artifact.resolve_effect(artifact.effect_def("activated", 0), self.current_player(), e, {"id": self.opponent().username, "target_type": "player"}))
             elif e.target_type == "all":  # Disk of Death only, maybe rename from all
-                message["log_lines"].append(artifact.resolve_effect(artifact.activated_effect_defs[0], self.current_player(), e, {})) 
+                message["log_lines"].append(artifact.resolve_effect(artifact.effect_def("activated", 0), self.current_player(), e, {})) 
             elif e.target_type == "artifact_in_deck":
-                message["log_lines"].append(artifact.resolve_effect(artifact.activated_effect_defs[0], self.current_player(), e, {"id": message["username"], "target_type": e.target_type})) 
+                message["log_lines"].append(artifact.resolve_effect(artifact.effect_def("activated", 0), self.current_player(), e, {"id": message["username"], "target_type": e.target_type})) 
             elif e.target_type == "friendly_mob":
                 message = self.select_mob_target_for_artifact_activated_effect(artifact, message)
             else:
@@ -860,7 +913,7 @@ class Game:
                 message["log_lines"].append(f"{self.current_player().username} uses {artifact.name} on {target_player.username}")
                 message["effect_targets"] = []
                 message["effect_targets"].append({"id": target_player.username, "target_type": "player"})
-                message["log_lines"].append(artifact.resolve_effect(artifact.activated_effect_defs[0], self.current_player(), e, message["effect_targets"][0])) 
+                message["log_lines"].append(artifact.resolve_effect(artifact.effect_def("activated", 0), self.current_player(), e, message["effect_targets"][0])) 
                 self.current_player().reset_card_info_to_target()
 
         self.current_player().reset_card_info_to_target()
@@ -886,7 +939,7 @@ class Game:
             damaged_card.deal_damage_with_effects(damage, controller)
             actual_damage = damaged_card.damage_to_show
             for idx, effect in enumerate(damage_card.effects_for_type("after_deals_damage")):
-                damage_card.resolve_effect(damage_card.after_deals_damage_effect_defs[idx], controller, effect, {"damage": actual_damage, "damage_possible": possible_damage}) 
+                damage_card.resolve_effect(damage_card.effect_def("after_deals_damage", idx), controller, effect, {"damage": actual_damage, "damage_possible": possible_damage}) 
         if attacking_card.damage >= attacking_card.hit_points_with_tokens():
             self.current_player().send_card_to_played_pile(attacking_card, did_kill=True)
         if defending_card.damage >= defending_card.hit_points_with_tokens():
@@ -946,7 +999,7 @@ class Game:
         selected_card = None
         for spell in self.stack:
             if spell[1]["id"] == message["card"]:
-                selected_card = Card(spell[1])
+                selected_card = Card(spell[1], self.catalog)
                 break
         effect_targets = []
         effect_targets.append({"id": selected_card.id, "target_type": "stack_spell"})            
@@ -987,4 +1040,42 @@ class Game:
                 attack_to_defend = True
                 if "defending_card" in action:
                     attack_defender, _ = self.get_in_play_for_id(action["defending_card"])
-        return attack_to_defend and defender != attack_defender
\ No newline at end of file
+        return attack_to_defend and defender != attack_defender
+
+class GameSnapshot:
+    """
+        A game serialized once per change, shared by everything that needs it after a move: the broadcast
+        to the room uses full, and the GameWriter saves compact.
+
+        Each form is built the first time it's used, from the cards' cached dicts, so only the cards that
+        changed since the last snapshot get serialized again. The dicts are shared, so they must not be changed.
+    """
+
+    def __init__(self, game):
+        self.game = game
+        self._full = None
+        self._compact = None
+
+    @property
+    def full(self):
+        """
+            The game's as_dict(), as sent to the players.
+        """
+        if self._full is None:
+            game_dict = self.game.as_dict(cached=True)
+            # later moves change these in place, and GameDeltas diffs the next snapshot against this one
+            game_dict["moves"] = list(game_dict["moves"])
+            game_dict["stack"] = copy_card_info(game_dict["stack"])
+            for player_dict in game_dict["players"]:
+                player_dict["card_info_to_target"] = dict(player_dict["card_info_to_target"])
+            self._full = game_dict
+        return self._full
+
+    @property
+    def compact(self):
+        """
+            The game's as_dict(compact=True), as saved to its GameRecord.
+        """
+        if self._compact is None:
+            self._compact = self.game.as_dict(compact=True, cached=True)
+        return self._compact
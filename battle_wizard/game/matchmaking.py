@@ -0,0 +1,490 @@
+import asyncio
+import bisect
+import datetime
+import threading
+import time
+
+from battle_wizard.game.rating import RatingSystem
+from battle_wizard.models import GameRecord
+from battle_wizard.models import MatchQueueEntry
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+
+def create_game_record():
+    return GameRecord.objects.create(date_created=datetime.datetime.now()).id
+
+
+class QueuedPlayer:
+
+    def __init__(self, username, channel_name, rating, enqueued_at, seen_at, order, entry_id=None):
+        self.username = username
+        self.channel_name = channel_name
+        self.rating = rating
+        self.enqueued_at = enqueued_at
+        self.seen_at = seen_at
+        # breaks ties between players enqueued at the same time
+        self.order = order
+        # the player's MatchQueueEntry, for a DatabaseMatchQueue
+        self.entry_id = entry_id
+        # the key of the player's bucket while they're in a RatingIndex
+        self.bucket = None
+
+
+class Match:
+    """
+        Two players the queue paired, and the GameRecord made for their game.
+    """
+
+    def __init__(self, game_record_id, players):
+        self.game_record_id = game_record_id
+        # the QueuedPlayers, by seat, longest waiting first
+        self.players = players
+
+
+class RatingIndex:
+    """
+        Queued players, bucketed by rating, to find a player's opponent within a rating window.
+
+        Each bucket is bucket_width wide and holds its players in the order they were added, and
+        bucket_keys is the sorted keys of the buckets with players in them. So finding the player who's
+        waited longest within a window bisects bucket_keys, then looks at the first player of each
+        bucket the window covers, past any outside the window at its edges and any accept() turns down.
+        That's linear in the number of buckets the window covers, which grows with the window, and in
+        the players it skips, rather than in the number of players queued.
+    """
+
+    def __init__(self, bucket_width):
+        self.bucket_width = bucket_width
+        self.buckets = {}
+        self.bucket_keys = []
+
+    def key(self, rating):
+        return int(rating // self.bucket_width)
+
+    @staticmethod
+    def waited_longer(player, other):
+        return (player.enqueued_at, player.order) < (other.enqueued_at, other.order)
+
+    def add(self, player):
+        key = self.key(player.rating)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = {}
+            bisect.insort(self.bucket_keys, key)
+        bucket[player.username] = player
+        player.bucket = key
+
+    def remove(self, player):
+        bucket = self.buckets[player.bucket]
+        del bucket[player.username]
+        if not bucket:
+            del self.buckets[player.bucket]
+            del self.bucket_keys[bisect.bisect_left(self.bucket_keys, player.bucket)]
+        player.bucket = None
+
+    def find_opponent(self, player, window, accept=None):
+        """
+            Returns the player who's waited longest within window of player's rating, other than player and
+            those accept() returns False for, or None.
+        """
+        low = bisect.bisect_left(self.bucket_keys, self.key(player.rating - window))
+        high = bisect.bisect_right(self.bucket_keys, self.key(player.rating + window))
+        opponent = None
+        for key in self.bucket_keys[low:high]:
+            for candidate in self.buckets[key].values():
+                if candidate is player or abs(candidate.rating - player.rating) > window or (accept and not accept(candidate)):
+                    continue
+                if opponent is None or self.waited_longer(candidate, opponent):
+                    opponent = candidate
+                break
+        return opponent
+
+
+class MatchQueue:
+    """
+        The players waiting for a pvp match, kept in this process's memory, and paired by rating.
+
+        A player is paired with whoever has waited longest within their rating window, which starts at
+        rating_window and widens by rating_window_per_second while they wait, up to max_rating_window.
+        enqueue() looks for the new player's opponent in the RatingIndex, and pair() is run every
+        sweep_seconds, to pair the players whose windows have widened to reach one another. Each is one
+        step under a lock, so concurrent consumers can't lose a player or put one in two matches. A player
+        who enqueues again, such as after reconnecting, keeps their place, with their new channel_name.
+
+        Players are dropped if their consumer hasn't called touch() for expiry_seconds, so players whose
+        server process died without disconnecting them don't get matched. This queue is lost when the
+        process restarts, but so are its consumers, and clients enqueue again when they reconnect.
+        DatabaseMatchQueue keeps the queue in the database, for several server processes.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, expiry_seconds=None, create_game=None, rating_window=None, rating_window_per_second=None, max_rating_window=None, bucket_width=None, sweep_seconds=None, clock=None):
+        self.expiry_seconds = expiry_seconds if expiry_seconds else getattr(settings, "MATCH_QUEUE_EXPIRY_SECONDS", 30)
+        # makes the GameRecord for a match, and returns its id
+        self.create_game = create_game if create_game else create_game_record
+        self.rating_window = rating_window if rating_window is not None else getattr(settings, "MATCH_RATING_WINDOW", 100)
+        self.rating_window_per_second = rating_window_per_second if rating_window_per_second is not None else getattr(settings, "MATCH_RATING_WINDOW_PER_SECOND", 10)
+        self.max_rating_window = max_rating_window if max_rating_window is not None else getattr(settings, "MATCH_RATING_WINDOW_MAX", 800)
+        self.sweep_seconds = sweep_seconds if sweep_seconds else getattr(settings, "MATCH_QUEUE_SWEEP_SECONDS", 1)
+        # the simulate_matchmaking command runs the queue on a simulated clock
+        self.clock = clock if clock else time.monotonic
+        self.lock = threading.Lock()
+        # username -> QueuedPlayer, in the order they were enqueued
+        self.players = {}
+        self.index = RatingIndex(bucket_width if bucket_width else getattr(settings, "MATCH_RATING_BUCKET_WIDTH", 50))
+        # the task running pair() every sweep_seconds
+        self.task = None
+        self.enqueues = 0
+        self.matches = 0
+        self.expired = 0
+
+    @staticmethod
+    def shared():
+        if MatchQueue._shared is None:
+            with MatchQueue._shared_lock:
+                if MatchQueue._shared is None:
+                    if getattr(settings, "MATCH_QUEUE", "memory") == "database":
+                        MatchQueue._shared = DatabaseMatchQueue()
+                    else:
+                        MatchQueue._shared = MatchQueue()
+        return MatchQueue._shared
+
+    def window(self, waited_seconds):
+        """
+            Returns how far from their rating a player who has waited waited_seconds can be paired.
+        """
+        return min(self.rating_window + self.rating_window_per_second * max(waited_seconds, 0), self.max_rating_window)
+
+    def enqueue(self, username, channel_name, rating=None):
+        """
+            Adds the player to the queue, or updates their channel_name if they're queued, and returns the Matches this made.
+        """
+        rating = rating if rating is not None else RatingSystem().initial_rating
+        with self.lock:
+            self.enqueues += 1
+            now = self.clock()
+            player = self.players.get(username)
+            if player is None:
+                player = self.players[username] = QueuedPlayer(username, channel_name, rating, now, now, self.enqueues)
+                self.index.add(player)
+            else:
+                player.channel_name = channel_name
+                player.seen_at = now
+            pairs = self.take_opponent(player, now)
+        return self.make_matches(pairs)
+
+    def dequeue(self, username, channel_name=None):
+        """
+            Removes the player from the queue, unless they've since enqueued from a channel other than channel_name, and returns whether they were queued.
+        """
+        with self.lock:
+            player = self.players.get(username)
+            if player is None or (channel_name is not None and player.channel_name != channel_name):
+                return False
+            self.remove(player)
+            return True
+
+    def touch(self, username, channel_name):
+        """
+            Keeps the player queued for another expiry_seconds, and returns whether they're still queued.
+        """
+        with self.lock:
+            player = self.players.get(username)
+            if player is None or player.channel_name != channel_name:
+                return False
+            player.seen_at = self.clock()
+            return True
+
+    def pair(self):
+        """
+            Drops expired players, then pairs each player whose window reaches another, longest waiting first, and returns the Matches.
+        """
+        with self.lock:
+            now = self.clock()
+            self.drop_expired(now)
+            pairs = []
+            for player in list(self.players.values()):
+                if player.bucket is not None:
+                    pairs += self.take_opponent(player, now)
+        return self.make_matches(pairs)
+
+    def take_opponent(self, player, now):
+        # call with self.lock held, returns [[player, opponent]] by seat if player has an opponent, or []
+        cutoff = now - self.expiry_seconds
+        opponent = self.index.find_opponent(player, self.window(now - player.enqueued_at), lambda candidate: candidate.seen_at >= cutoff)
+        if opponent is None:
+            return []
+        self.remove(player)
+        self.remove(opponent)
+        self.matches += 1
+        return [[opponent, player] if RatingIndex.waited_longer(opponent, player) else [player, opponent]]
+
+    def make_matches(self, pairs):
+        # the GameRecords are made after releasing the lock, since nobody else can pair these players now
+        matches = []
+        for index, players in enumerate(pairs):
+            try:
+                matches.append(Match(self.create_game(), players))
+            except Exception as e:
+                print(f"Error making the games of {len(pairs) - index} matches: {e}")
+                with self.lock:
+                    for players in pairs[index:]:
+                        self.matches -= 1
+                        for player in players:
+                            if player.username not in self.players:
+                                self.players[player.username] = player
+                                self.index.add(player)
+                break
+        return matches
+
+    def remove(self, player):
+        # call with self.lock held
+        del self.players[player.username]
+        self.index.remove(player)
+
+    def drop_expired(self, now):
+        # call with self.lock held
+        cutoff = now - self.expiry_seconds
+        for player in [player for player in self.players.values() if player.seen_at < cutoff]:
+            self.remove(player)
+            self.expired += 1
+
+    def waiting(self):
+        with self.lock:
+            return list(self.players)
+
+    async def start(self, announce):
+        """
+            Starts running pair() every sweep_seconds on this event loop, the first time a consumer connects,
+            and passes each Match it makes to the coroutine announce.
+        """
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done() or self.task.get_loop() is not loop:
+            self.task = loop.create_task(self.run(announce))
+
+    async def run(self, announce):
+        try:
+            while True:
+                await asyncio.sleep(self.sweep_seconds)
+                try:
+                    matches = await database_sync_to_async(self.pair)()
+                except Exception as e:
+                    print(f"Error pairing the players waiting for a match: {e}")
+                    continue
+                for match in matches:
+                    await announce(match)
+        except asyncio.CancelledError:
+            pass
+
+    def metrics(self):
+        with self.lock:
+            return {
+                "waiting": len(self.players),
+                "enqueues": self.enqueues,
+                "matches": self.matches,
+                "expired": self.expired,
+            }
+
+
+class EnqueueRequest:
+
+    def __init__(self, username, channel_name, rating):
+        self.username = username
+        self.channel_name = channel_name
+        self.rating = rating
+        self.done = threading.Event()
+        self.matches = []
+        self.error = None
+
+
+class DatabaseMatchQueue(MatchQueue):
+    """
+        A MatchQueue kept in the MatchQueueEntry table, which every server process shares, and which keeps
+        the players' places across restarts.
+
+        Enqueues are written by a thread of their own, which takes every enqueue waiting when it starts a
+        batch, and adds their players and looks for their opponents in one transaction, so concurrent
+        enqueues share a commit. An opponent is found with a range query on the rating index, for the
+        players within the player's window, and those whose own window has widened to max_rating_window.
+        A player's chances only change while their window widens, so pair() only looks up opponents for
+        the players enqueued within max_window_seconds() of now, found with a range query on date_enqueued,
+        rather than for the whole queue. Paired rows are locked, skipping rows another process has locked,
+        and deleted, and the transaction is rolled back unless it deleted all of them, so no player is in
+        two matches on databases without row locks either.
+
+        Each Match goes to the enqueue of one of its players, so every Match gets announced.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.condition = threading.Condition()
+        self.requests = []
+        self.thread = None
+        self.batches = 0
+
+    def enqueue(self, username, channel_name, rating=None):
+        # waits for the batch, so callers on an event loop run this with thread_sensitive=False, or the batch only ever has them
+        request = EnqueueRequest(username, channel_name, rating if rating is not None else RatingSystem().initial_rating)
+        with self.condition:
+            self.requests.append(request)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run_batches, name="match-queue", daemon=True)
+                self.thread.start()
+            self.condition.notify()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.matches
+
+    def run_batches(self):
+        while True:
+            with self.condition:
+                if not self.requests:
+                    self.condition.wait(self.expiry_seconds)
+                if not self.requests:
+                    # idle, so the thread and its database connection go away until the next enqueue
+                    self.thread = None
+                    break
+                batch = self.requests
+                self.requests = []
+            try:
+                self.enqueue_batch(batch)
+            except Exception as e:
+                print(f"Error enqueueing {len(batch)} players: {e}")
+                for request in batch:
+                    request.error = e
+                close_old_connections()
+            finally:
+                for request in batch:
+                    request.done.set()
+        close_old_connections()
+
+    def enqueue_batch(self, batch):
+        now = timezone.now()
+        # a player enqueued twice in the batch is queued from their last channel
+        requests = {request.username: request for request in batch}
+        with transaction.atomic():
+            # the delete takes SQLite's write lock before any read, rather than failing to upgrade to it
+            expired = self.drop_expired_entries(now)
+            queued = set(MatchQueueEntry.objects.filter(username__in=list(requests)).values_list("username", flat=True))
+            for username in queued:
+                # they keep their place
+                MatchQueueEntry.objects.filter(username=username).update(channel_name=requests[username].channel_name, date_seen=now)
+            # a conflict means another process enqueued them first
+            MatchQueueEntry.objects.bulk_create([
+                MatchQueueEntry(username=username, channel_name=request.channel_name, date_enqueued=now, date_seen=now, rating=request.rating)
+                for username, request in requests.items() if username not in queued
+            ], ignore_conflicts=True)
+
+            entries = MatchQueueEntry.objects.select_for_update(skip_locked=True).filter(username__in=list(requests))
+            matches = self.take_pairs(self.find_pairs(entries, now))
+
+        for match in matches:
+            request = next(requests[player.username] for player in match.players if player.username in requests)
+            request.matches.append(match)
+        with self.lock:
+            self.enqueues += len(batch)
+            self.matches += len(matches)
+            self.expired += expired
+            self.batches += 1
+
+    def dequeue(self, username, channel_name=None):
+        entries = MatchQueueEntry.objects.filter(username=username)
+        if channel_name is not None:
+            entries = entries.filter(channel_name=channel_name)
+        return entries.delete()[0] > 0
+
+    def touch(self, username, channel_name):
+        return MatchQueueEntry.objects.filter(username=username, channel_name=channel_name).update(date_seen=timezone.now()) > 0
+
+    def pair(self):
+        now = timezone.now()
+        with transaction.atomic():
+            expired = self.drop_expired_entries(now)
+            # the players whose windows widened since the last sweep, the others were already looked up at their widest
+            widening = now - datetime.timedelta(seconds=(self.max_window_seconds() or 0) + self.sweep_seconds)
+            entries = MatchQueueEntry.objects.select_for_update(skip_locked=True).filter(date_enqueued__gte=widening)
+            matches = self.take_pairs(self.find_pairs(entries, now))
+        with self.lock:
+            self.matches += len(matches)
+            self.expired += expired
+        return matches
+
+    def max_window_seconds(self):
+        """
+            Returns how long a player waits before their window widens to max_rating_window, or None if it never does.
+        """
+        if self.rating_window >= self.max_rating_window:
+            return 0
+        if self.rating_window_per_second <= 0:
+            return None
+        return (self.max_rating_window - self.rating_window) / self.rating_window_per_second
+
+    def find_pairs(self, entries, now):
+        """
+            Looks up an opponent for each of the entries, longest waiting first, and returns the pairs of QueuedPlayers by seat.
+
+            Call this in a transaction.
+        """
+        cutoff = now - datetime.timedelta(seconds=self.expiry_seconds)
+        max_window_seconds = self.max_window_seconds()
+        taken = set()
+        pairs = []
+        for entry in entries.order_by("date_enqueued", "id"):
+            if entry.username in taken:
+                continue
+            window = self.window((now - entry.date_enqueued).total_seconds())
+            within = Q(rating__gte=entry.rating - window, rating__lte=entry.rating + window)
+            if max_window_seconds is not None and window < self.max_rating_window:
+                # players who've waited long enough that their window reaches this one
+                widest = now - datetime.timedelta(seconds=max_window_seconds)
+                within |= Q(rating__gte=entry.rating - self.max_rating_window, rating__lte=entry.rating + self.max_rating_window, date_enqueued__lte=widest)
+            opponent = MatchQueueEntry.objects.select_for_update(skip_locked=True).filter(
+                within,
+                date_seen__gte=cutoff,
+            ).exclude(username__in=taken | {entry.username}).order_by("date_enqueued", "id").first()
+            if opponent is not None:
+                taken |= {entry.username, opponent.username}
+                players = [queued_player(entry), queued_player(opponent)]
+                pairs.append(players if RatingIndex.waited_longer(*players) else players[::-1])
+        return pairs
+
+    def drop_expired_entries(self, now):
+        cutoff = now - datetime.timedelta(seconds=self.expiry_seconds)
+        return MatchQueueEntry.objects.filter(date_seen__lt=cutoff).delete()[0]
+
+    def take_pairs(self, pairs):
+        """
+            Deletes the entries of the pairs of QueuedPlayers, and returns their Matches.
+
+            Call this in a transaction.
+        """
+        entry_ids = [player.entry_id for players in pairs for player in players]
+        if not entry_ids:
+            return []
+        with transaction.atomic():
+            if MatchQueueEntry.objects.filter(id__in=entry_ids).delete()[0] != len(entry_ids):
+                # somebody else paired some of them first
+                transaction.set_rollback(True)
+                return []
+            return [Match(self.create_game(), players) for players in pairs]
+
+    def waiting(self):
+        return list(MatchQueueEntry.objects.order_by("date_enqueued", "id").values_list("username", flat=True))
+
+    def metrics(self):
+        metrics = super().metrics()
+        metrics["waiting"] = MatchQueueEntry.objects.count()
+        metrics["batches"] = self.batches
+        return metrics
+
+
+def queued_player(entry):
+    return QueuedPlayer(entry.username, entry.channel_name, entry.rating, entry.date_enqueued, entry.date_seen, entry.id, entry_id=entry.id)
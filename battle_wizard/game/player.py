@@ -1,17 +1,8 @@
 import copy
 import datetime
-import random
 
 from battle_wizard.game.card import Card, CardEffect
 from battle_wizard.game.data import Constants
-from battle_wizard.game.data import default_deck 
-from battle_wizard.game.data import default_deck_genie_wizard 
-from battle_wizard.game.data import default_deck_dwarf_tinkerer
-from battle_wizard.game.data import default_deck_dwarf_bard
-from battle_wizard.game.data import default_deck_vampire_lich
-from battle_wizard.models import Deck
-from django.contrib.auth.models import User
-from django.core.exceptions import ObjectDoesNotExist
 
 
 class Player:
@@ -24,22 +15,22 @@ class Player:
         self.max_hit_points = 30
         self.card_mana = 0
         self.about_to_draw_count = info["about_to_draw_count"] if "about_to_draw_count" in info else 0
-        self.artifacts = [Card(c_info) for c_info in info["artifacts"]] if "artifacts" in info else []
+        self.artifacts = [Card(c_info, game.catalog) for c_info in info["artifacts"]] if "artifacts" in info else []
         self.can_be_clicked = info["can_be_clicked"] if "can_be_clicked" in info else 0
         self.damage_this_turn = info["damage_this_turn"] if "damage_this_turn" in info else 0
         self.damage_to_show = info["damage_to_show"] if "damage_to_show" in info else 0
-        self.deck = [Card(c_info) for c_info in info["deck"]] if "deck" in info else []
+        self.deck = [Card(c_info, game.catalog) for c_info in info["deck"]] if "deck" in info else []
         self.deck_id = info["deck_id"] if "deck_id" in info else None
         self.discipline = info["discipline"] if "discipline" in info else None
         self.deck_exhaustion = info["deck_exhaustion"] if "deck_exhaustion" in info else 0
-        self.hand = [Card(c_info) for c_info in info["hand"]] if "hand" in info else []
+        self.hand = [Card(c_info, game.catalog) for c_info in info["hand"]] if "hand" in info else []
         self.hit_points = info["hit_points"] if "hit_points" in info else Player.max_hit_points
-        # used for replays, todo: use a random seed to make replays easier per @silberman
-        self.initial_deck = [Card(c_info) for c_info in info["initial_deck"]] if "initial_deck" in info else []
-        self.in_play = [Card(c_info) for c_info in info["in_play"]] if "in_play" in info else []
+        # used for replays, because the deck the player joined with may have been edited since
+        self.initial_deck = [Card(c_info, game.catalog) for c_info in info["initial_deck"]] if "initial_deck" in info else []
+        self.in_play = [Card(c_info, game.catalog) for c_info in info["in_play"]] if "in_play" in info else []
         self.mana = info["mana"] if "about_to_draw_count" in info else 0
         self.max_mana = info["max_mana"] if "max_mana" in info else 0
-        self.played_pile = [Card(c_info) for c_info in info["played_pile"]] if "played_pile" in info else []
+        self.played_pile = [Card(c_info, game.catalog) for c_info in info["played_pile"]] if "played_pile" in info else []
         self.username = info["username"]
 
         if "card_info_to_target" in info:
@@ -48,7 +39,7 @@ class Player:
             self.card_info_to_target = None
             self.reset_card_info_to_target()
         if "card_choice_info" in info:
-            self.card_choice_info = {"cards": [Card(c_info) for c_info in info["card_choice_info"]["cards"]], "choice_type": info["card_choice_info"]["choice_type"], "effect_card_id": info["card_choice_info"]["effect_card_id"]}
+            self.card_choice_info = {"cards": [Card(c_info, game.catalog) for c_info in info["card_choice_info"]["cards"]], "choice_type": info["card_choice_info"]["choice_type"], "effect_card_id": info["card_choice_info"]["effect_card_id"]}
         else:
             self.card_choice_info = None
             self.reset_card_choice_info()
@@ -56,27 +47,36 @@ class Player:
     def __repr__(self):
         return f"{self.as_dict()}"
 
-    def as_dict(self):
+    def as_dict(self, compact=False, cached=False):
+        """
+            compact saves each card as an overlay on its definition, for storing the game rather than showing it.
+
+            cached reuses the dicts of cards that haven't changed since the last game snapshot, see Game.snapshot.
+        """
+        if cached:
+            card_dict = Card.snapshot_overlay_dict if compact else Card.snapshot_dict
+        else:
+            card_dict = Card.as_overlay_dict if compact else Card.as_dict
         return {
             "about_to_draw_count": self.about_to_draw_count,
-            "artifacts": [c.as_dict() for c in self.artifacts],
+            "artifacts": [card_dict(c) for c in self.artifacts],
             "can_be_clicked": self.can_be_clicked,
-            "card_choice_info": {"cards": [c.as_dict() for c in self.card_choice_info["cards"]], "choice_type": self.card_choice_info["choice_type"], "effect_card_id": self.card_choice_info["effect_card_id"] if "effect_card_id" in self.card_choice_info else None},
+            "card_choice_info": {"cards": [card_dict(c) for c in self.card_choice_info["cards"]], "choice_type": self.card_choice_info["choice_type"], "effect_card_id": self.card_choice_info["effect_card_id"] if "effect_card_id" in self.card_choice_info else None},
             "card_info_to_target": self.card_info_to_target,
             "damage_this_turn": self.damage_this_turn,
             "damage_to_show": self.damage_to_show,
-            "deck": [c.as_dict() for c in self.deck],
+            "deck": [card_dict(c) for c in self.deck],
             "deck_exhaustion": self.deck_exhaustion,
             "deck_id": self.deck_id,
             "discipline": self.discipline,
-            "hand": [c.as_dict() for c in self.hand],
+            "hand": [card_dict(c) for c in self.hand],
             "hit_points": self.hit_points,
-            "initial_deck": [c.as_dict() for c in self.initial_deck],
-            "in_play": [c.as_dict() for c in self.in_play],
+            "initial_deck": [card_dict(c) for c in self.initial_deck],
+            "in_play": [card_dict(c) for c in self.in_play],
             "is_ai": self.is_ai,
             "mana": self.mana,
             "max_mana": self.max_mana,
-            "played_pile": [c.as_dict() for c in self.played_pile],
+            "played_pile": [card_dict(c) for c in self.played_pile],
             "username": self.username,
         }
 
@@ -129,20 +129,17 @@ class Player:
     def mana_from_cards(self):
         for artifact in self.artifacts:
             for idx, effect in enumerate(artifact.effects_for_type("check_mana")):
-                artifact.resolve_effect(artifact.check_mana_effect_defs[idx], self, effect, {})
+                artifact.resolve_effect(artifact.effect_def("check_mana", idx), self, effect, {})
         mana = self.card_mana
         self.card_mana = 0
         return mana
 
     def add_to_deck(self, card_name, count, add_to_hand=False, card_cost=None, reduce_cost=0):
-        card = None
-        for c in Card.all_card_objects():
-            if c.name == card_name:
-                card = c
-        if not card:
+        catalog = self.game.catalog
+        if not catalog.card_named(card_name):
             print("Error: couldn't add_to_deck " + card_name)
         for x in range(0, count):
-            new_card = copy.deepcopy(card)
+            new_card = catalog.instantiate(card_name)
             if card_cost is not None:
                 new_card.cost = card_cost
             new_card.cost = max(0, new_card.cost-reduce_cost)
@@ -176,11 +173,11 @@ class Player:
                 self.hand.append(drawn_card)
                 for idx, effect in enumerate(drawn_card.effects_for_type("was_drawn")):
                     effect.show_effect_animation = True
-                    log_lines.append(drawn_card.resolve_effect(drawn_card.was_drawn_effect_defs[idx], self, effect, {})) 
+                    log_lines.append(drawn_card.resolve_effect(drawn_card.effect_def("was_drawn", idx), self, effect, {})) 
                 for m in self.in_play + self.artifacts + [drawn_card]:
                     for idx, effect in enumerate(m.effects_for_type("draw")):
                         effect.show_effect_animation = True
-                        log_lines.append(m.resolve_effect(m.draw_effect_defs[idx], self, effect, {})) 
+                        log_lines.append(m.resolve_effect(m.effect_def("draw", idx), self, effect, {})) 
         return log_lines if len(log_lines) > 0 else None
 
     def spend_mana(self, amount):
@@ -193,7 +190,7 @@ class Player:
         log_lines = None
         for artifact in self.artifacts:
             for idx, effect in enumerate(artifact.effects_for_type("spend_mana")):
-                log_lines = artifact.resolve_effect(artifact.spend_mana_effect_defs[idx], self, effect, {"amount_to_spend": amount_to_spend, "amount_spent": amount})
+                log_lines = artifact.resolve_effect(artifact.effect_def("spend_mana", idx), self, effect, {"amount_to_spend": amount_to_spend, "amount_spent": amount})
                 if log_lines:
                     effect.show_effect_animation = True
         return log_lines
@@ -280,7 +277,7 @@ class Player:
         to_resolve = self.game.stack.pop()
         spell_to_resolve = to_resolve[0]
         spell_to_resolve["log_lines"] = []
-        card = Card(to_resolve[1])
+        card = Card(to_resolve[1], self.game.catalog)
         return card.resolve(self, spell_to_resolve)
 
     def play_mob_or_artifact(self, card, spell_to_resolve, do_effects=True):
@@ -290,7 +287,7 @@ class Player:
             for c in self.in_play + self.artifacts:
                 for idx, effect in enumerate(c.effects_for_type("play_friendly_mob")):
                     effect.show_effect_animation = True
-                    spell_to_resolve["log_lines"].append(c.resolve_effect(c.play_friendly_mob_effect_defs[idx], self, effect, c.effect_targets(self, "play_friendly_mob")[0]))
+                    spell_to_resolve["log_lines"].append(c.resolve_effect(c.effect_def("play_friendly_mob", idx), self, effect, c.effect_targets(self, "play_friendly_mob")[0]))
 
             self.play_mob(card)
         elif card.card_type == Constants.artifactCardType:
@@ -337,7 +334,7 @@ class Player:
             effect_targets = card.effect_targets(self, "enter_play")
             message["effect_targets"] = effect_targets
             for idx, e in enumerate(effects):
-                message["log_lines"].append(card.resolve_effect(card.enter_play_effect_defs[idx], self, e, effect_targets[idx])) 
+                message["log_lines"].append(card.resolve_effect(card.effect_def("enter_play", idx), self, e, effect_targets[idx])) 
 
         return message
 
@@ -354,7 +351,7 @@ class Player:
                     message["effect_targets"].append({"id": message["username"], "target_type":"player"})
                 elif e.target_type == "opponent":           
                     message["effect_targets"].append({"id": self.my_opponent().username, "target_type":"player"})
-            message["log_lines"].append(card.resolve_effect(card.enter_play_effect_defs[idx], self, e, message["effect_targets"][idx])) 
+            message["log_lines"].append(card.resolve_effect(card.effect_def("enter_play", idx), self, e, message["effect_targets"][idx])) 
         
         self.reset_card_info_to_target()
         return message
@@ -384,7 +381,7 @@ class Player:
         self.about_to_draw_count = self.cards_each_turn()
         for card in self.in_play + self.artifacts:
             for idx, effect in enumerate(card.effects_for_type("before_draw")):
-                card.resolve_effect(card.before_draw_effect_defs[idx], self, effect, {})
+                card.resolve_effect(card.effect_def("before_draw", idx), self, effect, {})
         return self.about_to_draw_count
 
     def do_start_turn_card_effects(self, message):
@@ -395,7 +392,7 @@ class Player:
             card.can_activate_effects = True
             for idx, effect in enumerate(card.effects_for_type("start_turn")):
                 effect.show_effect_animation = True
-                message["log_lines"].append(card.resolve_effect(card.start_turn_effect_defs[idx], self, effect, {}))
+                message["log_lines"].append(card.resolve_effect(card.effect_def("start_turn", idx), self, effect, {}))
 
         for r in self.artifacts:
             r.can_activate_effects = True
@@ -676,7 +673,7 @@ class Player:
         if len(card.effects_for_type("sent_to_played_pile")) > 0:
             for idx, effect in enumerate(card.effects_for_type("sent_to_played_pile")):
                 effect.show_effect_animation = True
-                card.resolve_effect(card.sent_to_played_piled_effect_defs[idx], self, effect, {}) 
+                card.resolve_effect(card.effect_def("sent_to_played_pile", idx), self, effect, {}) 
         else:
             card = Card.factory_reset_card(card, player)
         if not card.is_token:
@@ -691,11 +688,11 @@ class Player:
         for e in self.in_play + self.artifacts:
             for idx, effect in enumerate(e.effects_for_type("mob_changes_zones")):
                 effect.show_effect_animation = True
-                e.resolve_effect(e.mob_changes_zones_effect_defs[idx], self, effect, {})                     
+                e.resolve_effect(e.effect_def("mob_changes_zones", idx), self, effect, {})                     
     
     def get_starting_deck(self):
         if len(self.initial_deck):
-            self.deck = self.initial_deck
+            self.deck = [card.copy() for card in self.initial_deck]
         else:
             card_names = []
             deck_to_use = self.deck_for_id_or_url(self.deck_id)
@@ -704,31 +701,9 @@ class Player:
                     card_names.append(key)
             for card_name in card_names:
                 self.add_to_deck(card_name, 1)
-            random.shuffle(self.deck)
-            self.initial_deck = copy.deepcopy(self.deck)
+            self.game.rng.shuffle(self.deck)
+            self.initial_deck = [card.copy() for card in self.deck]
             self.discipline = deck_to_use["discipline"]
 
     def deck_for_id_or_url(self, id_or_url):
-        try:
-            decks = Deck.objects.filter(owner=User.objects.get(username=self.username))
-        except ObjectDoesNotExist:
-            decks = []
-        deck_to_use = None
-        for d in decks:
-            if d.id == id_or_url:
-                deck_to_use = d.global_deck.deck_json
-        if id_or_url == "the_coven":
-            deck_to_use = default_deck_vampire_lich()
-        elif id_or_url == "keeper":
-            deck_to_use = default_deck_dwarf_tinkerer()
-        elif id_or_url == "townies":
-            deck_to_use = default_deck_dwarf_bard()
-        elif id_or_url == "draw_go":
-            deck_to_use = default_deck_genie_wizard()
-        elif id_or_url == "vanilla":
-            deck_to_use = default_deck()
-        else:
-            deck_to_use = deck_to_use if deck_to_use else default_deck()
-            # deck_to_use = deck_to_use if deck_to_use else random.choice([default_deck_genie_wizard(), default_deck_dwarf_tinkerer(), default_deck_dwarf_bard(), default_deck_vampire_lich()])
-
-        return deck_to_use
+        return self.game.deck_provider.deck_for_id_or_url(self.username, id_or_url)
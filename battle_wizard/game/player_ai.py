@@ -1,5 +1,4 @@
 import datetime
-import json
 import random
 import time
 from battle_wizard.game.player import Player
@@ -120,7 +119,7 @@ class PlayerAI(Player):
 
     def add_attack_and_play_card_moves(self, moves):
         for spell in self.game.stack:
-            card = Card(spell[1])
+            card = Card(spell[1], self.game.catalog)
             if card.can_be_clicked:
                 moves.append({"card":card.id, "move_type": "SELECT_STACK_SPELL", "username": self.username})
         for artifact in self.artifacts:
@@ -168,7 +167,7 @@ class PlayerAI(Player):
 
         print("AI playing " + str(chosen_move))
         chosen_move["log_lines"] = []
-        message = consumer.receive(json.dumps(chosen_move))
+        consumer.play_ai_move(chosen_move)
 
         self.ai_running = False
 
@@ -0,0 +1,38 @@
+def project_game(game_dict, username, is_reviewing=False):
+    """
+        Returns what the player named username gets to see of game_dict, a GameSnapshot's full dict.
+
+        The other players' hands, decks and pending card choices are replaced by card backs, which keep only
+        the ids of cards in hand, since those get targeted. The moves are replaced by move_count, and the initial decks are
+        only kept when is_reviewing. Spectators, whose username isn't a player's, see every hand as card backs.
+
+        The projection shares its cards with game_dict, so neither can be changed.
+    """
+    projection = {key: value for key, value in game_dict.items() if key != "moves"}
+    projection["move_count"] = len(game_dict["moves"])
+    projection["players"] = [project_player(player_dict, player_dict["username"] == username, is_reviewing) for player_dict in game_dict["players"]]
+    return projection
+
+
+def project_player(player_dict, is_viewer, is_reviewing):
+    projection = dict(player_dict)
+    if not is_reviewing:
+        del projection["initial_deck"]
+    if not is_viewer:
+        projection["hand"] = [{"id": card["id"]} for card in player_dict["hand"]]
+        projection["deck"] = [{} for card in player_dict["deck"]]
+        # a pending choice can be from the player's deck, such as a fetch_into_hand, or cards only they get to see
+        card_choice_info = player_dict["card_choice_info"]
+        projection["card_choice_info"] = dict(card_choice_info, cards=[{} for card in card_choice_info["cards"]])
+    return projection
+
+
+def viewer_key(username, game):
+    """
+        Returns the key of the projection the player named username sees: their username,
+        or "" for spectators, who all see the same projection.
+    """
+    for player in game.players:
+        if player.username == username:
+            return username
+    return ""
@@ -0,0 +1,115 @@
+import math
+
+from battle_wizard.models import GameRecord
+from battle_wizard.models import PlayerRating
+from django.db import transaction
+from django.utils import timezone
+
+# Glicko's scale factor, which puts ratings on the same scale as Elo's
+Q = math.log(10) / 400
+
+
+def g(deviation):
+    return 1 / math.sqrt(1 + 3 * Q ** 2 * deviation ** 2 / math.pi ** 2)
+
+
+def expected_score(rating, opponent_rating, opponent_deviation):
+    """
+        Returns the chance a player at rating beats a player at opponent_rating, counting a draw as half.
+    """
+    return 1 / (1 + 10 ** (-g(opponent_deviation) * (rating - opponent_rating) / 400))
+
+
+class RatingSystem:
+    """
+        Glicko ratings, updated one game at a time as games finish, rather than once per rating period.
+
+        A player's deviation is how unsure their rating is. It shrinks with each game, so a new player's
+        rating moves fast and a regular's slowly, and grows back by deviation_per_day while they don't
+        play. With the deviation held fixed, this is Elo with a K-factor of Q * deviation ** 2 * g(...).
+
+        The simulate_matchmaking command replays finished games to tune the parameters.
+    """
+
+    def __init__(self, initial_rating=1500, initial_deviation=350, min_deviation=30, deviation_per_day=35):
+        self.initial_rating = initial_rating
+        self.initial_deviation = initial_deviation
+        self.min_deviation = min_deviation
+        self.deviation_per_day = deviation_per_day
+
+    def current_deviation(self, deviation, date_played, now):
+        """
+            Returns the deviation of a player who last played at date_played, grown for the days since.
+        """
+        if date_played is None:
+            return self.initial_deviation
+        days = max((now - date_played).total_seconds(), 0) / 86400
+        return min(math.sqrt(deviation ** 2 + self.deviation_per_day ** 2 * days), self.initial_deviation)
+
+    def update(self, rating, deviation, opponent_rating, opponent_deviation, score):
+        """
+            Returns the player's (rating, deviation) after a game with score 1 for a win, 0.5 for a draw and 0 for a loss.
+        """
+        opponent_g = g(opponent_deviation)
+        expected = expected_score(rating, opponent_rating, opponent_deviation)
+        variance = 1 / (Q ** 2 * opponent_g ** 2 * expected * (1 - expected))
+        new_variance = 1 / (1 / deviation ** 2 + 1 / variance)
+        new_rating = rating + Q * new_variance * opponent_g * (score - expected)
+        return new_rating, max(math.sqrt(new_variance), self.min_deviation)
+
+    def rate(self, player_one, player_two, score, now):
+        """
+            Returns the players' new (rating, deviation), given each as (rating, deviation, date_played) and player one's score.
+        """
+        rating_one, deviation_one = player_one[0], self.current_deviation(player_one[1], player_one[2], now)
+        rating_two, deviation_two = player_two[0], self.current_deviation(player_two[1], player_two[2], now)
+        return (
+            self.update(rating_one, deviation_one, rating_two, deviation_two, score),
+            self.update(rating_two, deviation_two, rating_one, deviation_one, 1 - score),
+        )
+
+
+def rating_for_username(username):
+    """
+        Returns the rating of the user, or the initial rating if they haven't finished a rated game.
+    """
+    player_rating = PlayerRating.objects.filter(user__username=username).values_list("rating", flat=True).first()
+    return player_rating if player_rating is not None else RatingSystem().initial_rating
+
+
+def rate_game(game_record_id, player_one_id, player_two_id, winner_id, rating_system=None):
+    """
+        Updates the ratings of a finished pvp game's players, once per game, and returns whether it did.
+
+        winner_id is None for a draw. The players are passed in rather than read from the GameRecord,
+        since the GameWriter might not have saved the game's end yet.
+    """
+    if player_one_id is None or player_two_id is None or player_one_id == player_two_id:
+        return False
+    rating_system = rating_system if rating_system else RatingSystem()
+    now = timezone.now()
+    with transaction.atomic():
+        # flipping rated first takes the write lock, and makes sure the game is only rated once
+        if not GameRecord.objects.filter(id=game_record_id, rated=False).update(rated=True):
+            return False
+        player_ratings = []
+        for user_id in [player_one_id, player_two_id]:
+            PlayerRating.objects.get_or_create(user_id=user_id, defaults={"rating": rating_system.initial_rating, "deviation": rating_system.initial_deviation})
+            player_ratings.append(PlayerRating.objects.select_for_update().get(user_id=user_id))
+        if winner_id is None:
+            score = 0.5
+        else:
+            score = 1 if winner_id == player_one_id else 0
+        new_ratings = rating_system.rate(
+            (player_ratings[0].rating, player_ratings[0].deviation, player_ratings[0].date_played),
+            (player_ratings[1].rating, player_ratings[1].deviation, player_ratings[1].date_played),
+            score,
+            now,
+        )
+        for player_rating, (rating, deviation) in zip(player_ratings, new_ratings):
+            player_rating.rating = rating
+            player_rating.deviation = deviation
+            player_rating.games += 1
+            player_rating.date_played = now
+            player_rating.save()
+    return True
@@ -0,0 +1,56 @@
+from battle_wizard.game.card import copy_card_info
+from battle_wizard.game.game import Game
+
+
+class GameReplay:
+    """
+        Rebuilds a live game as it was after any number of its moves, for reviewing it.
+
+        Replaying is checkpointed: every checkpoint_interval moves, the replayed game is saved as a
+        compact dict, and going to move k restores the nearest checkpoint before k and replays only the
+        moves after it. Checkpoints and each move's log lines are taken the first time a move is
+        replayed, and stay valid as the live game goes on, because its moves are only ever appended.
+    """
+
+    def __init__(self, game, player_decks, checkpoint_interval=20):
+        self.game = game
+        self.player_decks = player_decks
+        self.checkpoint_interval = checkpoint_interval
+        # move count to the compact dict of the game after that many moves, without its moves
+        self.checkpoints = {}
+        # the log lines of each move replayed so far, by move index
+        self.move_log_lines = []
+
+    def game_at(self, move_count):
+        """
+            Returns the game after its first move_count moves, and the log lines of those moves.
+        """
+        moves = self.game.moves
+        move_count = min(move_count, len(moves))
+        start = max([c for c in self.checkpoints if c <= move_count], default=0)
+        if start:
+            info = copy_card_info(self.checkpoints[start])
+            info["moves"] = moves[:start]
+            review_game = Game("pvp", info=info, player_decks=self.player_decks, card_source=self.game.card_source, deck_provider=self.game.deck_provider)
+        else:
+            review_game = Game("pvp", info={"seed": self.game.seed}, player_decks=self.player_decks, card_source=self.game.card_source, deck_provider=self.game.deck_provider)
+
+        for index in range(start, move_count):
+            move = copy_card_info(moves[index])
+            if index < 2:
+                # the JOIN moves, replayed with the decks the players joined with
+                move["discipline"] = self.game.players[index].discipline
+                move["initial_deck"] = [c.as_overlay_dict() for c in self.game.players[index].initial_deck]
+            move["log_lines"] = []
+            message = review_game.play_move(move, should_add_to_move_list=True, is_reviewing=True)
+            if index == len(self.move_log_lines):
+                self.move_log_lines.append(message["log_lines"] if message else [])
+            if (index + 1) % self.checkpoint_interval == 0 and index + 1 not in self.checkpoints:
+                checkpoint = review_game.as_dict(compact=True)
+                del checkpoint["moves"]
+                self.checkpoints[index + 1] = checkpoint
+
+        log_lines = []
+        for move_log_lines in self.move_log_lines[:move_count]:
+            log_lines += move_log_lines
+        return review_game, log_lines
@@ -0,0 +1,171 @@
+import operator
+import re
+
+
+class Field:
+    """
+        One serialized attribute of a game object.
+
+        default is used when the attribute is missing from the info dict. Mutable defaults ([] and {}) are
+        written into the generated code as literals, so every object gets its own list or dict.
+
+        load is a Python expression that builds the attribute from `value`, the truthy value found in the
+        info dict, such as "[CardToken(t) for t in value]". It can refer to `self` and to the names in the
+        namespace the schema is compiled in. dump is the matching expression for as_dict, where `value`
+        is the attribute.
+
+        lazy fields are left as None by hydrate_overlay when the overlay doesn't have them, so the class can
+        build them from its definition on first use. overlay_dump is the expression as_overlay_dict uses for
+        them, which returns None when the attribute still matches the definition.
+    """
+
+    def __init__(self, name, default=None, load=None, dump=None, serialize=True, hydrate=True, builder=False, builder_dump=None, lazy=False, overlay_dump=None):
+        self.name = name
+        self.default = default
+        self.load = load
+        self.dump = dump
+        # False for attributes that are hydrated but never sent to the client or saved
+        self.serialize = serialize
+        # False for attributes the class sets itself, like CardEffect.id_for_game
+        self.hydrate = hydrate
+        # True for attributes included in as_dict(for_card_builder=True), dumped with builder_dump if given
+        self.builder = builder
+        self.builder_dump = builder_dump
+        self.lazy = lazy
+        self.overlay_dump = overlay_dump
+
+    def default_source(self):
+        if self.default == []:
+            return "[]"
+        if self.default == {}:
+            return "{}"
+        return repr(self.default)
+
+    def copy_source(self, expression):
+        # a shallow copy for mutable attributes, so objects hydrated from the same dict don't share them
+        if self.default == []:
+            return f"list({expression})"
+        if self.default == {}:
+            return f"dict({expression})"
+        return expression
+
+
+class Schema:
+    """
+        A declarative list of Fields for a class, used for both directions.
+
+        compile() gives the class __slots__-compatible attribute names, plus a generated hydrate(self, info)
+        that replaces the `info["x"] if "x" in info else default` lines in __init__, and a generated
+        as_dict(self, for_card_builder=False).
+
+        For classes backed by shared definitions, compile() also generates hydrate_overlay(self, info, base)
+        and as_overlay_dict(self), where base is the definition's full dict and the overlay holds only the
+        attributes that differ from it.
+    """
+
+    def __init__(self, fields, extra_slots=None):
+        self.fields = fields
+        self.extra_slots = extra_slots if extra_slots else []
+
+    def slots(self):
+        return tuple([f.name for f in self.fields if not f.lazy] + self.extra_slots)
+
+    def snapshot_key(self):
+        """
+            Returns a function that gives an object's serialized attributes, other than lazy ones, plus its
+            definition if it has one, as a tuple.
+
+            Two equal tuples mean the object serializes the same, as long as its lazy attributes weren't
+            built and its list and dict attributes weren't changed in place, which callers have to check.
+        """
+        names = [f.name for f in self.fields if f.serialize and not f.lazy]
+        if "definition" in self.extra_slots:
+            names.append("definition")
+        return operator.attrgetter(*names)
+
+    def hydrate_source(self):
+        lines = ["def hydrate(self, info):", "    get = info.get"]
+        # plain fields first, so load expressions can use them (the Card's effects need self.id)
+        for f in [f for f in self.fields if f.hydrate and not f.load]:
+            lines.append(f"    self.{f.name} = get({f.name!r}, {f.default_source()})")
+        for f in [f for f in self.fields if f.hydrate and f.load]:
+            lines.append(f"    value = get({f.name!r})")
+            lines.append(f"    self.{f.name} = ({f.load}) if value else {f.default_source()}")
+        return "\n".join(lines)
+
+    def hydrate_overlay_source(self):
+        lines = ["def hydrate_overlay(self, info, base):", "    get = info.get"]
+        for f in [f for f in self.fields if not f.serialize and f.hydrate]:
+            lines.append(f"    self.{f.name} = get({f.name!r}, {f.default_source()})")
+        for f in [f for f in self.fields if f.serialize and not f.load]:
+            lines.append(f"    self.{f.name} = {f.copy_source(f'get({f.name!r}) if {f.name!r} in info else base[{f.name!r}]')}")
+        for f in [f for f in self.fields if f.serialize and f.load]:
+            if f.lazy:
+                lines.append(f"    value = get({f.name!r})")
+                lines.append(f"    self.{f.name} = (({f.load}) if value else {f.default_source()}) if {f.name!r} in info else None")
+            else:
+                lines.append(f"    value = get({f.name!r}) if {f.name!r} in info else base[{f.name!r}]")
+                lines.append(f"    self.{f.name} = ({f.load}) if value else {f.default_source()}")
+        return "\n".join(lines)
+
+    def as_overlay_dict_source(self):
+        lines = [
+            "def as_overlay_dict(self):",
+            "    if not self.has_overlay():",
+            "        return self.as_dict()",
+            "    base = self.definition.info",
+            "    overlay = {'definition': base['name'], 'definition_hash': self.definition.content_hash}",
+        ]
+        for f in [f for f in self.fields if f.serialize]:
+            if f.lazy:
+                lines.append(f"    value = {f.overlay_dump}")
+                lines.append(f"    if value is not None:")
+            else:
+                lines.append(f"    value = self.{f.name}")
+                if f.dump:
+                    lines.append(f"    value = {f.dump}")
+                lines.append(f"    if value != base[{f.name!r}]:")
+            lines.append(f"        overlay[{f.name!r}] = value")
+        lines.append("    return overlay")
+        return "\n".join(lines)
+
+    def as_dict_source(self):
+        lines = ["def as_dict(self, for_card_builder=False):", "    if for_card_builder:"]
+        builder_fields = [(f, f.builder_dump if f.builder_dump else f.dump) for f in self.fields if f.builder]
+        lines += self.dict_source_lines(builder_fields, "        ")
+        lines += self.dict_source_lines([(f, f.dump) for f in self.fields if f.serialize], "    ")
+        return "\n".join(lines)
+
+    def dict_source_lines(self, fields_and_dumps, indent):
+        # attributes with a dump expression are read into locals first, so the expression can use them more than once
+        lines = []
+        for f, dump in fields_and_dumps:
+            if dump and re.search(r"\bvalue\b", dump):
+                lines.append(f"{indent}value_{f.name} = self.{f.name}")
+        lines.append(f"{indent}return {{")
+        for f, dump in fields_and_dumps:
+            expression = re.sub(r"\bvalue\b", f"value_{f.name}", dump) if dump else f"self.{f.name}"
+            lines.append(f"{indent}    {f.name!r}: {expression},")
+        lines.append(f"{indent}}}")
+        return lines
+
+    def compile(self, cls, namespace):
+        """
+            Sets the generated hydrate and as_dict methods on cls, plus hydrate_overlay and as_overlay_dict
+            if the class has a definition slot.
+
+            namespace is usually the globals() of the module cls is defined in, so load and dump
+            expressions can refer to the module's classes.
+        """
+        sources = [self.hydrate_source(), self.as_dict_source()]
+        if "definition" in self.extra_slots:
+            sources += [self.hydrate_overlay_source(), self.as_overlay_dict_source()]
+        for source in sources:
+            code = compile(source, f"<schema {cls.__name__}>", "exec")
+            local_namespace = {}
+            exec(code, namespace, local_namespace)
+            for name, function in local_namespace.items():
+                function.__qualname__ = f"{cls.__name__}.{name}"
+                setattr(cls, name, function)
+        cls.schema = self
+        return cls
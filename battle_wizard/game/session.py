@@ -0,0 +1,557 @@
+import atexit
+import json
+import threading
+import time
+
+from battle_wizard.game.actor import RoomActor
+from battle_wizard.game.card import copy_card_info
+from battle_wizard.game.clock import TurnClock
+from battle_wizard.game.delta import GameDeltas
+from battle_wizard.game.game import Game
+from battle_wizard.models import GameJournalGap
+from battle_wizard.models import GameMove
+from battle_wizard.models import GameRecord
+from django.conf import settings
+from django.db import IntegrityError
+from django.db import close_old_connections
+from django.db import transaction
+
+
+class GameSession:
+    """
+        A live game, kept hydrated in memory while any consumer is connected to its room.
+
+        Consumers in the same room share the session's Game and GameRecord, so a move only costs the
+        engine work, instead of a GameRecord query and a Game rebuilt from game_json.
+    """
+
+    def __init__(self, game_record, game):
+        self.game_record = game_record
+        self.game = game
+        # held while playing a move, re-entrant because the AI plays its moves from inside the consumer's engine work
+        self.lock = threading.RLock()
+        # the number of consumers that opened the session and haven't closed it
+        self.connections = 0
+        # when the oldest move not yet saved by the GameWriter was played, or None if the game is saved
+        self.dirty_since = None
+        self.unsaved_moves = 0
+        # the GameWriter's failed saves in a row, and when it can try again
+        self.flush_failures = 0
+        self.retry_at = None
+        # game.moves before this index have been written to the GameMove journal
+        self.journaled_moves = len(game.moves)
+        # the GameReplay for reviewing the game, made on the first review
+        self.replay = None
+        # the usernames of the clients connected to the room, counted per connection
+        self.viewers = {}
+        # a GameDeltas for each viewer_key, which numbers the projections sent to it and diffs each against the last
+        self.deltas = {}
+        # pushes the turn clock to the room once the game starts
+        self.clock = TurnClock(game)
+        # set while the RoomAffinity hands the room over to another worker, which drops its moves
+        self.handing_over = False
+        # applies the consumers' moves in order
+        self.actor = RoomActor(self)
+        # set by the GameWriter when somebody else saved the GameRecord, until the session reloads it
+        self.stale = False
+        # set by the GameSessions that loaded the session
+        self.writer = None
+
+    def add_viewer(self, username):
+        self.viewers[username] = self.viewers.get(username, 0) + 1
+
+    def remove_viewer(self, username):
+        self.viewers[username] -= 1
+        if not self.viewers[username]:
+            del self.viewers[username]
+
+    def deltas_for(self, key):
+        if key not in self.deltas:
+            self.deltas[key] = GameDeltas()
+        return self.deltas[key]
+
+    @staticmethod
+    def load(game_record_id, player_type, player_decks):
+        """
+            Returns a session for the GameRecord, recovered from its snapshot and move journal.
+
+            game_json is a snapshot of the game as of the move at its last_seq, without the moves
+            themselves. Those come from the GameMove journal, and the moves journaled after the
+            snapshot get replayed onto it. Games saved before the journal keep their moves in game_json.
+            Raises GameJournalGap if the journal is missing a seq, rather than rebuild the wrong game.
+        """
+        game_record = GameRecord.objects.get(id=game_record_id)
+        info = game_record.game_json
+        info["game_record_id"] = game_record_id
+        tail = []
+        if "moves" not in info:
+            journal = list(GameMove.objects.filter(game_record=game_record).order_by("seq").values_list("seq", "move_json"))
+            snapshot_moves = info["last_seq"] + 1 if "last_seq" in info else 0
+            seqs = [seq for seq, _ in journal]
+            if seqs != list(range(0, len(seqs))) or len(seqs) < snapshot_moves:
+                raise GameJournalGap(f"game {game_record_id} has journaled seqs {seqs[:3]}...{seqs[-3:]} of {len(seqs)}, and its snapshot is at seq {snapshot_moves - 1}")
+            moves = [move_json for _, move_json in journal]
+            info["moves"] = moves[:snapshot_moves]
+            tail = moves[snapshot_moves:]
+        game = Game(player_type, info=info, player_decks=player_decks)
+        for move in tail:
+            move["log_lines"] = []
+            game.play_move(move, should_add_to_move_list=True)
+        return GameSession(game_record, game)
+
+    def reload(self):
+        """
+            Reloads the game from its GameRecord and journal, and replays the moves this session played
+            that the saved game doesn't have yet, then returns how many that was.
+
+            Call this with the lock held, after somebody else saved the GameRecord.
+        """
+        loaded = GameSession.load(self.game_record.id, self.game.player_type, self.game.player_decks)
+        moves = copy_card_info(self.game.moves[len(loaded.game.moves):])
+        for move in moves:
+            move["log_lines"] = []
+            loaded.game.play_move(move, should_add_to_move_list=True)
+        # fields this session set that the saved record doesn't have yet, such as the players when the game started
+        for field in ["date_started", "player_one_id", "player_two_id", "player_one_deck_id", "player_two_deck_id", "winner_id", "date_finished"]:
+            if getattr(loaded.game_record, field) is None:
+                setattr(loaded.game_record, field, getattr(self.game_record, field))
+        self.game_record = loaded.game_record
+        self.game = loaded.game
+        self.journaled_moves = loaded.journaled_moves
+        self.clock.game = self.game
+        self.replay = None
+        self.stale = False
+        return len(moves)
+
+    def reload_if_stale(self):
+        """
+            Reloads the game if the GameWriter found that somebody else saved it, and saves the result.
+
+            Consumers call this with the lock held before their moves, so no move is played on a stale game.
+        """
+        if not self.stale:
+            return
+        moves = self.reload()
+        print(f"Reloaded game {self.game_record.id} at version {self.game_record.state_version}, and replayed {moves} moves onto it")
+        if self.writer:
+            self.writer.mark_dirty(self, flush=True)
+
+
+class GameSessions:
+    """
+        The process-wide registry of live GameSessions, keyed by GameRecord id.
+
+        A session is loaded from the database when the first consumer opens it, which is either the
+        start of a match or a cold start after a restart or failover, and dropped when the last one closes.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, writer=None):
+        self.lock = threading.Lock()
+        self.sessions = {}
+        # game_record_id -> the lock held while its session loads, so the registry lock isn't held through the load
+        self.loading = {}
+        self.writer = writer if writer else GameWriter()
+        self.writer.sessions = self
+
+    @staticmethod
+    def shared():
+        """
+            Returns the registry shared by everything in this process.
+        """
+        if GameSessions._shared is None:
+            with GameSessions._shared_lock:
+                if GameSessions._shared is None:
+                    GameSessions._shared = GameSessions()
+                    # save unsaved moves when the server shuts down
+                    atexit.register(GameSessions._shared.writer.stop)
+        return GameSessions._shared
+
+    def open(self, game_record_id, player_type, player_decks):
+        """
+            Returns the live session for game_record_id, loading it if needed, and counts the caller as connected.
+        """
+        game_record_id = int(game_record_id)
+        with self.lock:
+            session = self.sessions.get(game_record_id)
+            if session is not None:
+                session.connections += 1
+                return session
+            load_lock = self.loading.setdefault(game_record_id, threading.Lock())
+
+        # only one caller loads each session, while opening other sessions goes on
+        with load_lock:
+            with self.lock:
+                session = self.sessions.get(game_record_id)
+                if session is not None:
+                    session.connections += 1
+                    return session
+            # if the load raises, the next caller tries again with the same load_lock
+            session = GameSession.load(game_record_id, player_type, player_decks)
+            session.writer = self.writer
+            with self.lock:
+                self.sessions[game_record_id] = session
+                session.connections += 1
+                del self.loading[game_record_id]
+            return session
+
+    def close(self, session):
+        """
+            Counts one caller of open() as disconnected and saves the session.
+
+            The session is dropped after the last caller closes it, once the GameWriter has saved it,
+            so an open() in the meantime gets the live session instead of a stale game_json.
+        """
+        with self.lock:
+            session.connections -= 1
+        self.writer.request_flush(session)
+        self.flushed(session)
+
+    def flushed(self, session):
+        """
+            Called by the GameWriter after saving a session, drops the session if nobody has it open.
+        """
+        with self.lock:
+            if session.connections <= 0 and session.dirty_since is None and self.sessions.get(session.game_record.id) is session:
+                del self.sessions[session.game_record.id]
+                session.clock.stop()
+
+    def get(self, game_record_id):
+        with self.lock:
+            return self.sessions.get(int(game_record_id))
+
+    def ids(self):
+        with self.lock:
+            return list(self.sessions)
+
+    def live(self):
+        with self.lock:
+            return list(self.sessions.values())
+
+    def evict(self, game_record_id):
+        """
+            Drops a session regardless of its connections, so the next open() reloads it from the database.
+        """
+        with self.lock:
+            session = self.sessions.pop(int(game_record_id), None)
+        if session:
+            session.clock.stop()
+
+
+class GameWriter:
+    """
+        Saves dirty GameSessions to their GameRecords on a background thread (write-behind).
+
+        Each move in game.moves is appended to the GameMove journal as soon as the thread gets to it.
+        A snapshot of the game, without its moves, is saved to game_json once the session has
+        flush_moves unsaved moves, once its oldest unsaved move is flush_seconds old, when its game ends,
+        and when a consumer disconnects from it. Raising either limit trades recovery time, the journal
+        tail that has to be replayed, for fewer database writes.
+
+        Snapshots are saved with GameRecord.save_version(), so if somebody else saved the record since
+        the session loaded it, the save is dropped and the session marked stale, and the session reloads
+        the record and replays its moves onto it before its next move, or right away if nobody is connected.
+
+        metrics() reports how far behind the database was when each snapshot landed, how many bytes
+        of snapshots and journal rows got written, and how many saves conflicted.
+    """
+
+    def __init__(self, flush_moves=None, flush_seconds=None, retry_seconds=None):
+        self.flush_moves = flush_moves if flush_moves else getattr(settings, "GAME_FLUSH_MOVES", 10)
+        self.flush_seconds = flush_seconds if flush_seconds is not None else getattr(settings, "GAME_FLUSH_SECONDS", 5)
+        self.retry_seconds = retry_seconds if retry_seconds is not None else getattr(settings, "GAME_FLUSH_RETRY_SECONDS", 1)
+        self.max_retry_seconds = getattr(settings, "GAME_FLUSH_RETRY_MAX_SECONDS", 60)
+        # set by the GameSessions that owns the writer
+        self.sessions = None
+        self.condition = threading.Condition()
+        self.dirty = set()
+        # sessions waiting on a snapshot, and sessions that only need their new moves journaled
+        self.pending = []
+        self.journal_pending = []
+        # the number of sessions being saved right now, so drain() can wait on them
+        self.flushing = 0
+        self.thread = None
+        self.stopping = False
+        self.flushes = 0
+        self.bytes_written = 0
+        self.journal_rows = 0
+        self.journal_bytes_written = 0
+        self.total_flush_lag = 0
+        self.max_flush_lag = 0
+        self.last_flush_lag = 0
+        self.conflicts = 0
+        self.failures = 0
+
+    def mark_dirty(self, session, flush=False):
+        """
+            Records a move played on session, and schedules a save if the flush policy calls for one.
+
+            Call this with session.lock held. flush=True saves as soon as possible, such as at game end.
+        """
+        with self.condition:
+            if session.dirty_since is None:
+                session.dirty_since = time.monotonic()
+            session.unsaved_moves += 1
+            self.dirty.add(session)
+            if flush or session.unsaved_moves >= self.flush_moves:
+                self.enqueue(session)
+            elif session not in self.journal_pending:
+                self.journal_pending.append(session)
+            self.start()
+            self.condition.notify()
+
+    def request_flush(self, session):
+        """
+            Schedules a save of session, if it has unsaved moves.
+        """
+        with self.condition:
+            if session in self.dirty:
+                self.enqueue(session)
+                self.start()
+                self.condition.notify()
+
+    def enqueue(self, session, retrying=False):
+        # a session whose save failed waits out its backoff, then seconds_until_due() makes it due
+        if not retrying and session.retry_at is not None and session.retry_at > time.monotonic():
+            return
+        if session not in self.pending:
+            self.pending.append(session)
+
+    def start(self):
+        if self.thread is None:
+            self.stopping = False
+            self.thread = threading.Thread(target=self.run, name="game-writer", daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.journal_pending and not self.stopping:
+                    timeout = self.seconds_until_due()
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self.condition.wait(timeout)
+                now = time.monotonic()
+                for session in self.dirty:
+                    if session.dirty_since is not None and now >= self.due_at(session):
+                        self.enqueue(session)
+                if self.stopping:
+                    for session in self.dirty:
+                        self.enqueue(session, retrying=True)
+                batch = [(session, self.flush) for session in self.pending]
+                batch += [(session, self.journal) for session in self.journal_pending if session not in self.pending]
+                self.pending = []
+                self.journal_pending = []
+                self.flushing += len(batch)
+                if not batch and self.stopping:
+                    self.thread = None
+                    self.condition.notify_all()
+                    return
+            for session, save in batch:
+                try:
+                    save(session)
+                except Exception as e:
+                    print(f"Error saving game {session.game_record.id}: {e}")
+                finally:
+                    with self.condition:
+                        self.flushing -= 1
+                        self.condition.notify_all()
+            close_old_connections()
+
+    def seconds_until_due(self):
+        """
+            Returns the seconds until the oldest unsaved move is due to be saved, or None if nothing is unsaved.
+        """
+        due = [self.due_at(session) for session in self.dirty if session.dirty_since is not None]
+        if not due:
+            return None
+        return min(due) - time.monotonic()
+
+    def due_at(self, session):
+        # a session whose save failed was already due, and is due again once its backoff runs out
+        if session.retry_at is not None:
+            return session.retry_at
+        return session.dirty_since + self.flush_seconds
+
+    def journal(self, session):
+        """
+            Appends the session's moves that aren't journaled yet to the GameMove journal.
+        """
+        with session.lock:
+            game_moves = self.unjournaled_moves(session)
+        try:
+            self.write_journal(session, game_moves)
+        except IntegrityError:
+            # somebody else journaled moves at the same seqs
+            self.conflict(session, session.game_record.state_version)
+
+    def conflict(self, session, state_version):
+        with self.condition:
+            self.conflicts += 1
+        with session.lock:
+            session.stale = True
+            if session.connections > 0:
+                print(f"Game {session.game_record.id} was saved by somebody else since version {state_version}, it gets reloaded before its next move")
+                return
+            # nobody is connected to play a next move, so reload and save it now, or it's never saved
+            print(f"Game {session.game_record.id} was saved by somebody else since version {state_version}, and nobody is connected, reloading it")
+            try:
+                session.reload_if_stale()
+                return
+            except Exception as e:
+                print(f"Error reloading game {session.game_record.id}, dropping it so the next open() loads it from the database: {e}")
+        if self.sessions:
+            self.sessions.evict(session.game_record.id)
+
+    def unjournaled_moves(self, session):
+        # call with session.lock held, the moves get copied so they can be written after releasing it
+        first_seq = session.journaled_moves
+        moves = copy_card_info(session.game.moves[first_seq:])
+        return [GameMove(game_record_id=session.game_record.id, seq=first_seq + index, move_json=move) for index, move in enumerate(moves)]
+
+    def write_journal(self, session, game_moves):
+        """
+            Inserts the GameMoves, then counts them as journaled, so moves whose insert failed get written again next time.
+        """
+        if not game_moves:
+            return
+        with transaction.atomic():
+            GameMove.objects.bulk_create(game_moves)
+        with session.lock:
+            # unless the session reloaded in the meantime, and counted the journal again
+            if session.journaled_moves == game_moves[0].seq:
+                session.journaled_moves += len(game_moves)
+        bytes_written = sum([len(json.dumps(game_move.move_json)) for game_move in game_moves])
+        with self.condition:
+            self.journal_rows += len(game_moves)
+            self.journal_bytes_written += bytes_written
+
+    def flush(self, session):
+        """
+            Journals the session's new moves and saves a snapshot of its game, if it has unsaved moves.
+
+            The game is serialized under the session's lock, but written after releasing it,
+            so moves can keep being played while the database writes are in flight.
+        """
+        with session.lock:
+            if session.dirty_since is None:
+                return
+            game_moves = self.unjournaled_moves(session)
+            # a copy of the snapshot the move was broadcast with, whose cards are shared and mustn't be changed
+            game_json = dict(session.game.snapshot().compact)
+            # the moves are in the journal, the snapshot only says how many of them it includes
+            game_json["last_seq"] = len(game_json.pop("moves")) - 1
+            game_record = session.game_record
+            state_version = game_record.state_version
+            fields = {field: getattr(game_record, field) for field in ["date_started", "date_finished", "player_one_id", "player_two_id", "player_one_deck_id", "player_two_deck_id", "winner_id"]}
+            fields["game_json"] = game_json
+            dirty_since = session.dirty_since
+            snapshot_at = time.monotonic()
+            saving_moves = session.unsaved_moves
+
+        # journal first, so the snapshot's last_seq is never ahead of the journal
+        try:
+            self.write_journal(session, game_moves)
+            saved = GameRecord.save_version(game_record.id, state_version, **fields)
+        except IntegrityError:
+            # somebody else journaled moves at the same seqs
+            saved = False
+        except Exception as e:
+            # the session stays dirty, and gets saved again after a backoff
+            self.retry_later(session, e)
+            return
+        with session.lock:
+            # moves played while the snapshot was being written stay unsaved
+            session.unsaved_moves = max(session.unsaved_moves - saving_moves, 0) if saved else 0
+            session.dirty_since = snapshot_at if session.unsaved_moves else None
+            session.flush_failures = 0
+            session.retry_at = None
+            with self.condition:
+                if session.dirty_since is None:
+                    self.dirty.discard(session)
+            if saved and session.game_record is game_record:
+                game_record.state_version = state_version + 1
+        if not saved:
+            # the session reloads, and saves again, before its next move
+            self.conflict(session, state_version)
+            return
+
+        flush_lag = time.monotonic() - dirty_since
+        bytes_written = len(json.dumps(game_json))
+        with self.condition:
+            self.flushes += 1
+            self.bytes_written += bytes_written
+            self.total_flush_lag += flush_lag
+            self.max_flush_lag = max(self.max_flush_lag, flush_lag)
+            self.last_flush_lag = flush_lag
+        if self.sessions:
+            self.sessions.flushed(session)
+
+    def retry_later(self, session, error):
+        with session.lock:
+            session.flush_failures += 1
+            backoff = min(self.retry_seconds * 2 ** (session.flush_failures - 1), self.max_retry_seconds)
+            session.retry_at = time.monotonic() + backoff
+        with self.condition:
+            self.failures += 1
+            if self.stopping:
+                # stop() doesn't wait out the backoff, the moves since the last snapshot are lost
+                print(f"Error saving game {session.game_record.id} while stopping, it is left unsaved: {error}")
+                self.dirty.discard(session)
+                return
+            print(f"Error saving game {session.game_record.id}, retrying in {backoff} seconds: {error}")
+            self.dirty.add(session)
+            self.condition.notify()
+
+    def wait(self):
+        """
+            Waits until the saves already scheduled finish, without scheduling the other dirty sessions.
+        """
+        with self.condition:
+            while self.pending or self.journal_pending or self.flushing:
+                self.condition.wait()
+
+    def drain(self):
+        """
+            Saves every dirty session now, and waits until the saves finish.
+        """
+        with self.condition:
+            for session in self.dirty:
+                self.enqueue(session)
+            if self.pending:
+                self.start()
+                self.condition.notify()
+            while self.pending or self.journal_pending or self.flushing:
+                self.condition.wait()
+
+    def stop(self):
+        """
+            Saves every dirty session, then stops the background thread.
+        """
+        with self.condition:
+            if self.thread is None:
+                return
+            self.stopping = True
+            self.condition.notify()
+            while self.thread is not None:
+                self.condition.wait()
+
+    def metrics(self):
+        """
+            Returns the writer's counters as a dict, with flush lags in seconds.
+        """
+        with self.condition:
+            return {
+                "dirty_sessions": len(self.dirty),
+                "flushes": self.flushes,
+                "bytes_written": self.bytes_written,
+                "journal_rows": self.journal_rows,
+                "journal_bytes_written": self.journal_bytes_written,
+                "mean_flush_lag": self.total_flush_lag / self.flushes if self.flushes else 0,
+                "max_flush_lag": self.max_flush_lag,
+                "last_flush_lag": self.last_flush_lag,
+                "conflicts": self.conflicts,
+                "failures": self.failures,
+            }
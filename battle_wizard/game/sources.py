@@ -0,0 +1,163 @@
+import json
+import os
+import threading
+
+from battle_wizard.game.data import default_deck
+from battle_wizard.game.data import default_deck_dwarf_bard
+from battle_wizard.game.data import default_deck_dwarf_tinkerer
+from battle_wizard.game.data import default_deck_genie_wizard
+from battle_wizard.game.data import default_deck_vampire_lich
+
+
+class CardSource:
+    """
+        Where a CardCatalog reads its cards from: the card JSON files that ship with the game, plus cards.
+
+        cards is a list of extra card dicts, like the custom cards from the card builder, which replace
+        any built-in card with the same name. The engine only needs this class, so it runs without Django;
+        the server uses CustomCardSource from django_sources, which reads the cards from the CustomCard table.
+
+        Each source gets its own CardCatalog, from CardCatalog.for_source(), so games can run with a
+        card pool under test while the server's shared catalog stays the same.
+
+        A source whose cards can change in another process returns something that changes with them from
+        version(), which its catalog checks at most every version_seconds, and reloads when it differs.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    card_files = [
+        os.path.join(os.path.dirname(__file__), "battle_wizard_cards.json"),
+        os.path.join(os.path.dirname(__file__), "old_cards.json"),
+    ]
+    cards_and_effects_file = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "create_cards", "cards_and_effects.json")
+    # how often the catalog checks version(), or None if it never changes
+    version_seconds = None
+    # how many definitions of changed or deleted cards, from saved games, the catalog keeps
+    saved_definitions_limit = 1000
+
+    def __init__(self, cards=None):
+        self.cards = cards if cards else []
+
+    @staticmethod
+    def shared():
+        """
+            Returns the source of the process-wide CardCatalog, which only has the built-in cards unless set_shared() was called.
+        """
+        if CardSource._shared is None:
+            with CardSource._shared_lock:
+                if CardSource._shared is None:
+                    CardSource._shared = CardSource()
+        return CardSource._shared
+
+    @staticmethod
+    def set_shared(card_source):
+        with CardSource._shared_lock:
+            CardSource._shared = card_source
+
+    def card_infos(self):
+        """
+            Returns (card_info, is_old_card, is_custom) for each card, in the order the catalog lists them.
+        """
+        infos = []
+        for path in self.card_files:
+            with open(path) as json_data:
+                for c in json.load(json_data):
+                    infos.append((c, True, False))
+
+        with open(self.cards_and_effects_file) as json_data:
+            cards_and_effects = json.load(json_data)
+        for c in cards_and_effects["cards"]:
+            c["discipline"] = "magic"
+            infos.append((c, False, False))
+
+        for c in self.custom_cards():
+            c["discipline"] = "magic"
+            infos.append((c, False, True))
+        return infos
+
+    def custom_cards(self):
+        return [dict(c) for c in self.cards]
+
+    def version(self):
+        """
+            Returns a value that changes when the cards change, or None if they only change in this process.
+        """
+        return None
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        # copies of a Game keep using the same source
+        return self
+
+
+class DeckProvider:
+    """
+        Looks up the deck a player joins a game with, by the deck_id the player joined with.
+
+        decks maps deck ids to deck dicts, with a "cards" dict of card names to counts and a "discipline".
+        The urls of the starter decks, like "vanilla", always give the starter deck, and any other id that
+        isn't in decks gives the default deck. The server uses DatabaseDeckProvider from django_sources,
+        which looks up the player's saved Decks instead of decks.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, decks=None):
+        self.decks = decks if decks else {}
+
+    @staticmethod
+    def shared():
+        """
+            Returns the DeckProvider games use when none is passed in, which only has the starter decks unless set_shared() was called.
+        """
+        if DeckProvider._shared is None:
+            with DeckProvider._shared_lock:
+                if DeckProvider._shared is None:
+                    DeckProvider._shared = DeckProvider()
+        return DeckProvider._shared
+
+    @staticmethod
+    def set_shared(deck_provider):
+        with DeckProvider._shared_lock:
+            DeckProvider._shared = deck_provider
+
+    def deck_for_id_or_url(self, username, id_or_url):
+        """
+            Returns the deck dict for the id or starter deck url, for the player with username.
+        """
+        deck_to_use = self.player_deck(username, id_or_url)
+        if id_or_url == "the_coven":
+            deck_to_use = default_deck_vampire_lich()
+        elif id_or_url == "keeper":
+            deck_to_use = default_deck_dwarf_tinkerer()
+        elif id_or_url == "townies":
+            deck_to_use = default_deck_dwarf_bard()
+        elif id_or_url == "draw_go":
+            deck_to_use = default_deck_genie_wizard()
+        elif id_or_url == "vanilla":
+            deck_to_use = default_deck()
+        else:
+            deck_to_use = deck_to_use if deck_to_use else default_deck()
+            # deck_to_use = deck_to_use if deck_to_use else random.choice([default_deck_genie_wizard(), default_deck_dwarf_tinkerer(), default_deck_dwarf_bard(), default_deck_vampire_lich()])
+        return deck_to_use
+
+    def player_deck(self, username, deck_id):
+        """
+            Returns the player's own deck with deck_id, or None if they don't have one.
+        """
+        try:
+            return self.decks.get(deck_id)
+        except TypeError:
+            # the pvai bot joins with a deck dict rather than an id
+            return None
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
@@ -0,0 +1,55 @@
+import json
+import time
+
+from battle_wizard.game.game import Game
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Time rebuilding a Game from its saved dict, the way the consumer does for every move."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=200)
+        parser.add_argument("--turns", type=int, default=6, help="turns to play before taking the snapshot")
+
+    def handle(self, *args, **options):
+        game = Game("pvp", info={}, player_decks=[[], []])
+        game.play_move({"username": "benchmark_a", "move_type": "JOIN"})
+        game.play_move({"username": "benchmark_b", "move_type": "JOIN"})
+        for x in range(0, options["turns"]):
+            game.play_move({"username": game.current_player().username, "move_type": "END_TURN"})
+        game_json = json.dumps(game.as_dict())
+        card_count = sum([len(p.deck) + len(p.hand) + len(p.initial_deck) + len(p.played_pile) + len(p.in_play) for p in game.players])
+
+        iterations = options["iterations"]
+        self.stdout.write(f"cards in game: {card_count}")
+        self.time_snapshot("full snapshot", game_json, iterations, compact=False)
+        self.time_snapshot("compact snapshot", json.dumps(game.as_dict(compact=True)), iterations, compact=True)
+
+    def time_snapshot(self, label, game_json, iterations, compact):
+        start = time.perf_counter()
+        for x in range(0, iterations):
+            game_dict = json.loads(game_json)
+        loads_time = (time.perf_counter() - start) / iterations
+
+        start = time.perf_counter()
+        for x in range(0, iterations):
+            hydrated_game = Game("pvp", info=json.loads(game_json))
+        hydrate_time = (time.perf_counter() - start) / iterations - loads_time
+
+        start = time.perf_counter()
+        for x in range(0, iterations):
+            hydrated_game.as_dict(compact=compact)
+        as_dict_time = (time.perf_counter() - start) / iterations
+
+        # the cards don't change between iterations, so this is the cost of a snapshot after a move that changed nothing
+        start = time.perf_counter()
+        for x in range(0, iterations):
+            hydrated_game.as_dict(compact=compact, cached=True)
+        cached_time = (time.perf_counter() - start) / iterations
+
+        self.stdout.write(f"{label}, {len(game_json)} bytes")
+        self.stdout.write(f"  json.loads: {loads_time * 1000:.3f} ms")
+        self.stdout.write(f"  Game(info): {hydrate_time * 1000:.3f} ms")
+        self.stdout.write(f"  Game.as_dict(): {as_dict_time * 1000:.3f} ms")
+        self.stdout.write(f"  Game.as_dict(cached=True): {cached_time * 1000:.3f} ms")
@@ -0,0 +1,77 @@
+import json
+import threading
+import time
+
+from battle_wizard.game.matchmaking import DatabaseMatchQueue
+from battle_wizard.game.matchmaking import MatchQueue
+from battle_wizard.models import GameRecord
+from battle_wizard.models import MatchQueueEntry
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+
+class Command(BaseCommand):
+    help = "Time enqueueing players on the MatchQueue from several threads, and check every player got exactly one match."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--players", type=int, default=4000)
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--queue", choices=["memory", "database"], default="memory")
+        parser.add_argument("--no-game-records", action="store_true", help="don't make a GameRecord for each match, to time the queue alone")
+        parser.add_argument("--json", action="store_true", help="print the results as JSON")
+
+    def handle(self, *args, **options):
+        create_game = (lambda: 0) if options["no_game_records"] else None
+        queue_class = DatabaseMatchQueue if options["queue"] == "database" else MatchQueue
+        queue = queue_class(create_game=create_game)
+        # only the benchmark's own players, in case this runs against a database real players are queued in
+        MatchQueueEntry.objects.filter(username__startswith="benchmark_").delete()
+        game_records_before = GameRecord.objects.count()
+
+        players = options["players"]
+        threads = options["threads"]
+        matches = []
+        matches_lock = threading.Lock()
+
+        def enqueue_players(thread_index):
+            thread_matches = []
+            for index in range(thread_index, players, threads):
+                thread_matches += queue.enqueue(f"benchmark_{index}", f"channel_{index}")
+            with matches_lock:
+                matches.extend(thread_matches)
+            close_old_connections()
+
+        workers = [threading.Thread(target=enqueue_players, args=(thread_index,)) for thread_index in range(0, threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        paired = [player.username for match in matches for player in match.players]
+        waiting = [username for username in queue.waiting() if username.startswith("benchmark_")]
+        results = {
+            "queue": options["queue"],
+            "players": players,
+            "threads": threads,
+            "seconds": elapsed,
+            "enqueues_per_second": players / elapsed,
+            "matches": len(matches),
+            "waiting": len(waiting),
+            # players in more than one match, and players neither matched nor waiting
+            "duplicates": len(paired) - len(set(paired)),
+            "lost": players - len(set(paired) | set(waiting)),
+            "game_records": GameRecord.objects.count() - game_records_before,
+            "queue_metrics": queue.metrics(),
+        }
+        MatchQueueEntry.objects.filter(username__startswith="benchmark_").delete()
+        if not options["no_game_records"]:
+            GameRecord.objects.filter(id__in=[match.game_record_id for match in matches]).delete()
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results))
+            return
+        self.stdout.write(f"{players} players on {threads} threads, {options['queue']} queue")
+        self.stdout.write(f"  {results['enqueues_per_second']:.0f} enqueues/s, {elapsed:.3f} s")
+        self.stdout.write(f"  {results['matches']} matches, {results['waiting']} waiting, {results['duplicates']} duplicates, {results['lost']} lost")
@@ -0,0 +1,42 @@
+import asyncio
+import time
+
+from battle_wizard.game.affinity import RoomAffinity
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+
+class Command(BaseCommand):
+    help = "Tell a worker to hand its games over to the other workers, such as before a deploy, and wait until it has."
+
+    def add_arguments(self, parser):
+        parser.add_argument("worker_id")
+        parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for the worker to drain")
+
+    def handle(self, *args, **options):
+        if not getattr(settings, "GAME_WORKER_REDIS_URL", ""):
+            raise CommandError("workers only drain when they share a Redis server, set CHANNEL_LAYER_URL")
+        games = asyncio.run(self.drain(options["worker_id"], options["timeout"]))
+        if games is None:
+            raise CommandError(f"worker {options['worker_id']} didn't drain in {options['timeout']} seconds")
+        self.stdout.write(f"worker {options['worker_id']} handed over {games} games")
+
+    async def drain(self, worker_id, timeout):
+        affinity = RoomAffinity(worker_id=worker_id)
+        if affinity.redis is None:
+            raise CommandError("workers only drain when they share a Redis server, install redis")
+        pipeline = affinity.redis.pipeline(transaction=False)
+        pipeline.delete(affinity.key("drained", worker_id))
+        pipeline.set(affinity.key("draining", worker_id), 1, px=int(timeout * 1000))
+        await pipeline.execute()
+        deadline = time.monotonic() + timeout
+        try:
+            while time.monotonic() < deadline:
+                games = await affinity.redis.get(affinity.key("drained", worker_id))
+                if games is not None:
+                    return int(games)
+                await asyncio.sleep(0.2)
+            return None
+        finally:
+            await affinity.redis.close()
@@ -0,0 +1,217 @@
+import asyncio
+import json
+import random
+import time
+
+from asgiref.sync import async_to_sync
+from battle_wizard.game.consumers import BattleWizardMatchFinderConsumer
+from battle_wizard.game.matchmaking import DatabaseMatchQueue
+from battle_wizard.game.matchmaking import MatchQueue
+from battle_wizard.models import GameRecord
+from battle_wizard.models import MatchQueueEntry
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from django.urls import re_path
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else None
+
+
+class SimulatedClient:
+    """
+        One player in the load test, who connects to the match finder, joins the queue and waits for start_match.
+    """
+
+    def __init__(self, username):
+        self.username = username
+        self.communicator = None
+        self.joined_at = None
+        # the start_match messages the client got, and how long after joining
+        self.matches = []
+        self.latencies = []
+        self.disconnects = 0
+        # set when the client leaves the queue for good before it's matched
+        self.left = False
+
+
+class Command(BaseCommand):
+    help = """
+        Run simulated clients against the match finder consumer, through WebsocketCommunicator and the
+        in-memory channel layer, and report how fast and how correctly they were paired.
+
+        The clients arrive at --arrival-rate a second. A --churn fraction of them disconnect while they
+        wait, and a --rejoin fraction of those reconnect and join again, which should keep their place.
+        A pairing is lost when two players who stayed never got a match, and duplicated when a player
+        got more than one match, or a game more than two players.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=1000)
+        parser.add_argument("--arrival-rate", type=float, default=500, help="clients connecting a second")
+        parser.add_argument("--churn", type=float, default=0.1, help="fraction of clients that disconnect while waiting")
+        parser.add_argument("--rejoin", type=float, default=0.5, help="fraction of the disconnected clients that reconnect")
+        parser.add_argument("--churn-seconds", type=float, default=0.5, help="longest a churning client waits before disconnecting, and again before reconnecting")
+        parser.add_argument("--timeout", type=float, default=10, help="seconds to wait for the last matches")
+        parser.add_argument("--queue", choices=["memory", "database"], default="memory")
+        parser.add_argument("--no-game-records", action="store_true", help="don't make a GameRecord for each match, to time the queue alone")
+        parser.add_argument("--seed", type=int, default=None)
+        parser.add_argument("--json", action="store_true", help="print the results as JSON")
+
+    def handle(self, *args, **options):
+        create_game = (lambda: 0) if options["no_game_records"] else None
+        queue_class = DatabaseMatchQueue if options["queue"] == "database" else MatchQueue
+        queue = queue_class(create_game=create_game)
+        # only the load test's own players, in case this runs against a database real players are queued in
+        MatchQueueEntry.objects.filter(username__startswith="load_test_").delete()
+        game_records_before = GameRecord.objects.count()
+
+        in_memory_layer = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+        with override_settings(CHANNEL_LAYERS=in_memory_layer):
+            previous_queue = MatchQueue._shared
+            MatchQueue._shared = queue
+            try:
+                clients, elapsed = async_to_sync(self.simulate)(queue, options)
+            finally:
+                MatchQueue._shared = previous_queue
+
+        results = self.results(clients, elapsed, options)
+        results["game_records"] = GameRecord.objects.count() - game_records_before
+        results["queue_metrics"] = queue.metrics()
+        MatchQueueEntry.objects.filter(username__startswith="load_test_").delete()
+        if not options["no_game_records"]:
+            game_record_ids = set([match["game_record_id"] for client in clients for match in client.matches])
+            GameRecord.objects.filter(id__in=game_record_ids).delete()
+        self.report(results, options["json"])
+
+    async def simulate(self, queue, options):
+        """
+            Runs every client to the end, and returns the clients and how many seconds that took.
+        """
+        application = URLRouter([re_path(r'^ws/find_match/$', BattleWizardMatchFinderConsumer.as_asgi())])
+        randomizer = random.Random(options["seed"])
+        clients = [SimulatedClient(f"load_test_{index}") for index in range(0, options["clients"])]
+        start = time.perf_counter()
+        # the clients still waiting stop when the last arrival's timeout runs out
+        deadline = start + options["clients"] / options["arrival_rate"] + options["timeout"]
+        tasks = []
+        for index, client in enumerate(clients):
+            arrival = start + index / options["arrival_rate"]
+            churn = randomizer.random() < options["churn"]
+            rejoin = churn and randomizer.random() < options["rejoin"]
+            delays = [randomizer.random() * options["churn_seconds"] for _ in range(0, 2)]
+            tasks.append(asyncio.ensure_future(self.run_client(application, client, arrival, deadline, churn, rejoin, delays)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+        if queue.task is not None:
+            queue.task.cancel()
+        # the players that stayed, and weren't matched, are still queued
+        for username in await database_sync_to_async(queue.waiting)():
+            await database_sync_to_async(queue.dequeue)(username)
+        return clients, elapsed
+
+    async def run_client(self, application, client, arrival, deadline, churn, rejoin, delays):
+        await asyncio.sleep(max(arrival - time.perf_counter(), 0))
+        await self.join(application, client)
+        if churn:
+            await self.wait_for_match(client, min(time.perf_counter() + delays[0], deadline))
+            if client.matches:
+                await self.leave(client, deadline)
+                return
+            client.disconnects += 1
+            await self.leave(client, deadline)
+            if not rejoin:
+                client.left = True
+                return
+            await asyncio.sleep(delays[1])
+            await self.join(application, client)
+        await self.wait_for_match(client, deadline)
+        # a second start_match, sent before the browser would have left the page, is a duplicate
+        if client.matches:
+            await self.wait_for_match(client, min(time.perf_counter() + 0.05, deadline), count=len(client.matches) + 1)
+        await self.leave(client, deadline)
+
+    async def join(self, application, client):
+        client.communicator = WebsocketCommunicator(application, "/ws/find_match/")
+        await client.communicator.connect()
+        if client.joined_at is None:
+            client.joined_at = time.perf_counter()
+        await client.communicator.send_to(text_data=json.dumps({"username": client.username, "message_type": "JOIN"}))
+
+    async def leave(self, client, deadline):
+        # the server lets the consumer's disconnect finish, where the communicator would stop it after a second
+        await client.communicator.disconnect(timeout=max(deadline - time.perf_counter(), 1))
+
+    async def wait_for_match(self, client, until, count=1):
+        """
+            Receives start_match messages until the client has count of them, or until passes.
+        """
+        while len(client.matches) < count:
+            timeout = until - time.perf_counter()
+            if timeout <= 0:
+                return
+            try:
+                # not receive_from, which stops the consumer when it times out
+                output = await asyncio.wait_for(client.communicator.output_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                return
+            if output["type"] != "websocket.send":
+                continue
+            message = json.loads(output["text"])["payload"]
+            if message.get("message_type") == "start_match":
+                client.matches.append(message)
+                client.latencies.append(time.perf_counter() - client.joined_at)
+
+    def results(self, clients, elapsed, options):
+        # game_record_id -> the seats of the clients told to play it
+        games = {}
+        for client in clients:
+            for match in client.matches:
+                games.setdefault(match["game_record_id"], []).append(match["seat"])
+        latencies = sorted([client.latencies[0] * 1000 for client in clients if client.latencies])
+        stayed_unmatched = len([client for client in clients if not client.left and not client.matches])
+        if options["no_game_records"]:
+            # every game has the same id, so games can't be told apart
+            duplicate_games = 0
+            half_games = 0
+        else:
+            duplicate_games = len([seats for seats in games.values() if len(seats) > 2 or len(set(seats)) != len(seats)])
+            half_games = len([seats for seats in games.values() if len(seats) == 1])
+        return {
+            "queue": options["queue"],
+            "clients": len(clients),
+            "arrival_rate": options["arrival_rate"],
+            "churn": options["churn"],
+            "rejoin": options["rejoin"],
+            "seconds": elapsed,
+            "matched": len([client for client in clients if client.matches]),
+            "pairings_per_second": len([client for client in clients if client.matches]) / 2 / elapsed,
+            "disconnects": sum([client.disconnects for client in clients]),
+            "left": len([client for client in clients if client.left]),
+            # an odd player out can be left waiting, but two players who stayed should have been paired
+            "lost": max(stayed_unmatched - 1, 0),
+            "duplicates": len([client for client in clients if len(client.matches) > 1]) + duplicate_games,
+            # games whose other player left just as they were paired
+            "half_matches": half_games,
+            "latency_ms": {
+                "p50": percentile(latencies, 0.5),
+                "p90": percentile(latencies, 0.9),
+                "p99": percentile(latencies, 0.99),
+                "max": latencies[-1] if latencies else None,
+            },
+        }
+
+    def report(self, results, as_json):
+        if as_json:
+            self.stdout.write(json.dumps(results))
+            return
+        latency = results["latency_ms"]
+        self.stdout.write(f"{results['clients']} clients at {results['arrival_rate']:g}/s, {results['churn']:g} churn, {results['queue']} queue")
+        self.stdout.write(f"  {results['matched']} matched, {results['pairings_per_second']:.0f} pairings/s, {results['seconds']:.3f} s")
+        self.stdout.write(f"  {results['disconnects']} disconnects, {results['left']} left, {results['half_matches']} half matches")
+        self.stdout.write(f"  {results['lost']} lost, {results['duplicates']} duplicates")
+        if latency["p50"] is not None:
+            self.stdout.write(f"  latency: p50 {latency['p50']:.1f} ms, p90 {latency['p90']:.1f} ms, p99 {latency['p99']:.1f} ms, max {latency['max']:.1f} ms")
@@ -0,0 +1,170 @@
+import itertools
+import json
+import math
+
+from battle_wizard.game.matchmaking import MatchQueue
+from battle_wizard.game.rating import RatingSystem
+from battle_wizard.game.rating import expected_score
+from battle_wizard.models import GameRecord
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+
+def values(text):
+    return [float(value) for value in text.split(",")]
+
+
+class SimulatedClock:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class Command(BaseCommand):
+    help = """
+        Replay the finished pvp GameRecords to tune the rating and matchmaking parameters offline.
+
+        The games are rated in order, to score how well each player's rating predicted their games.
+        Then each game's players arrive at a MatchQueue, with the ratings they had then, at the time the
+        game started, and the queue pairs them on a simulated clock, to time how long they would wait
+        and how even their matches would be. Give several comma-separated values for a parameter to try
+        each combination.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--initial-deviation", type=values, default=[350])
+        parser.add_argument("--min-deviation", type=values, default=[30])
+        parser.add_argument("--deviation-per-day", type=values, default=[35])
+        parser.add_argument("--rating-window", type=values, default=[100])
+        parser.add_argument("--rating-window-per-second", type=values, default=[10])
+        parser.add_argument("--max-rating-window", type=values, default=[800])
+        parser.add_argument("--bucket-width", type=values, default=[50])
+        parser.add_argument("--sweep-seconds", type=float, default=1)
+        parser.add_argument("--patience", type=float, default=120, help="seconds a player waits for a match before leaving")
+        parser.add_argument("--time-scale", type=float, default=1, help="multiplies the time between arrivals, below 1 for a busier queue")
+        parser.add_argument("--json", action="store_true", help="print the results as JSON, one line per combination")
+
+    def handle(self, *args, **options):
+        games = list(GameRecord.objects.filter(
+            date_finished__isnull=False, player_one__isnull=False, player_two__isnull=False,
+        ).filter(game_json__player_type="pvp").exclude(player_one=F("player_two")).order_by("date_finished", "id").values(
+            "id", "player_one_id", "player_two_id", "winner_id", "date_created", "date_started", "date_finished",
+        ))
+        if not options["json"]:
+            self.stdout.write(f"replaying {len(games)} finished pvp games")
+
+        rating_parameters = ["initial_deviation", "min_deviation", "deviation_per_day"]
+        queue_parameters = ["rating_window", "rating_window_per_second", "max_rating_window", "bucket_width"]
+        for rating_values in itertools.product(*[options[name] for name in rating_parameters]):
+            rating_system = RatingSystem(**dict(zip(rating_parameters, rating_values)))
+            rating_results, arrivals = self.replay_ratings(games, rating_system)
+            for queue_values in itertools.product(*[options[name] for name in queue_parameters]):
+                queue_options = dict(zip(queue_parameters, queue_values))
+                queue_results = self.simulate_queue(arrivals, queue_options, options)
+                results = dict(zip(rating_parameters, rating_values), **queue_options, **rating_results, **queue_results)
+                self.report(results, options["json"])
+
+    def replay_ratings(self, games, rating_system):
+        """
+            Rates the games in order, and returns how well the ratings predicted them, and the players' arrivals at the queue.
+        """
+        # user id -> (rating, deviation, date_played)
+        players = {}
+        log_loss = 0
+        correct = 0
+        predicted = 0
+        arrivals = []
+        for game in games:
+            now = game["date_finished"]
+            player_one = players.get(game["player_one_id"], (rating_system.initial_rating, rating_system.initial_deviation, None))
+            player_two = players.get(game["player_two_id"], (rating_system.initial_rating, rating_system.initial_deviation, None))
+            arrived = game["date_started"] or game["date_created"]
+            arrivals.append((arrived, game["player_one_id"], player_one[0]))
+            arrivals.append((arrived, game["player_two_id"], player_two[0]))
+
+            score = 0.5 if game["winner_id"] is None else (1 if game["winner_id"] == game["player_one_id"] else 0)
+            deviation_two = rating_system.current_deviation(player_two[1], player_two[2], now)
+            expected = expected_score(player_one[0], player_two[0], deviation_two)
+            expected = min(max(expected, 1e-6), 1 - 1e-6)
+            log_loss -= score * math.log(expected) + (1 - score) * math.log(1 - expected)
+            if score != 0.5 and expected != 0.5:
+                predicted += 1
+                correct += 1 if (expected > 0.5) == (score == 1) else 0
+
+            (rating_one, deviation_one), (rating_two, deviation_two) = rating_system.rate(player_one, player_two, score, now)
+            players[game["player_one_id"]] = (rating_one, deviation_one, now)
+            players[game["player_two_id"]] = (rating_two, deviation_two, now)
+        arrivals.sort(key=lambda arrival: arrival[0])
+        return {
+            "games": len(games),
+            "log_loss": log_loss / len(games) if games else 0,
+            "accuracy": correct / predicted if predicted else 0,
+        }, arrivals
+
+    def simulate_queue(self, arrivals, queue_options, options):
+        """
+            Runs the arrivals through a MatchQueue on a simulated clock, and returns how long players waited and how even their matches were.
+        """
+        clock = SimulatedClock()
+        game_ids = itertools.count()
+        queue = MatchQueue(
+            expiry_seconds=options["patience"],
+            create_game=lambda: next(game_ids),
+            sweep_seconds=options["sweep_seconds"],
+            clock=clock,
+            **queue_options,
+        )
+        waits = []
+        gaps = []
+        imbalances = []
+
+        def record(matches):
+            for match in matches:
+                waits.extend([clock.now - player.enqueued_at for player in match.players])
+                gaps.append(abs(match.players[0].rating - match.players[1].rating))
+                imbalances.append(abs(expected_score(match.players[0].rating, match.players[1].rating, 0) - 0.5))
+
+        start = arrivals[0][0] if arrivals else None
+        next_sweep = 0
+        for arrived, user_id, rating in arrivals:
+            arrival_time = (arrived - start).total_seconds() * options["time_scale"]
+            while next_sweep <= arrival_time:
+                if not queue.players:
+                    # nobody to pair until the arrival
+                    next_sweep = math.ceil(arrival_time / queue.sweep_seconds) * queue.sweep_seconds
+                    break
+                clock.now = next_sweep
+                record(queue.pair())
+                next_sweep += queue.sweep_seconds
+            clock.now = arrival_time
+            record(queue.enqueue(str(user_id), "simulated", rating))
+        # the players still waiting get until their patience runs out
+        while queue.players:
+            clock.now = next_sweep
+            record(queue.pair())
+            next_sweep += queue.sweep_seconds
+
+        waits.sort()
+        metrics = queue.metrics()
+        return {
+            "arrivals": len(arrivals),
+            "matches": metrics["matches"],
+            "abandoned": metrics["expired"],
+            "mean_wait": sum(waits) / len(waits) if waits else 0,
+            "p90_wait": waits[int(len(waits) * 0.9)] if waits else 0,
+            "mean_rating_gap": sum(gaps) / len(gaps) if gaps else 0,
+            "mean_imbalance": sum(imbalances) / len(imbalances) if imbalances else 0,
+        }
+
+    def report(self, results, as_json):
+        if as_json:
+            self.stdout.write(json.dumps(results))
+            return
+        self.stdout.write(", ".join([f"{name}={results[name]:g}" for name in ["initial_deviation", "min_deviation", "deviation_per_day", "rating_window", "rating_window_per_second", "max_rating_window", "bucket_width"]]))
+        self.stdout.write(f"  ratings: log loss {results['log_loss']:.4f}, {results['accuracy'] * 100:.1f}% of decided games predicted")
+        self.stdout.write(f"  queue: {results['matches']} matches, {results['abandoned']} abandoned of {results['arrivals']} arrivals")
+        self.stdout.write(f"  wait: mean {results['mean_wait']:.1f} s, p90 {results['p90_wait']:.1f} s")
+        self.stdout.write(f"  rating gap: mean {results['mean_rating_gap']:.0f}, mean imbalance {results['mean_imbalance']:.3f}")
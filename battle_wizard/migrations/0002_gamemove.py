@@ -0,0 +1,26 @@
+# Generated by Django 3.1.14 on 2026-10-18 15:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('battle_wizard', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameMove',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.IntegerField()),
+                ('move_json', models.JSONField()),
+                ('game_record', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='journal', to='battle_wizard.gamerecord')),
+            ],
+            options={
+                'unique_together': {('game_record', 'seq')},
+            },
+        ),
+    ]
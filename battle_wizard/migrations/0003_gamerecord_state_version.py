@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 16:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('battle_wizard', '0002_gamemove'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gamerecord',
+            name='state_version',
+            field=models.IntegerField(default=0),
+        ),
+    ]
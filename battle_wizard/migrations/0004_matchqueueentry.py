@@ -0,0 +1,23 @@
+# Generated by Django 3.1.14 on 2026-10-18 16:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('battle_wizard', '0003_gamerecord_state_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MatchQueueEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(max_length=150, unique=True)),
+                ('channel_name', models.TextField()),
+                ('date_enqueued', models.DateTimeField()),
+                ('date_seen', models.DateTimeField()),
+            ],
+        ),
+    ]
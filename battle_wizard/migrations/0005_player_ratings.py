@@ -0,0 +1,37 @@
+# Generated by Django 3.1.14 on 2026-10-18 16:34
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('battle_wizard', '0004_matchqueueentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gamerecord',
+            name='rated',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='matchqueueentry',
+            name='rating',
+            field=models.FloatField(db_index=True, default=1500),
+        ),
+        migrations.CreateModel(
+            name='PlayerRating',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rating', models.FloatField(default=1500)),
+                ('deviation', models.FloatField(default=350)),
+                ('games', models.IntegerField(default=0)),
+                ('date_played', models.DateTimeField(null=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='rating', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 17:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('battle_wizard', '0005_player_ratings'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='matchqueueentry',
+            name='date_enqueued',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
@@ -20,9 +20,25 @@ class Deck(models.Model):
             "title": self.title,
         }
 
+class StaleGameRecord(Exception):
+    """
+        Raised when saving a GameRecord that somebody else saved since it was loaded.
+    """
+    pass
+
+class GameJournalGap(Exception):
+    """
+        Raised when loading a game whose GameMove journal is missing seqs, which it can't be rebuilt from.
+    """
+    pass
+
 class GameRecord(models.Model):
     """
         A GameRecord is created when a game starts, and updated when it ends.
+
+        Every save checks that state_version is still the one the saver loaded, and increments it, with a
+        conditional UPDATE rather than a row lock, so several server processes and the admin can write
+        the same record without overwriting each other's saves.
     """
     date_finished = models.DateTimeField(null=True)
     date_started = models.DateTimeField(null=True)
@@ -33,6 +49,48 @@ class GameRecord(models.Model):
     player_one_deck = models.ForeignKey("GlobalDeck", on_delete=models.CASCADE, null=True, related_name='player_one_deck')
     player_two_deck = models.ForeignKey("GlobalDeck", on_delete=models.CASCADE, null=True, related_name='player_two_deck')
     winner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, related_name='winner')
+    state_version = models.IntegerField(default=0)
+    # set by rate_game() once the players' ratings include the game
+    rated = models.BooleanField(default=False)
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        """
+            Makes the UPDATE of Model.save() conditional on state_version, increments it, and raises
+            StaleGameRecord if somebody else saved the record since this one was loaded.
+
+            Only the UPDATE changes, so save() still sends pre_save and post_save and handles update_fields.
+            rated is left to rate_game(), which flips it with its own conditional UPDATE.
+        """
+        state_version = self._meta.get_field("state_version")
+        values = [value for value in values if value[0].name not in ["state_version", "rated"]] + [(state_version, None, self.state_version + 1)]
+        if not super()._do_update(base_qs.filter(state_version=self.state_version), using, pk_val, values, update_fields, forced_update):
+            if base_qs.filter(pk=pk_val).exists():
+                raise StaleGameRecord(f"GameRecord {pk_val} was saved by somebody else since version {self.state_version}")
+            return False
+        self.state_version += 1
+        return True
+
+    @staticmethod
+    def save_version(game_record_id, state_version, **fields):
+        """
+            Updates the record's fields and increments its state_version, if it's still at state_version, and returns whether it was.
+        """
+        return GameRecord.objects.filter(id=game_record_id, state_version=state_version).update(state_version=state_version + 1, **fields) == 1
+
+class GameMove(models.Model):
+    """
+        One move of a game, journaled as it gets played.
+
+        GameRecord.game_json is a snapshot that includes the moves up to its last_seq, and the moves after
+        that get replayed onto it to recover the game.
+    """
+    game_record = models.ForeignKey("GameRecord", on_delete=models.CASCADE, related_name="journal")
+    # the index of the move in Game.moves
+    seq = models.IntegerField()
+    move_json = models.JSONField()
+
+    class Meta:
+        unique_together = [["game_record", "seq"]]
 
 class GlobalDeck(models.Model):
     """
@@ -45,4 +103,28 @@ class GlobalDeck(models.Model):
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True)
     date_created = models.DateTimeField()
     cards_hash = models.TextField()
-    deck_json = models.JSONField()
\ No newline at end of file
+    deck_json = models.JSONField()
+
+class MatchQueueEntry(models.Model):
+    """
+        A player waiting for a pvp match, for the DatabaseMatchQueue that server processes share.
+
+        The entry keeps the player's place across restarts, and its channel_name is updated when the
+        player reconnects, so it gets dropped only if the player's consumer stops checking in.
+    """
+    username = models.CharField(max_length=150, unique=True)
+    channel_name = models.TextField()
+    date_enqueued = models.DateTimeField(db_index=True)
+    date_seen = models.DateTimeField()
+    rating = models.FloatField(default=1500, db_index=True)
+
+class PlayerRating(models.Model):
+    """
+        A player's Glicko rating, updated by rate_game() when they finish a pvp game, which matchmaking pairs players by.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="rating")
+    rating = models.FloatField(default=1500)
+    # how unsure the rating is, which shrinks with each game and grows back while the player doesn't play
+    deviation = models.FloatField(default=350)
+    games = models.IntegerField(default=0)
+    date_played = models.DateTimeField(null=True)
@@ -1,25 +1,84 @@
 import asyncio
+import copy
 import datetime
+import gzip
+import io
 import json
 import os
+import subprocess
+import sys
+import threading
 import time
+from unittest import mock
 from unittest import skip
+from unittest import skipUnless
 
+from asgiref.sync import async_to_sync
 from channels.db import database_sync_to_async
+from channels.layers import InMemoryChannelLayer
 from channels.routing import URLRouter
+from django.core.management import call_command
+from django.db import OperationalError
+from django.db.models.signals import post_save
 from django.test import TransactionTestCase
 from django.urls import re_path
+from django.utils import timezone
+from battle_wizard.game.affinity import RoomAffinity
+from battle_wizard.game.affinity import rendezvous_worker
+from battle_wizard.game.clock import TurnClock
 from battle_wizard.game.consumers import BattleWizardConsumer
+from battle_wizard.game.consumers import BattleWizardMatchFinderConsumer
+from battle_wizard.game.delta import GameDeltas
+from battle_wizard.game.engine_pool import EnginePool
+from battle_wizard.game.delta import apply_patch
+from battle_wizard.game.delta import diff
+from battle_wizard.game.django_sources import CustomCardSource
+from battle_wizard.game.django_sources import DatabaseDeckProvider
+from battle_wizard.game.frames import FRAME_ENCODING
+from battle_wizard.game.frames import encode_frame
+from battle_wizard.game.matchmaking import DatabaseMatchQueue
+from battle_wizard.game.matchmaking import MatchQueue
+from battle_wizard.game.rating import RatingSystem
+from battle_wizard.game.rating import expected_score
+from battle_wizard.game.rating import rate_game
+from battle_wizard.game.rating import rating_for_username
 from battle_wizard.models import Deck
 from battle_wizard.game.game import Game
+from battle_wizard.models import GameJournalGap
+from battle_wizard.models import GameMove
 from battle_wizard.models import GameRecord
 from battle_wizard.models import GlobalDeck
+from battle_wizard.models import MatchQueueEntry
+from battle_wizard.models import PlayerRating
+from battle_wizard.models import StaleGameRecord
+from battle_wizard.game.card import all_cards
 from battle_wizard.game.card import Card
+from battle_wizard.game.card import CardCatalog
+from battle_wizard.game.card import CardDefinition
+from battle_wizard.game.card import CardToken
+from battle_wizard.game.card import copy_card_info
+from battle_wizard.game.card import EFFECT_HANDLERS
+from battle_wizard.game.card import unsupported_effect_ids
 from battle_wizard.game.player import Player
 from battle_wizard.game.player_ai import PlayerAI
+from battle_wizard.game.projection import project_game
+from battle_wizard.game.replay import GameReplay
+from battle_wizard.game.session import GameSession
+from battle_wizard.game.session import GameSessions
+from battle_wizard.game.session import GameWriter
+from battle_wizard.game.sources import CardSource
+from battle_wizard.game.sources import DeckProvider
 from battle_wizard.views import add_default_decks
 from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser
 from django.contrib.auth.models import User
+from create_cards.models import CustomCard
+
+# only for the RoomAffinity tests, which are skipped without it, it isn't in requirements.txt
+try:
+    from fakeredis import aioredis as fakeredis
+except ImportError:
+    fakeredis = None
 
 
 class GameObjectTests(TransactionTestCase):
@@ -1496,3 +1555,1440 @@ class GameObjectTests(TransactionTestCase):
         self.assertEqual(game.players[0].mana, 0)
         game.play_move({"username": "a", "move_type": "PLAY_CARD_IN_HAND", "card": 1})
         self.assertEqual(game.players[0].mana, 0)
+
+
+class CardCatalogTests(TransactionTestCase):
+
+    def setUp(self):
+        CardCatalog.shared().invalidate()
+
+    def tearDown(self):
+        CardCatalog.shared().invalidate()
+
+    def test_cards_are_cached(self):
+        self.assertIs(all_cards(), all_cards())
+        self.assertIs(all_cards(require_images=True, include_tokens=False), all_cards(require_images=True, include_tokens=False))
+
+    def test_card_variants(self):
+        catalog = CardCatalog.shared()
+        self.assertFalse([c for c in all_cards(include_tokens=False) if c["is_token"]])
+        self.assertFalse([c for c in all_cards(require_images=True) if not c["image"]])
+        self.assertLess(len(all_cards(include_old_cards=False)), len(all_cards()))
+        self.assertEqual(catalog.card_named("Stone Elemental")["name"], "Stone Elemental")
+        for card_info in catalog.cards_with_cost(2):
+            self.assertEqual(card_info["cost"], 2)
+        for card_info in catalog.cards_of_type("spell"):
+            self.assertEqual(card_info["card_type"], "spell")
+        for card_info in catalog.cards_in_discipline("magic"):
+            self.assertEqual(card_info["discipline"], "magic")
+
+    def test_custom_card_invalidates_catalog(self):
+        card_count = len(all_cards())
+        custom_card = CustomCard.objects.create(date_created=datetime.datetime.now(), card_json={"name": "Catalog Test Card", "card_type": "mob", "cost": 1, "strength": 1, "hit_points": 1})
+        self.assertEqual(len(all_cards()), card_count + 1)
+        self.assertEqual(CardCatalog.shared().card_named("Catalog Test Card")["discipline"], "magic")
+        custom_card.delete()
+        self.assertEqual(len(all_cards()), card_count)
+        self.assertIsNone(CardCatalog.shared().card_named("Catalog Test Card"))
+
+    def test_catalog_notices_cards_saved_by_other_processes(self):
+        card_source = CustomCardSource()
+        card_source.version_seconds = 60
+        catalog = CardCatalog(card_source)
+        card_count = len(catalog.cards())
+        # bulk_create sends no post_save, like a save in another process
+        custom_card = CustomCard(date_created=datetime.datetime.now(), card_json={"name": "Catalog Test Card", "card_type": "mob", "cost": 1, "strength": 1, "hit_points": 1})
+        CustomCard.objects.bulk_create([custom_card])
+        self.assertEqual(len(catalog.cards()), card_count)
+        card_source.version_seconds = 0
+        self.assertEqual(len(catalog.cards()), card_count + 1)
+        self.assertEqual(catalog.card_named("Catalog Test Card")["cost"], 1)
+
+        custom_card = CustomCard.objects.get(card_json__name="Catalog Test Card")
+        custom_card.card_json["cost"] = 2
+        custom_card.date_updated = timezone.now()
+        CustomCard.objects.bulk_update([custom_card], ["card_json", "date_updated"])
+        self.assertEqual(catalog.card_named("Catalog Test Card")["cost"], 2)
+
+    def test_instantiate_makes_independent_cards(self):
+        catalog = CardCatalog.shared()
+        card = catalog.instantiate("Stone Elemental", 7, "a")
+        self.assertEqual(card.name, "Stone Elemental")
+        self.assertEqual(card.id, 7)
+        self.assertEqual(card.owner_username, "a")
+        other_card = catalog.instantiate("Stone Elemental", 8, "b")
+        card.effects_can_be_clicked.append(True)
+        self.assertEqual(other_card.effects_can_be_clicked, [])
+        self.assertEqual(catalog.card_named("Stone Elemental")["effects_can_be_clicked"], [])
+        self.assertIsNone(catalog.instantiate("Not A Card"))
+
+    def test_townies_index(self):
+        townies = CardCatalog.shared().cards_with_effect("is_townie")
+        self.assertTrue(len(townies) > 0)
+        for card_info in townies:
+            self.assertIn("is_townie", [e["id"] for e in card_info["effects"]])
+
+    def test_card_catalog_endpoint(self):
+        published = CardCatalog.shared().published(require_images=True, include_tokens=False)
+        response = self.client.get(f"/cards/{published.cards_hash}.json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["ETag"], f'"{published.cards_hash}"')
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertEqual(json.loads(response.content), json.loads(published.json_bytes))
+
+        response = self.client.get(f"/cards/{published.cards_hash}.json", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.content), published.json_bytes)
+
+        response = self.client.get(f"/cards/{published.cards_hash}.json", HTTP_IF_NONE_MATCH=f'"{published.cards_hash}"')
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get("/cards/not_a_hash.json")
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response["Cache-Control"], "no-cache")
+
+        response = self.client.get("/cards/current.json?require_images=true&include_tokens=false")
+        self.assertEqual(response["ETag"], f'"{published.cards_hash}"')
+        self.assertEqual(response["Cache-Control"], "no-cache")
+        self.assertEqual(self.client.get("/cards/current.json")["ETag"], f'"{CardCatalog.shared().published().cards_hash}"')
+
+    def test_card_catalog_endpoint_reloads_for_unknown_hashes(self):
+        CardCatalog.shared().published()
+        # bulk_create sends no post_save, like a save in another process
+        CustomCard.objects.bulk_create([CustomCard(date_created=datetime.datetime.now(), card_json={"name": "Catalog Test Card", "card_type": "mob", "cost": 1, "strength": 1, "hit_points": 1})])
+        published = CardCatalog(CustomCardSource()).published()
+        self.assertNotEqual(CardCatalog.shared().published().cards_hash, published.cards_hash)
+        response = self.client.get(f"/cards/{published.cards_hash}.json")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Catalog Test Card", [card["name"] for card in json.loads(response.content)])
+
+    def test_card_catalog_hash_changes_with_cards(self):
+        cards_hash = CardCatalog.shared().published().cards_hash
+        custom_card = CustomCard.objects.create(date_created=datetime.datetime.now(), card_json={"name": "Catalog Test Card", "card_type": "mob", "cost": 1, "strength": 1, "hit_points": 1})
+        self.assertNotEqual(CardCatalog.shared().published().cards_hash, cards_hash)
+        custom_card.delete()
+        self.assertEqual(CardCatalog.shared().published().cards_hash, cards_hash)
+
+
+class CardSchemaTests(TransactionTestCase):
+
+    def test_cards_round_trip(self):
+        for card_info in all_cards():
+            card = Card(card_info)
+            self.assertEqual(Card(card.as_dict()).as_dict(), card.as_dict())
+            self.assertEqual(card.as_dict(), card_info)
+
+    def test_cards_are_slotted(self):
+        card = CardCatalog.shared().instantiate("Stone Elemental")
+        self.assertFalse(hasattr(card, "__dict__"))
+        with self.assertRaises(AttributeError):
+            card.not_a_card_field = True
+
+    def test_hydrate_copies_default_lists(self):
+        first_card = Card({"name": "first"})
+        second_card = Card({"name": "second"})
+        first_card.effects_can_be_clicked.append(True)
+        self.assertEqual(second_card.effects_can_be_clicked, [])
+
+    def test_card_builder_dict(self):
+        card = CardCatalog.shared().instantiate("Stone Elemental")
+        builder_dict = card.as_dict(for_card_builder=True)
+        self.assertEqual(list(builder_dict.keys()), ["author_username", "card_type", "cost", "effects", "image", "is_custom", "name", "power_points", "strength", "hit_points"])
+
+
+class EffectRegistryTests(TransactionTestCase):
+
+    def test_effect_ids_have_handlers(self):
+        self.assertEqual(EFFECT_HANDLERS["damage"], Card.do_damage_effect)
+        self.assertEqual(EFFECT_HANDLERS["store_for_decosting"], Card.do_store_card_for_next_turn_effect)
+        for card_info in all_cards():
+            self.assertEqual(unsupported_effect_ids(card_info), [])
+
+    def test_unsupported_effect_ids(self):
+        card_info = {"name": "Bad Card", "effects": [
+            {"id": "not_an_effect", "effect_type": "spell"},
+            {"id": "damage", "effect_type": "spell", "effects": [{"id": "also_not_an_effect", "effect_type": "enter_play"}]},
+            {"id": "not_triggered", "effect_type": "not_an_effect_type"},
+        ]}
+        self.assertEqual(sorted(unsupported_effect_ids(card_info)), ["also_not_an_effect", "not_an_effect"])
+
+    def test_effect_defs_index(self):
+        card = Card({"name": "Indexed", "effects": [
+            {"id": "damage", "effect_type": "spell"},
+            {"id": "draw", "effect_type": "enter_play"},
+            {"id": "drain", "effect_type": "spell"},
+        ]})
+        self.assertEqual(card.effect_defs["spell"], [(0, Card.do_damage_effect), (2, Card.do_drain_hp_effect)])
+        self.assertEqual(card.effect_def("enter_play", 0), EFFECT_HANDLERS["draw"])
+        card.effects.pop(0)
+        card.index_effects()
+        self.assertEqual(card.effect_defs["spell"], [(1, Card.do_drain_hp_effect)])
+
+
+class CardDefinitionTests(TransactionTestCase):
+
+    def setUp(self):
+        CardCatalog.shared().invalidate()
+
+    def tearDown(self):
+        CardCatalog.shared().invalidate()
+
+    def effect_card_name(self):
+        return CardCatalog.shared().cards_with_effect("damage")[0]["name"]
+
+    def test_cards_share_definitions(self):
+        catalog = CardCatalog.shared()
+        name = self.effect_card_name()
+        card = catalog.instantiate(name, 1, "a")
+        other_card = catalog.instantiate(name, 2, "b")
+        self.assertIs(card.definition, other_card.definition)
+        self.assertIs(card.effect_defs, card.definition.effect_defs)
+        self.assertIsNone(card._effects)
+        self.assertEqual(card.as_dict()["effects"][0]["id_for_game"], 1)
+
+        card.effects[0].amount += 1
+        self.assertIsNotNone(card._effects)
+        self.assertIsNone(other_card._effects)
+        self.assertNotEqual(other_card.effects[0].amount, card.effects[0].amount)
+        self.assertEqual(catalog.card_named(name)["effects"][0]["amount"], other_card.effects[0].amount)
+
+    def test_overlay_dict(self):
+        card = CardCatalog.shared().instantiate(self.effect_card_name(), 3, "a")
+        card.cost += 1
+        self.assertEqual(card.as_overlay_dict(), {"definition": card.name, "definition_hash": card.definition.content_hash, "cost": card.cost, "id": 3, "owner_username": "a"})
+        self.assertEqual(Card(card.as_overlay_dict()).as_dict(), card.as_dict())
+
+        # building the effects doesn't add them to the overlay, changing them does
+        card.effects
+        self.assertNotIn("effects", card.as_overlay_dict())
+        card.effects[0].amount += 1
+        self.assertIn("effects", card.as_overlay_dict())
+        self.assertEqual(Card(json.loads(json.dumps(card.as_overlay_dict()))).as_dict(), card.as_dict())
+
+    def test_renamed_card_saves_full_dict(self):
+        card = CardCatalog.shared().instantiate("Stone Elemental")
+        card.name = "Renamed Elemental"
+        self.assertEqual(card.as_overlay_dict(), card.as_dict())
+
+    def test_copy_is_independent(self):
+        card = CardCatalog.shared().instantiate(self.effect_card_name(), 4, "a")
+        card.effects[0].amount += 1
+        card_copy = card.copy()
+        self.assertEqual(card_copy.as_dict(), card.as_dict())
+        card_copy.effects[0].ai_target_types.append("self")
+        self.assertNotEqual(card_copy.effects[0].ai_target_types, card.effects[0].ai_target_types)
+
+    def test_compact_game_round_trip(self):
+        game = Game("pvp", info={}, player_decks=[[], []])
+        game.play_move({"username": "a", "move_type": "JOIN"})
+        game.play_move({"username": "b", "move_type": "JOIN"})
+        for x in range(0, 4):
+            game.play_move({"username": game.current_player().username, "move_type": "END_TURN"})
+        compact_dict = game.as_dict(compact=True)
+        # the cards' definitions are saved once per game, rather than once per card
+        overlays = [card_dict for player_dict in compact_dict["players"] for card_dict in player_dict["deck"] + player_dict["hand"] + player_dict["initial_deck"]]
+        self.assertEqual(set(compact_dict["definitions"]), set([card_dict["definition_hash"] for card_dict in overlays]))
+        overlays_json = json.dumps({key: value for key, value in compact_dict.items() if key != "definitions"})
+        self.assertTrue(len(overlays_json) < len(json.dumps(game.as_dict())) / 4)
+        compact_json = json.dumps(compact_dict)
+        self.assertEqual(Game("pvp", info=json.loads(compact_json)).as_dict(), game.as_dict())
+
+    def test_changed_and_deleted_cards_load_from_saved_definitions(self):
+        card_info = copy_card_info(CardCatalog.shared().card_named("Stone Elemental"))
+        card_source = CardSource(cards=[dict(card_info, name="Changing Elemental"), dict(card_info, name="Deleted Elemental")])
+        catalog = CardCatalog.for_source(card_source)
+        game = Game("pvp", info={}, player_decks=[["Changing Elemental"] * 5, ["Deleted Elemental"] * 5], card_source=card_source)
+        game.play_move({"username": "a", "move_type": "JOIN"})
+        game.play_move({"username": "b", "move_type": "JOIN"})
+        compact_json = json.dumps(game.as_dict(compact=True))
+        self.assertEqual(json.loads(compact_json)["players"][0]["deck"][0]["definition"], "Changing Elemental")
+
+        card_source.cards = [dict(card_info, name="Changing Elemental", strength=card_info["strength"] + 5)]
+        catalog.invalidate()
+        loaded_game = Game("pvp", info=json.loads(compact_json), card_source=card_source)
+        self.assertEqual(loaded_game.as_dict(), game.as_dict())
+        # the cards made on the old definitions get saved whole from here on
+        loaded_compact = loaded_game.as_dict(compact=True)
+        self.assertEqual(loaded_compact["players"][0]["deck"][0]["strength"], card_info["strength"])
+        self.assertNotIn("definition", loaded_compact["players"][1]["deck"][0])
+
+    def test_saved_definitions_are_bounded(self):
+        card_source = CardSource()
+        card_source.saved_definitions_limit = 2
+        catalog = CardCatalog.for_source(card_source)
+        card_info = copy_card_info(catalog.card_named("Stone Elemental"))
+        definitions = [CardDefinition(dict(card_info, strength=strength)) for strength in range(0, 3)]
+        catalog.add_saved_definitions({definition.content_hash: definition.info for definition in definitions[:2]})
+        # using the first keeps it, so the second is the least recently used
+        self.assertIsNotNone(catalog.definition_with_hash(definitions[0].content_hash))
+        catalog.add_saved_definitions({definitions[2].content_hash: definitions[2].info})
+        self.assertEqual(list(catalog.saved_definitions), [definitions[0].content_hash, definitions[2].content_hash])
+        self.assertIsNone(catalog.definition_with_hash(definitions[1].content_hash))
+
+
+class GameSessionTests(TransactionTestCase):
+
+    def test_sessions_are_shared_per_room(self):
+        game_record = GameRecord.objects.create(date_created=datetime.datetime.now())
+        sessions = GameSessions()
+        session = sessions.open(game_record.id, "pvp", [[], []])
+        self.assertIs(sessions.open(str(game_record.id), "pvp", [[], []]), session)
+        self.assertEqual(session.connections, 2)
+
+        session.game.play_move({"username": "a", "move_type": "JOIN"})
+        sessions.close(session)
+        self.assertIs(sessions.get(game_record.id), session)
+        self.assertEqual(len(sessions.open(game_record.id, "pvp", [[], []]).game.players), 1)
+        sessions.close(session)
+        sessions.close(session)
+        self.assertIsNone(sessions.get(game_record.id))
+
+        # the move was never saved, so a cold start reloads the empty game
+        session = sessions.open(game_record.id, "pvp", [[], []])
+        self.assertEqual(len(session.game.players), 0)
+
+    def test_a_slow_load_only_blocks_its_own_room(self):
+        slow_load_started = threading.Event()
+        finish_slow_load = threading.Event()
+        loads = []
+
+        def load(game_record_id, player_type, player_decks):
+            loads.append(game_record_id)
+            if game_record_id == 1:
+                slow_load_started.set()
+                finish_slow_load.wait(5)
+            return GameSession(GameRecord(id=game_record_id), Game(player_type, player_decks=player_decks))
+
+        sessions = GameSessions()
+        opened = []
+        with mock.patch.object(GameSession, "load", side_effect=load):
+            threads = [threading.Thread(target=lambda: opened.append(sessions.open(1, "pvp", [[], []]))) for x in range(0, 2)]
+            threads[0].start()
+            self.assertTrue(slow_load_started.wait(5))
+            threads[1].start()
+            other_session = sessions.open(2, "pvp", [[], []])
+            self.assertEqual(other_session.game_record.id, 2)
+            self.assertEqual(opened, [])
+            finish_slow_load.set()
+            for thread in threads:
+                thread.join(5)
+        self.assertEqual(loads, [1, 2])
+        self.assertIs(opened[0], opened[1])
+        self.assertEqual(opened[0].connections, 2)
+        self.assertEqual(sessions.loading, {})
+
+    def test_evicted_session_reloads(self):
+        game_record = GameRecord.objects.create(date_created=datetime.datetime.now())
+        sessions = GameSessions()
+        session = sessions.open(game_record.id, "pvp", [[], []])
+        session.game.play_move({"username": "a", "move_type": "JOIN"})
+        game_record.game_json = session.game.as_dict(compact=True)
+        game_record.save()
+
+        sessions.evict(game_record.id)
+        reloaded_session = sessions.open(game_record.id, "pvp", [[], []])
+        self.assertIsNot(reloaded_session, session)
+        self.assertEqual(reloaded_session.game.as_dict(), session.game.as_dict())
+        # closing the evicted session doesn't drop the new one
+        sessions.close(session)
+        self.assertIs(sessions.get(game_record.id), reloaded_session)
+
+
+class GameWriterTests(TransactionTestCase):
+
+    def open_session(self, writer):
+        game_record = GameRecord.objects.create(date_created=datetime.datetime.now())
+        sessions = GameSessions(writer)
+        session = sessions.open(game_record.id, "pvp", [[], []])
+        return sessions, session
+
+    def play_move(self, writer, session, move, flush=False):
+        with session.lock:
+            session.game.play_move(move)
+            writer.mark_dirty(session, flush=flush)
+
+    def saved_game(self, session):
+        return GameRecord.objects.get(id=session.game_record.id).game_json
+
+    def test_flush_after_moves(self):
+        writer = GameWriter(flush_moves=2, flush_seconds=60)
+        sessions, session = self.open_session(writer)
+        self.play_move(writer, session, {"username": "a", "move_type": "JOIN"})
+        writer.wait()
+        self.assertEqual(self.saved_game(session), {})
+        self.play_move(writer, session, {"username": "b", "move_type": "JOIN"})
+        writer.wait()
+        self.assertEqual(len(self.saved_game(session)["players"]), 2)
+        metrics = writer.metrics()
+        self.assertEqual(metrics["flushes"], 1)
+        self.assertTrue(metrics["bytes_written"] > 0)
+        writer.stop()
+
+    def test_flush_after_seconds(self):
+        writer = GameWriter(flush_moves=100, flush_seconds=0.05)
+        sessions, session = self.open_session(writer)
+        self.play_move(writer, session, {"username": "a", "move_type": "JOIN"})
+        time.sleep(0.3)
+        self.assertEqual(len(self.saved_game(session)["players"]), 1)
+        self.assertTrue(writer.metrics()["max_flush_lag"] >= 0.05)
+        writer.stop()
+
+    def test_flush_at_game_end_and_disconnect(self):
+        writer = GameWriter(flush_moves=100, flush_seconds=60)
+        sessions, session = self.open_session(writer)
+        self.play_move(writer, session, {"username": "a", "move_type": "JOIN"}, flush=True)
+        writer.wait()
+        self.assertEqual(len(self.saved_game(session)["players"]), 1)
+
+        self.play_move(writer, session, {"username": "b", "move_type": "JOIN"})
+        sessions.close(session)
+        writer.wait()
+        self.assertEqual(len(self.saved_game(session)["players"]), 2)
+        self.assertIsNone(sessions.get(session.game_record.id))
+        writer.stop()
+
+    def test_stop_saves_dirty_sessions(self):
+        writer = GameWriter(flush_moves=100, flush_seconds=60)
+        sessions, session = self.open_session(writer)
+        self.play_move(writer, session, {"username": "a", "move_type": "JOIN"})
+        writer.stop()
+        self.assertEqual(len(self.saved_game(session)["players"]), 1)
+        self.assertEqual(writer.metrics()["dirty_sessions"], 0)
+
+    def test_failed_saves_stay_dirty_and_retry(self):
+        writer = GameWriter(flush_moves=100, flush_seconds=60, retry_seconds=0.1)
+        sessions, session = self.open_session(writer)
+        with mock.patch.object(GameRecord, "save_version", side_effect=OperationalError("database is locked")):
+            self.play_move(writer, session, {"username": "a", "move_type": "JOIN"}, flush=True)
+            writer.wait()
+        self.assertEqual(self.saved_game(session), {})
+        self.assertEqual(session.unsaved_moves, 1)
+        self.assertIsNotNone(session.dirty_since)
+        self.assertEqual(session.flush_failures, 1)
+        self.assertEqual(writer.metrics()["dirty_sessions"], 1)
+        self.assertEqual(writer.metrics()["failures"], 1)
+
+        time.sleep(0.4)
+        self.assertEqual(len(self.saved_game(session)["players"]), 1)
+        self.assertIsNone(session.dirty_since)
+        self.assertEqual(session.flush_failures, 0)
+        self.assertEqual(writer.metrics()["dirty_sessions"], 0)
+        writer.stop()
+
+
+class GameMoveJournalTests(TransactionTestCase):
+
+    def test_moves_are_journaled(self):
+        writer = GameWriter(flush_moves=3, flush_seconds=60)
+        game_record = GameRecord.objects.create(date_created=datetime.datetime.now())
+        session = GameSessions(writer).open(game_record.id, "pvp", [["Stone Elemental"] * 10, ["Stone Elemental"] * 10])
+        for move in [{"username": "a", "move_type": "JOIN"}, {"username": "b", "move_type": "JOIN"}, {"username": "a", "move_type": "END_TURN"}, {"username": "b", "move_type": "END_TURN"}]:
+            with session.lock:
+                session.game.play_move(move, should_add_to_move_list=True)
+                writer.mark_dirty(session)
+            writer.wait()
+
+        journal = list(GameMove.objects.filter(game_record=game_record).order_by("seq"))
+        self.assertEqual([game_move.seq for game_move in journal], list(range(0, len(session.game.moves))))
+        self.assertEqual([game_move.move_json["move_type"] for game_move in journal], [move["move_type"] for move in session.game.moves])
+        game_json = GameRecord.objects.get(id=game_record.id).game_json
+        self.assertNotIn("moves", game_json)
+        # the third move made the snapshot
+        self.assertEqual(game_json["last_seq"], 2)
+        self.assertEqual(writer.metrics()["journal_rows"], len(journal))
+        writer.stop()
+
+    def test_recover_from_snapshot_and_journal_tail(self):
+        writer = GameWriter(flush_moves=100, flush_seconds=60)
+        game_record = GameRecord.objects.create(date_created=datetime.datetime.now())
+        player_decks = [["Stone Elemental"] * 10, ["Stone Elemental"] * 10]
+        session = GameSessions(writer).open(game_record.id, "pvp", player_decks)
+        for move in [{"username": "a", "move_type": "JOIN"}, {"username": "b", "move_type": "JOIN"}]:
+            with session.lock:
+                session.game.play_move(move, should_add_to_move_list=True)
+                writer.mark_dirty(session, flush=len(session.game.players) == 2)
+            writer.wait()
+        for x in range(0, 3):
+            with session.lock:
+                session.game.play_move({"username": session.game.current_player().username, "move_type": "END_TURN"}, should_add_to_move_list=True)
+                writer.mark_dirty(session)
+        writer.wait()
+        snapshot_moves = GameRecord.objects.get(id=game_record.id).game_json["last_seq"] + 1
+        self.assertEqual(GameMove.objects.filter(game_record=game_record).count(), snapshot_moves + 3)
+
+        # a cold start, without the snapshot of the last 3 moves
+        recovered_session = GameSessions(GameWriter()).open(game_record.id, "pvp", player_decks)
+        self.assertEqual(recovered_session.game.turn, 3)
+        recovered_game_dict = recovered_session.game.as_dict()
+        game_dict = session.game.as_dict()
+        # the replayed turns start when they get replayed
+        del recovered_game_dict["turn_start_time"]
+        del game_dict["turn_start_time"]
+        self.assertEqual(recovered_game_dict, game_dict)
+        self.assertEqual(recovered_session.journaled_moves, len(session.game.moves))
+        writer.stop()
+
+    def test_failed_journal_writes_are_retried(self):
+        writer = GameWriter(flush_moves=100, flush_seconds=60)
+        game_record = GameRecord.objects.create(date_created=datetime.datetime.now())
+        player_decks = [["Stone Elemental"] * 10, ["Stone Elemental"] * 10]
+        session = GameSessions(writer).open(game_record.id, "pvp", player_decks)
+        with mock.patch.object(GameMove.objects, "bulk_create", side_effect=OperationalError("disk I/O error")):
+            with session.lock:
+                session.game.play_move({"username": "a", "move_type": "JOIN"}, should_add_to_move_list=True)
+                writer.mark_dirty(session)
+            writer.wait()
+        self.assertEqual(session.journaled_moves, 0)
+        self.assertEqual(GameMove.objects.filter(game_record=game_record).count(), 0)
+
+        with session.lock:
+            session.game.play_move({"username": "b", "move_type": "JOIN"}, should_add_to_move_list=True)
+            writer.mark_dirty(session, flush=True)
+        writer.wait()
+        self.assertEqual(list(GameMove.objects.filter(game_record=game_record).order_by("seq").values_list("seq", flat=True)), [0, 1])
+        self.assertEqual(session.journaled_moves, 2)
+        writer.stop()
+
+    def test_journal_gaps_fail_to_load(self):
+        game_record = GameRecord.objects.create(date_created=datetime.datetime.now(), game_json={"last_seq": -1})
+        GameMove.objects.create(game_record=game_record, seq=0, move_json={"username": "a", "move_type": "JOIN"})
+        GameMove.objects.create(game_record=game_record, seq=2, move_json={"username": "a", "move_type": "END_TURN"})
+        with self.assertRaises(GameJournalGap):
+            GameSession.load(game_record.id, "pvp", [[], []])
+
+
+class GameRecordVersionTests(TransactionTestCase):
+
+    player_decks = [["Stone Elemental"] * 10, ["Stone Elemental"] * 10]
+
+    def play_moves(self, writer, session, count, flush=False):
+        for x in range(0, count):
+            with session.lock:
+                session.game.play_move({"username": session.game.current_player().username, "move_type": "END_TURN"}, should_add_to_move_list=True)
+                writer.mark_dirty(session, flush=flush)
+        writer.wait()
+
+    def started_game(self, writer):
+        game_record = GameRecord.objects.create(date_created=datetime.datetime.now())
+        session = GameSessions(writer).open(game_record.id, "pvp", self.player_decks)
+        for move in [{"username": "a", "move_type": "JOIN"}, {"username": "b", "move_type": "JOIN"}]:
+            with session.lock:
+                session.game.play_move(move, should_add_to_move_list=True)
+                writer.mark_dirty(session, flush=True)
+        writer.wait()
+        return game_record
+
+    def test_stale_save_raises(self):
+        game_record = GameRecord.objects.create(date_created=datetime.datetime.now())
+        other_game_record = GameRecord.objects.get(id=game_record.id)
+        game_record.game_json = {"saved_by": "one"}
+        game_record.save()
+        self.assertEqual(game_record.state_version, 1)
+        other_game_record.game_json = {"saved_by": "two"}
+        with self.assertRaises(StaleGameRecord):
+            other_game_record.save()
+        self.assertEqual(GameRecord.objects.get(id=game_record.id).game_json, {"saved_by": "one"})
+
+    def test_save_keeps_signals_and_update_fields(self):
+        saves = []
+
+        def saved(sender, instance, created, update_fields, **kwargs):
+            saves.append((created, update_fields, instance.state_version))
+
+        post_save.connect(saved, sender=GameRecord)
+        try:
+            game_record = GameRecord(date_created=datetime.datetime.now(), game_json={"saved_by": "one"})
+            game_record.save()
+            game_record.game_json = {"saved_by": "two"}
+            game_record.date_finished = datetime.datetime.now()
+            game_record.save(update_fields=["date_finished"])
+        finally:
+            post_save.disconnect(saved, sender=GameRecord)
+        self.assertEqual(saves, [(True, None, 0), (False, frozenset(["date_finished"]), 1)])
+        saved_game_record = GameRecord.objects.get(id=game_record.id)
+        self.assertEqual(saved_game_record.state_version, 1)
+        self.assertEqual(saved_game_record.game_json, {"saved_by": "one"})
+        self.assertIsNotNone(saved_game_record.date_finished)
+
+    def test_conflicting_save_reloads_and_keeps_the_other_save(self):
+        writer = GameWriter(flush_moves=100, flush_seconds=60)
+        game_record = self.started_game(writer)
+        session = GameSessions(writer).open(game_record.id, "pvp", self.player_decks)
+        # somebody else, such as the admin, saves the record
+        other_game_record = GameRecord.objects.get(id=game_record.id)
+        other_game_record.date_finished = datetime.datetime.now()
+        other_game_record.save(update_fields=["date_finished"])
+
+        self.play_moves(writer, session, 1, flush=True)
+        self.assertTrue(session.stale)
+        self.assertEqual(writer.metrics()["conflicts"], 1)
+        with session.lock:
+            session.reload_if_stale()
+        writer.wait()
+        self.assertFalse(session.stale)
+        saved_game_record = GameRecord.objects.get(id=game_record.id)
+        self.assertEqual(saved_game_record.state_version, session.game_record.state_version)
+        self.assertEqual(saved_game_record.game_json["last_seq"], len(session.game.moves) - 1)
+        self.assertIsNotNone(saved_game_record.date_finished)
+        writer.stop()
+
+    def test_conflicting_save_with_nobody_connected_reloads_and_saves(self):
+        writer = GameWriter(flush_moves=100, flush_seconds=60)
+        game_record = self.started_game(writer)
+        sessions = GameSessions(writer)
+        session = sessions.open(game_record.id, "pvp", self.player_decks)
+        self.play_moves(writer, session, 2)
+        other_game_record = GameRecord.objects.get(id=game_record.id)
+        other_game_record.date_finished = datetime.datetime.now()
+        other_game_record.save(update_fields=["date_finished"])
+
+        # the last player leaves, so no next move would reload the session
+        sessions.close(session)
+        writer.wait()
+        self.assertEqual(writer.metrics()["conflicts"], 1)
+        self.assertFalse(session.stale)
+        self.assertIsNone(sessions.get(game_record.id))
+        saved_game_record = GameRecord.objects.get(id=game_record.id)
+        self.assertEqual(saved_game_record.game_json["last_seq"], len(session.game.moves) - 1)
+        self.assertIsNotNone(saved_game_record.date_finished)
+        writer.stop()
+
+    def test_conflicting_moves_get_replayed_onto_the_saved_game(self):
+        writer = GameWriter(flush_moves=100, flush_seconds=60)
+        game_record = self.started_game(writer)
+        session = GameSessions(writer).open(game_record.id, "pvp", self.player_decks)
+        other_writer = GameWriter(flush_moves=100, flush_seconds=60)
+        other_session = GameSessions(other_writer).open(game_record.id, "pvp", self.player_decks)
+
+        # the other process journals its move at the seq this session plays its first at
+        turn = session.game.turn
+        self.play_moves(other_writer, other_session, 1, flush=True)
+        self.play_moves(writer, session, 2, flush=True)
+        self.assertTrue(session.stale)
+        with session.lock:
+            session.reload_if_stale()
+        writer.wait()
+
+        # the other move stands, and this session's second move is played after it
+        self.assertEqual(session.game.turn, turn + 2)
+        self.assertEqual(len(session.game.moves), 4)
+        self.assertEqual(GameMove.objects.filter(game_record=game_record).count(), len(session.game.moves))
+        saved_game_record = GameRecord.objects.get(id=game_record.id)
+        self.assertEqual(saved_game_record.state_version, 3)
+        self.assertEqual(saved_game_record.game_json["last_seq"], len(session.game.moves) - 1)
+        writer.stop()
+        other_writer.stop()
+
+
+class SeededGameTests(TransactionTestCase):
+
+    def play_game(self, seed, turns=6):
+        game = Game("pvp", info={"seed": seed}, player_decks=[[], []])
+        game.play_move({"username": "a", "move_type": "JOIN"}, should_add_to_move_list=True)
+        game.play_move({"username": "b", "move_type": "JOIN"}, should_add_to_move_list=True)
+        for x in range(0, turns):
+            game.play_move({"username": game.current_player().username, "move_type": "END_TURN"}, should_add_to_move_list=True)
+        return game
+
+    def deck_names(self, game):
+        return [[c.name for c in p.initial_deck] for p in game.players]
+
+    def test_seed_decides_shuffle(self):
+        self.assertEqual(self.deck_names(self.play_game(1)), self.deck_names(self.play_game(1)))
+        self.assertNotEqual(self.deck_names(self.play_game(1)), self.deck_names(self.play_game(2)))
+
+    def test_replay_from_seed_and_moves(self):
+        game = self.play_game(3)
+        replay = Game("pvp", info={"seed": game.seed}, player_decks=[[], []])
+        for move in json.loads(json.dumps(game.moves)):
+            replay.play_move(move, should_add_to_move_list=True)
+        game_dict = game.as_dict()
+        replay_dict = replay.as_dict()
+        del game_dict["turn_start_time"]
+        del replay_dict["turn_start_time"]
+        self.assertEqual(replay_dict, game_dict)
+
+    def test_seed_is_only_saved(self):
+        game = self.play_game(4, turns=0)
+        self.assertNotIn("seed", game.as_dict())
+        self.assertEqual(game.as_dict(compact=True)["seed"], 4)
+        self.assertEqual(Game("pvp", info=game.as_dict(compact=True)).seed, 4)
+
+
+class GameReplayTests(TransactionTestCase):
+
+    def play_game(self, turns):
+        game = Game("pvp", info={"seed": 5}, player_decks=[[], []])
+        game.play_move({"username": "a", "move_type": "JOIN"}, should_add_to_move_list=True)
+        game.play_move({"username": "b", "move_type": "JOIN"}, should_add_to_move_list=True)
+        for x in range(0, turns):
+            game.play_move({"username": game.current_player().username, "move_type": "END_TURN"}, should_add_to_move_list=True)
+        return game
+
+    def game_dict(self, game):
+        # replays from a checkpoint don't have the initial decks added to their JOIN moves
+        game_dict = game.as_dict()
+        del game_dict["moves"]
+        del game_dict["turn_start_time"]
+        return game_dict
+
+    def test_checkpoints_match_full_replay(self):
+        game = self.play_game(10)
+        replay = GameReplay(game, [[], []], checkpoint_interval=4)
+        review_game, log_lines = replay.game_at(len(game.moves))
+        self.assertEqual([p.as_dict() for p in review_game.players], [p.as_dict() for p in game.players])
+        self.assertEqual(sorted(replay.checkpoints.keys()), [4, 8, 12])
+
+        for move_count in [1, 4, 6, 9, len(game.moves)]:
+            uncheckpointed_replay = GameReplay(game, [[], []], checkpoint_interval=100)
+            expected_game, expected_log_lines = uncheckpointed_replay.game_at(move_count)
+            review_game, log_lines = replay.game_at(move_count)
+            self.assertEqual(self.game_dict(review_game), self.game_dict(expected_game))
+            self.assertEqual(log_lines, expected_log_lines)
+
+    def test_replay_keeps_up_with_live_game(self):
+        game = self.play_game(3)
+        replay = GameReplay(game, [[], []], checkpoint_interval=2)
+        replay.game_at(len(game.moves))
+        for x in range(0, 4):
+            game.play_move({"username": game.current_player().username, "move_type": "END_TURN"}, should_add_to_move_list=True)
+        review_game, log_lines = replay.game_at(len(game.moves))
+        expected_game, expected_log_lines = GameReplay(game, [[], []], checkpoint_interval=100).game_at(len(game.moves))
+        self.assertEqual(self.game_dict(review_game), self.game_dict(expected_game))
+        self.assertEqual(log_lines, expected_log_lines)
+        self.assertEqual(len(replay.move_log_lines), len(game.moves))
+        # reviewing doesn't change the live game's moves
+        self.assertNotIn("initial_deck", game.moves[0])
+
+
+class GameSnapshotTests(TransactionTestCase):
+
+    def play_game(self, turns=4):
+        game = Game("pvp", info={"seed": 6}, player_decks=[[], []])
+        game.play_move({"username": "a", "move_type": "JOIN"}, should_add_to_move_list=True)
+        game.play_move({"username": "b", "move_type": "JOIN"}, should_add_to_move_list=True)
+        for x in range(0, turns):
+            game.play_move({"username": game.current_player().username, "move_type": "END_TURN"}, should_add_to_move_list=True)
+        return game
+
+    def test_snapshot_matches_as_dict(self):
+        game = self.play_game()
+        snapshot = game.snapshot()
+        self.assertEqual(snapshot.full, game.as_dict())
+        self.assertEqual(snapshot.compact, game.as_dict(compact=True))
+        self.assertIs(game.snapshot(), snapshot)
+        game.play_move({"username": game.current_player().username, "move_type": "END_TURN"}, should_add_to_move_list=True)
+        self.assertIsNot(game.snapshot(), snapshot)
+        self.assertEqual(game.snapshot().full, game.as_dict())
+        self.assertEqual(game.snapshot().compact, game.as_dict(compact=True))
+
+    def test_unchanged_cards_are_reused(self):
+        game = self.play_game()
+        card = game.players[0].initial_deck[0]
+        card_dict = game.snapshot().full["players"][0]["initial_deck"][0]
+        game.play_move({"username": game.current_player().username, "move_type": "END_TURN"}, should_add_to_move_list=True)
+        self.assertIs(game.snapshot().full["players"][0]["initial_deck"][0], card_dict)
+        card.cost += 1
+        game.play_move({"username": game.current_player().username, "move_type": "END_TURN"}, should_add_to_move_list=True)
+        self.assertIsNot(game.snapshot().full["players"][0]["initial_deck"][0], card_dict)
+        self.assertEqual(game.snapshot().full["players"][0]["initial_deck"][0]["cost"], card_dict["cost"] + 1)
+
+    def test_cards_that_change_in_place_are_not_cached(self):
+        card = self.play_game(turns=0).players[0].deck[0]
+        self.assertIs(card.snapshot_dict(), card.snapshot_dict())
+        card.tokens.append(CardToken({"strength_modifier": 1, "id": card.id}))
+        self.assertIsNot(card.snapshot_dict(), card.snapshot_dict())
+        self.assertEqual(card.snapshot_dict(), card.as_dict())
+        card.effects
+        card.tokens = []
+        self.assertIsNot(card.snapshot_dict(), card.snapshot_dict())
+
+
+class GameDeltaTests(TransactionTestCase):
+
+    def test_diff_and_apply(self):
+        old = {"a": 1, "b": [1, 2, 3, 4], "c": {"d": "x"}, "e/f": True}
+        new = {"a": 1, "b": [2, 3, 4, 5], "c": {"d": "y", "g": None}, "e/f": 1}
+        patch = diff(old, new)
+        self.assertEqual(patch, [
+            {"op": "replace", "path": "/b/0", "value": 2},
+            {"op": "replace", "path": "/b/1", "value": 3},
+            {"op": "replace", "path": "/b/2", "value": 4},
+            {"op": "replace", "path": "/b/3", "value": 5},
+            {"op": "replace", "path": "/c/d", "value": "y"},
+            {"op": "add", "path": "/c/g", "value": None},
+            {"op": "replace", "path": "/e~1f", "value": 1},
+        ])
+        self.assertEqual(apply_patch(json.loads(json.dumps(old)), patch), new)
+
+    def test_list_ends_are_skipped(self):
+        self.assertEqual(diff([1, 2, 3], [1, 3]), [{"op": "remove", "path": "/1"}])
+        self.assertEqual(diff([1, 2, 3], [0, 1, 2, 3]), [{"op": "add", "path": "/0", "value": 0}])
+        self.assertEqual(diff([1, 2, 3], [1, 2, 3, 4, 5]), [{"op": "add", "path": "/3", "value": 4}, {"op": "add", "path": "/4", "value": 5}])
+        self.assertEqual(apply_patch([1, 2, 3, 4], diff([1, 2, 3, 4], [1, 4])), [1, 4])
+
+    def test_game_deltas(self):
+        game = Game("pvp", info={"seed": 7}, player_decks=[[], []])
+        game.play_move({"username": "a", "move_type": "JOIN"}, should_add_to_move_list=True)
+        game.play_move({"username": "b", "move_type": "JOIN"}, should_add_to_move_list=True)
+        deltas = GameDeltas()
+        seq, patch = deltas.next(game.snapshot().full)
+        self.assertEqual(seq, 1)
+        self.assertIsNone(patch)
+        client_game = json.loads(json.dumps(game.snapshot().full))
+        for x in range(0, 6):
+            game.play_move({"username": game.current_player().username, "move_type": "END_TURN"}, should_add_to_move_list=True)
+            seq, patch = deltas.next(game.snapshot().full)
+            self.assertEqual(seq, x + 2)
+            self.assertLess(len(json.dumps(patch)), len(json.dumps(game.snapshot().full)) / 10)
+            client_game = apply_patch(client_game, json.loads(json.dumps(patch)))
+            self.assertEqual(client_game, json.loads(json.dumps(game.as_dict())))
+
+
+class ProjectionTests(TransactionTestCase):
+
+    def setUp(self):
+        self.game = Game("pvp", info={"seed": 8}, player_decks=[[], []])
+        self.game.play_move({"username": "a", "move_type": "JOIN"}, should_add_to_move_list=True)
+        self.game.play_move({"username": "b", "move_type": "JOIN"}, should_add_to_move_list=True)
+        self.game.play_move({"username": "a", "move_type": "END_TURN"}, should_add_to_move_list=True)
+
+    def test_opponent_hand_and_deck_are_hidden(self):
+        projection = project_game(self.game.snapshot().full, "a")
+        me, opponent = projection["players"]
+        self.assertEqual([c["name"] for c in me["hand"]], [c.name for c in self.game.players[0].hand])
+        self.assertEqual(me["deck"], self.game.snapshot().full["players"][0]["deck"])
+        self.assertEqual(opponent["hand"], [{"id": c.id} for c in self.game.players[1].hand])
+        self.assertEqual(opponent["deck"], [{}] * len(self.game.players[1].deck))
+        self.assertEqual(opponent["in_play"], self.game.snapshot().full["players"][1]["in_play"])
+
+    def test_opponent_card_choices_are_hidden(self):
+        player = self.game.players[1]
+        player.card_choice_info = {"cards": player.deck, "choice_type": "fetch_into_hand", "effect_card_id": None}
+        full = self.game.as_dict()
+        opponent = project_game(full, "a")["players"][1]
+        self.assertEqual(opponent["card_choice_info"], {"cards": [{}] * len(player.deck), "choice_type": "fetch_into_hand", "effect_card_id": None})
+        self.assertEqual(project_game(full, "")["players"][1]["card_choice_info"], opponent["card_choice_info"])
+        self.assertEqual(project_game(full, "b")["players"][1]["card_choice_info"], full["players"][1]["card_choice_info"])
+
+    def test_moves_and_initial_decks_are_dropped(self):
+        projection = project_game(self.game.snapshot().full, "b")
+        self.assertNotIn("moves", projection)
+        self.assertEqual(projection["move_count"], len(self.game.moves))
+        self.assertNotIn("initial_deck", projection["players"][0])
+        self.assertNotIn("initial_deck", projection["players"][1])
+        review_projection = project_game(self.game.as_dict(), "b", is_reviewing=True)
+        self.assertIn("initial_deck", review_projection["players"][0])
+        self.assertEqual(review_projection["players"][0]["hand"], [{"id": c.id} for c in self.game.players[0].hand])
+
+    def test_spectators_see_no_hands(self):
+        projection = project_game(self.game.snapshot().full, "")
+        for player_dict, player in zip(projection["players"], self.game.players):
+            self.assertEqual(player_dict["hand"], [{"id": c.id} for c in player.hand])
+        self.assertLess(len(json.dumps(projection)), len(json.dumps(self.game.snapshot().full)) / 2)
+
+
+class FrameTests(TransactionTestCase):
+
+    def consumer(self, username):
+        consumer = BattleWizardConsumer()
+        consumer.username = username
+        consumer.sent = []
+        async def send(text_data):
+            consumer.sent.append(text_data)
+        consumer.send = send
+        return consumer
+
+    def test_encode_frame(self):
+        message = {"move_type": "END_TURN", "log_lines": ["é"], "game": {"turn": 1}}
+        frame = encode_frame(message)
+        self.assertIsInstance(frame, bytes)
+        self.assertEqual(json.loads(frame), {"payload": message})
+
+    def test_each_consumer_sends_its_frame(self):
+        event = {
+            "type": "game_message",
+            "frame": None,
+            "frames": {"a": encode_frame({"seq": 1, "for": "a"}), "": encode_frame({"seq": 1, "for": "spectators"})},
+            "encoding": FRAME_ENCODING,
+        }
+        for username, expected in [("a", "a"), ("c", "spectators"), (None, "spectators")]:
+            consumer = self.consumer(username)
+            async_to_sync(consumer.game_message)(event)
+            self.assertEqual(json.loads(consumer.sent[0])["payload"]["for"], expected)
+
+    def test_viewer_is_the_logged_in_user(self):
+        consumer = self.consumer(None)
+        consumer.scope = {"user": User(username="a")}
+        self.assertEqual(consumer.viewer_username("a"), "a")
+        self.assertEqual(consumer.viewer_username("b"), "")
+        consumer.scope = {"user": AnonymousUser()}
+        self.assertEqual(consumer.viewer_username("a"), "")
+        consumer.scope = {}
+        self.assertEqual(consumer.viewer_username("a"), "")
+
+    def test_unknown_encoding_is_not_sent(self):
+        consumer = self.consumer("a")
+        async_to_sync(consumer.game_message)({"type": "game_message", "frame": b"\x00", "frames": None, "encoding": "brotli"})
+        self.assertEqual(consumer.sent, [])
+
+
+class TurnClockTests(TransactionTestCase):
+
+    def setUp(self):
+        self.game = Game("pvp", info={"seed": 9}, player_decks=[[], []])
+        self.game.play_move({"username": "a", "move_type": "JOIN"}, should_add_to_move_list=True)
+        self.game.play_move({"username": "b", "move_type": "JOIN"}, should_add_to_move_list=True)
+
+    def test_tick(self):
+        clock = TurnClock(self.game, max_turn_seconds=60, rope_seconds=10)
+        self.game.turn_start_time = datetime.datetime.now() - datetime.timedelta(seconds=45)
+        self.assertEqual(clock.tick(), {"turn": 0, "turn_time": 45, "max_turn_time": 60, "show_rope": False})
+        self.game.turn_start_time = datetime.datetime.now() - datetime.timedelta(seconds=55)
+        self.assertTrue(clock.tick()["show_rope"])
+
+    def test_ticks_are_pushed_on_turn_changes_and_during_the_rope(self):
+        clock = TurnClock(self.game, max_turn_seconds=60, rope_seconds=10, rope_tick_seconds=1)
+        tick = {"turn": 0, "turn_time": 5, "max_turn_time": 60, "show_rope": False}
+        self.assertTrue(clock.push_is_due(tick, 0))
+        clock.pushed_tick, clock.pushed_at = tick, 0
+        # the turn's time alone isn't pushed, the clients only show the rope
+        self.assertFalse(clock.push_is_due(dict(tick, turn_time=40), 35))
+        self.assertTrue(clock.push_is_due(dict(tick, turn=1, turn_time=0), 36))
+        rope = dict(tick, turn_time=50, show_rope=True)
+        self.assertTrue(clock.push_is_due(rope, 45))
+        clock.pushed_tick, clock.pushed_at = rope, 45
+        self.assertFalse(clock.push_is_due(dict(rope, turn_time=50), 45.5))
+        self.assertTrue(clock.push_is_due(dict(rope, turn_time=51), 46))
+
+    def test_timeout_is_claimed_once(self):
+        clock = TurnClock(self.game)
+        self.assertFalse(clock.claim_timeout(1))
+        self.assertTrue(clock.claim_timeout(0))
+        self.assertFalse(clock.claim_timeout(0))
+
+    def test_clock_pushes_ticks_and_timeout(self):
+        clock = TurnClock(self.game, max_turn_seconds=30, rope_seconds=10, tick_seconds=0.01)
+        self.game.turn_start_time = datetime.datetime.now() - datetime.timedelta(seconds=31)
+
+        async def run_clock():
+            layer = InMemoryChannelLayer()
+            await layer.group_add("room_test", "test.clock")
+            await clock.start(layer, "room_test")
+            tick = await asyncio.wait_for(layer.receive("test.clock"), 1)
+            timeout = await asyncio.wait_for(layer.receive("test.clock"), 1)
+            clock.stop()
+            await asyncio.sleep(0)
+            return tick, timeout
+
+        tick, timeout = async_to_sync(run_clock)()
+        self.assertEqual(tick["type"], "clock_tick")
+        payload = json.loads(tick["frame"])["payload"]
+        self.assertEqual(payload["turn_time"], 31)
+        self.assertTrue(payload["show_rope"])
+        self.assertEqual(timeout, {"type": "turn_timeout", "turn": 0})
+        self.assertIsNone(clock.task)
+
+
+class EnginePoolTests(TransactionTestCase):
+
+    def test_runs_on_the_pool(self):
+        pool = EnginePool(threads=2)
+
+        async def run():
+            return await pool.run(lambda value: (value, threading.current_thread().name), 7)
+
+        value, thread_name = async_to_sync(run)()
+        self.assertEqual(value, 7)
+        self.assertTrue(thread_name.startswith("game-engine"))
+
+    def test_moves_run_while_the_loop_serves_others(self):
+        pool = EnginePool(threads=2)
+        game = Game("pvp", info={"seed": 9}, player_decks=[[], []])
+
+        async def run():
+            ticks = 0
+            move = asyncio.ensure_future(pool.run(game.play_move, {"username": "a", "move_type": "JOIN", "log_lines": []}, True))
+            while not move.done():
+                ticks += 1
+                await asyncio.sleep(0)
+            await move
+            return ticks
+
+        self.assertGreater(async_to_sync(run)(), 0)
+        self.assertEqual(game.players[0].username, "a")
+
+
+class RoomAffinityTests(TransactionTestCase):
+
+    def test_rendezvous_only_moves_a_leaving_workers_rooms(self):
+        workers = ["w1", "w2", "w3"]
+        owners = {game_record_id: rendezvous_worker(game_record_id, workers) for game_record_id in range(0, 300)}
+        self.assertEqual(set(owners.values()), set(workers))
+        for game_record_id, owner in owners.items():
+            new_owner = rendezvous_worker(game_record_id, ["w1", "w3"])
+            self.assertEqual(new_owner, owner if owner != "w2" else new_owner)
+            self.assertNotEqual(new_owner, "w2")
+
+    def run_with_redis(self, test):
+        """
+            Runs the coroutine function test with a fake Redis client and an in-memory channel layer, and returns its result.
+        """
+        async def run():
+            return await test(fakeredis.FakeRedis(), InMemoryChannelLayer())
+        return async_to_sync(run)()
+
+    @skipUnless(fakeredis, "fakeredis isn't installed")
+    def test_rooms_are_claimed_by_their_rendezvous_worker(self):
+        async def test(redis, layer):
+            w1 = RoomAffinity("w1", "ws://w1", sessions=GameSessions(), redis=redis)
+            w2 = RoomAffinity("w2", "ws://w2", sessions=GameSessions(), redis=redis)
+            await w1.start(layer)
+            await w2.start(layer)
+            owners = []
+            for game_record_id in range(0, 20):
+                expected = rendezvous_worker(game_record_id, ["w1", "w2"])
+                # the other worker only says who owns the room, then the owner claims it
+                other, owner = (w2, w1) if expected == "w1" else (w1, w2)
+                owners.append((expected, await other.owner(game_record_id), await owner.owner(game_record_id), await other.owner(game_record_id)))
+            url = await w1.url("w2")
+            w1.task.cancel()
+            w2.task.cancel()
+            return owners, url
+
+        owners, url = self.run_with_redis(test)
+        for expected, before_claim, claimed, after_claim in owners:
+            self.assertEqual(before_claim, expected)
+            self.assertEqual(claimed, expected)
+            self.assertEqual(after_claim, expected)
+        self.assertEqual(url, "ws://w2")
+
+    @skipUnless(fakeredis, "fakeredis isn't installed")
+    def test_heartbeat_only_renews_its_own_leases(self):
+        sessions = GameSessions()
+        game_record_ids = [GameRecord.objects.create(date_created=datetime.datetime.now()).id for x in range(0, 3)]
+        owned, lapsed, taken = [sessions.open(game_record_id, "pvp", [[], []]) for game_record_id in game_record_ids]
+
+        async def test(redis, layer):
+            w1 = RoomAffinity("w1", "ws://w1", sessions=sessions, redis=redis)
+            w1.channel_layer = layer
+            await redis.set(w1.key("room", game_record_ids[0]), "w1", px=1000)
+            await redis.set(w1.key("room", game_record_ids[2]), "w2", px=1000)
+            channel = await layer.new_channel()
+            await layer.group_add(f"room_{game_record_ids[2]}", channel)
+            await w1.heartbeat()
+            handover = await asyncio.wait_for(layer.receive(channel), 1)
+            leases = [(await redis.get(w1.key("room", game_record_id)), await redis.pttl(w1.key("room", game_record_id))) for game_record_id in game_record_ids]
+            return handover, leases
+
+        handover, leases = self.run_with_redis(test)
+        self.assertEqual([owner for owner, ttl in leases], [b"w1", b"w1", b"w2"])
+        self.assertGreater(leases[0][1], 1000)
+        self.assertLessEqual(leases[2][1], 1000)
+        self.assertEqual(handover, {"type": "room_handover", "game_record_id": game_record_ids[2]})
+        self.assertTrue(taken.handing_over)
+        self.assertEqual(sessions.ids(), game_record_ids[:2])
+
+    @skipUnless(fakeredis, "fakeredis isn't installed")
+    def test_drain_hands_rooms_over(self):
+        game_record = GameRecord.objects.create(date_created=datetime.datetime.now())
+        sessions = GameSessions()
+        session = sessions.open(game_record.id, "pvp", [[], []])
+        with session.lock:
+            session.game.play_move({"username": "a", "move_type": "JOIN", "log_lines": []}, should_add_to_move_list=True)
+            sessions.writer.mark_dirty(session)
+
+        async def test(redis, layer):
+            w1 = RoomAffinity("w1", "ws://w1", sessions=sessions, redis=redis)
+            w2 = RoomAffinity("w2", "ws://w2", sessions=GameSessions(), redis=redis)
+            await w1.start(layer)
+            await w2.start(layer)
+            await redis.set(w1.key("room", game_record.id), "w1")
+            channel = await layer.new_channel()
+            await layer.group_add(f"room_{game_record.id}", channel)
+
+            await redis.set(w1.key("draining", "w1"), 1)
+            await w1.heartbeat()
+            handover = await asyncio.wait_for(layer.receive(channel), 1)
+            owner = await w1.owner(game_record.id)
+            w1.task.cancel()
+            w2.task.cancel()
+            return handover, owner
+
+        handover, owner = self.run_with_redis(test)
+        self.assertEqual(handover, {"type": "room_handover", "game_record_id": game_record.id})
+        self.assertEqual(owner, "w2")
+        self.assertTrue(session.handing_over)
+        self.assertIsNone(sessions.get(game_record.id))
+        # the new owner loads the game with its moves
+        self.assertEqual(GameSessions().open(game_record.id, "pvp", [[], []]).game.players[0].username, "a")
+
+
+class RoomActorTests(TransactionTestCase):
+
+    class Consumer:
+        """
+            Stands in for a BattleWizardConsumer, recording what the actor sends.
+        """
+
+        def __init__(self, channel_layer, sent):
+            self.channel_layer = channel_layer
+            self.room_group_name = "room_actor"
+            self.outbox = []
+            self.sent = sent
+
+        async def send_outbox_item(self, kind, value):
+            self.sent.append((kind, value))
+
+    def setUp(self):
+        self.game = Game("pvp", info={"seed": 9}, player_decks=[[], []])
+        self.session = GameSession(GameRecord(id=1), self.game)
+        self.applied = []
+
+    def move(self, consumer, number):
+        self.applied.append(number)
+        consumer.outbox.append(("group", {"type": "game_message", "number": number}))
+        if number == 2:
+            consumer.outbox.append(("client", "snapshot"))
+        if number == 3:
+            raise ValueError("bad move")
+
+    def test_moves_apply_in_order_and_broadcasts_coalesce(self):
+        sent = []
+
+        async def run():
+            layer = InMemoryChannelLayer()
+            await layer.group_add("room_actor", "test.actor")
+            consumers = [self.Consumer(layer, sent), self.Consumer(layer, sent)]
+            results = await asyncio.gather(*[self.session.actor.submit(consumers[number % 2], self.move, consumers[number % 2], number) for number in range(0, 6)], return_exceptions=True)
+            events = []
+            while len(events) < 2:
+                events.append(await asyncio.wait_for(layer.receive("test.actor"), 1))
+            return results, events
+
+        results, events = async_to_sync(run)()
+        self.assertEqual(self.applied, [0, 1, 2, 3, 4, 5])
+        self.assertIsInstance(results[3], ValueError)
+        self.assertEqual(results[:3] + results[4:], [None] * 5)
+        # the client message splits the batch's broadcasts in two
+        self.assertEqual([event["type"] for event in events], ["game_messages", "game_messages"])
+        self.assertEqual([[message["number"] for message in event["events"]] for event in events], [[0, 1, 2], [3, 4, 5]])
+        self.assertEqual(sent, [("client", "snapshot")])
+        self.assertEqual(self.session.actor.metrics(), {"depth": 0, "max_depth": 6, "jobs": 6, "batches": 1, "group_sends": 2})
+
+    def test_a_failed_send_fails_every_job_in_the_batch(self):
+        sent = []
+
+        async def run():
+            layer = InMemoryChannelLayer()
+            consumer = self.Consumer(layer, sent)
+
+            async def send_outbox_item(kind, value):
+                raise ConnectionError("send failed")
+
+            consumer.send_outbox_item = send_outbox_item
+            return await asyncio.gather(*[self.session.actor.submit(consumer, self.move, consumer, number) for number in range(0, 4)], return_exceptions=True)
+
+        results = async_to_sync(run)()
+        self.assertEqual(self.applied, [0, 1, 2, 3])
+        # move 3 keeps its own error, the others get the send's
+        self.assertEqual([type(result) for result in results], [ConnectionError, ConnectionError, ConnectionError, ValueError])
+
+
+class MatchQueueTests(TransactionTestCase):
+
+    def usernames(self, matches):
+        return [[player.username for player in match.players] for match in matches]
+
+    def enqueue_concurrently(self, queue, players, threads=8):
+        matches = []
+        lock = threading.Lock()
+
+        def enqueue_players(thread_index):
+            for index in range(thread_index, players, threads):
+                thread_matches = queue.enqueue(f"player_{index}", f"channel_{index}")
+                with lock:
+                    matches.extend(thread_matches)
+
+        workers = [threading.Thread(target=enqueue_players, args=(thread_index,)) for thread_index in range(0, threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return matches
+
+    def check_queue(self, queue):
+        self.assertEqual(queue.enqueue("a", "channel_a"), [])
+        # a reconnect keeps a's place, from the new channel
+        self.assertEqual(queue.enqueue("a", "channel_a2"), [])
+        # the old channel's disconnect doesn't take a off the queue
+        self.assertFalse(queue.dequeue("a", "channel_a"))
+        matches = queue.enqueue("b", "channel_b")
+        self.assertEqual(self.usernames(matches), [["a", "b"]])
+        self.assertEqual([player.channel_name for player in matches[0].players], ["channel_a2", "channel_b"])
+        self.assertTrue(GameRecord.objects.filter(id=matches[0].game_record_id).exists())
+        self.assertFalse(queue.touch("a", "channel_a2"))
+
+        self.assertEqual(queue.enqueue("c", "channel_c"), [])
+        self.assertTrue(queue.dequeue("c", "channel_c"))
+        self.assertEqual(queue.waiting(), [])
+        self.assertEqual(queue.metrics()["matches"], 1)
+
+    def check_concurrent_enqueues(self, queue):
+        matches = self.enqueue_concurrently(queue, 201)
+        paired = [username for usernames in self.usernames(matches) for username in usernames]
+        self.assertEqual(len(matches), 100)
+        self.assertEqual(len(set(paired)), 200)
+        self.assertEqual(len(set(paired) | set(queue.waiting())), 201)
+        self.assertEqual(len(set([match.game_record_id for match in matches])), 100)
+
+    def test_memory_queue(self):
+        self.check_queue(MatchQueue())
+
+    def test_database_queue(self):
+        self.check_queue(DatabaseMatchQueue())
+
+    def test_memory_queue_concurrent_enqueues(self):
+        self.check_concurrent_enqueues(MatchQueue(create_game=lambda: object()))
+
+    def test_database_queue_concurrent_enqueues(self):
+        queue = DatabaseMatchQueue(create_game=lambda: object())
+        self.check_concurrent_enqueues(queue)
+        self.assertTrue(queue.metrics()["batches"] <= 201)
+
+    def test_database_queue_survives_restarts(self):
+        DatabaseMatchQueue().enqueue("a", "channel_a")
+        # a new process, which a reconnects to
+        queue = DatabaseMatchQueue()
+        self.assertEqual(queue.waiting(), ["a"])
+        self.assertEqual(queue.enqueue("a", "channel_a2"), [])
+        matches = queue.enqueue("b", "channel_b")
+        self.assertEqual([player.channel_name for player in matches[0].players], ["channel_a2", "channel_b"])
+
+    def test_expired_players_are_dropped(self):
+        clock = mock.Mock(return_value=0)
+        for queue in [MatchQueue(expiry_seconds=60, clock=clock), DatabaseMatchQueue(expiry_seconds=60)]:
+            queue.enqueue("a", "channel_a")
+            clock.return_value = 120
+            MatchQueueEntry.objects.update(date_seen=timezone.now() - datetime.timedelta(seconds=120))
+            self.assertEqual(queue.enqueue("b", "channel_b"), [])
+            self.assertEqual(queue.pair(), [])
+            self.assertEqual(queue.waiting(), ["b"])
+            self.assertEqual(queue.metrics()["expired"], 1)
+            queue.dequeue("b")
+
+    def test_players_are_paired_within_their_rating_window(self):
+        clock = mock.Mock(return_value=0)
+        queue = MatchQueue(rating_window=100, rating_window_per_second=10, max_rating_window=300, bucket_width=50, clock=clock, create_game=lambda: 1)
+        self.assertEqual(queue.enqueue("a", "channel_a", 1500), [])
+        self.assertEqual(queue.enqueue("b", "channel_b", 1750), [])
+        # c is within 100 of both a and b, and a has waited longer
+        self.assertEqual(self.usernames(queue.enqueue("c", "channel_c", 1580)), [["a", "c"]])
+        self.assertEqual(queue.enqueue("d", "channel_d", 2000), [])
+        self.assertEqual(queue.pair(), [])
+        # 24 seconds later, b's window has widened to 340, capped at 300, which reaches d at 250
+        clock.return_value = 24
+        self.assertEqual(self.usernames(queue.pair()), [["b", "d"]])
+        self.assertEqual(queue.index.bucket_keys, [])
+
+    def test_database_queue_pairs_within_the_rating_window(self):
+        queue = DatabaseMatchQueue(rating_window=100, rating_window_per_second=0, create_game=lambda: 1)
+        self.assertEqual(queue.enqueue("a", "channel_a", 1500), [])
+        self.assertEqual(queue.enqueue("b", "channel_b", 1750), [])
+        self.assertEqual(self.usernames(queue.enqueue("c", "channel_c", 1680)), [["b", "c"]])
+        queue.max_rating_window = queue.rating_window = 300
+        self.assertEqual(queue.enqueue("d", "channel_d", 2100), [])
+        self.assertEqual(self.usernames(queue.pair()), [])
+        self.assertEqual(queue.waiting(), ["a", "d"])
+        queue.rating_window = queue.max_rating_window = 600
+        self.assertEqual(self.usernames(queue.pair()), [["a", "d"]])
+
+    def test_database_queue_sweeps_only_the_widening_players(self):
+        queue = DatabaseMatchQueue(rating_window=100, rating_window_per_second=10, max_rating_window=300, create_game=lambda: 1)
+        now = timezone.now()
+        # waited long enough to be at the widest window, and too far apart to be paired
+        for username, rating in [("a", 1000), ("b", 2000)]:
+            MatchQueueEntry.objects.create(username=username, channel_name=f"channel_{username}", date_enqueued=now - datetime.timedelta(seconds=60), date_seen=now, rating=rating)
+        # c's own window doesn't reach b, but b's does
+        self.assertEqual(self.usernames(queue.enqueue("c", "channel_c", 2250)), [["b", "c"]])
+        MatchQueueEntry.objects.create(username="d", channel_name="channel_d", date_enqueued=now - datetime.timedelta(seconds=10), date_seen=now, rating=1200)
+        find_pairs = queue.find_pairs
+        swept = []
+
+        def find_pairs_of_swept(entries, now):
+            swept.extend([entry.username for entry in entries])
+            return find_pairs(entries, now)
+
+        with mock.patch.object(queue, "find_pairs", find_pairs_of_swept):
+            self.assertEqual(self.usernames(queue.pair()), [["a", "d"]])
+        # a is at its widest window, so only d is looked up
+        self.assertEqual(swept, ["d"])
+
+    def test_start_match_is_only_sent_to_the_paired_players(self):
+        async def find_matches():
+            application = URLRouter([re_path(r'^ws/find_match/$', BattleWizardMatchFinderConsumer.as_asgi())])
+            communicators = {}
+            for username in ["a", "b", "c"]:
+                communicators[username] = WebsocketCommunicator(application, "/ws/find_match/")
+                await communicators[username].connect()
+                await communicators[username].send_json_to({"username": username, "message_type": "JOIN"})
+                await asyncio.sleep(0.1)
+            messages = {username: json.loads(await communicators[username].receive_from(1))["payload"] for username in ["a", "c"]}
+            self.assertTrue(await communicators["b"].receive_nothing(0.2))
+            for communicator in communicators.values():
+                await communicator.disconnect()
+            return messages
+
+        queue = MatchQueue(rating_window_per_second=0, create_game=lambda: 7)
+        # b is too far from a and c to be paired, and is still waiting when a and c are
+        ratings = {"a": 1500, "b": 2500, "c": 1550}
+        with mock.patch.object(MatchQueue, "_shared", queue), mock.patch("battle_wizard.game.consumers.rating_for_username", ratings.get):
+            messages = async_to_sync(find_matches)()
+        self.assertEqual(messages["a"], {"message_type": "start_match", "game_record_id": 7, "seat": 0})
+        self.assertEqual(messages["c"], {"message_type": "start_match", "game_record_id": 7, "seat": 1})
+        self.assertEqual(queue.waiting(), [])
+
+    def test_concurrent_joins_share_a_batch(self):
+        queue = DatabaseMatchQueue(create_game=lambda: 7, sweep_seconds=60)
+        enqueue_batch = queue.enqueue_batch
+
+        def slow_enqueue_batch(batch):
+            # so the joins that arrive while a batch is written wait for the next one
+            time.sleep(0.1)
+            enqueue_batch(batch)
+
+        async def join_all(usernames):
+            application = URLRouter([re_path(r'^ws/find_match/$', BattleWizardMatchFinderConsumer.as_asgi())])
+            communicators = [WebsocketCommunicator(application, "/ws/find_match/") for username in usernames]
+            for communicator in communicators:
+                await communicator.connect()
+            for username, communicator in zip(usernames, communicators):
+                await communicator.send_json_to({"username": username, "message_type": "JOIN"})
+            for x in range(0, 50):
+                if queue.enqueues == len(usernames):
+                    break
+                await asyncio.sleep(0.05)
+            batches = queue.batches
+            for communicator in communicators:
+                await communicator.disconnect()
+            return batches
+
+        usernames = [f"player_{index}" for index in range(0, 8)]
+        # too far apart to be paired
+        ratings = {username: 1000 * index for index, username in enumerate(usernames)}
+        with mock.patch.object(MatchQueue, "_shared", queue), mock.patch.object(queue, "enqueue_batch", slow_enqueue_batch), mock.patch("battle_wizard.game.consumers.rating_for_username", ratings.get):
+            batches = async_to_sync(join_all)(usernames)
+        self.assertEqual(queue.enqueues, len(usernames))
+        self.assertTrue(batches < len(usernames))
+
+    def test_load_test_match_finder(self):
+        out = io.StringIO()
+        call_command("load_test_match_finder", "--json", "--clients", "40", "--arrival-rate", "200", "--churn", "0.25", "--seed", "1", "--timeout", "3", stdout=out)
+        results = json.loads(out.getvalue().splitlines()[-1])
+        self.assertEqual(results["lost"], 0)
+        self.assertEqual(results["duplicates"], 0)
+        self.assertTrue(results["matched"] + results["left"] >= 39)
+        self.assertTrue(results["latency_ms"]["p50"] <= results["latency_ms"]["p99"])
+        self.assertEqual(MatchQueueEntry.objects.count(), 0)
+        self.assertEqual(GameRecord.objects.count(), 0)
+
+
+class RatingTests(TransactionTestCase):
+
+    def test_glicko_update(self):
+        rating_system = RatingSystem()
+        (winner_rating, winner_deviation), (loser_rating, loser_deviation) = rating_system.rate((1500, 350, None), (1500, 350, None), 1, timezone.now())
+        self.assertAlmostEqual(winner_rating - 1500, 1500 - loser_rating)
+        self.assertTrue(winner_rating > 1600)
+        self.assertTrue(winner_deviation < 350)
+        # an upset moves the ratings further than the expected result
+        (favorite_rating, _), _ = rating_system.rate((1700, 100, None), (1500, 100, None), 0, timezone.now())
+        (expected_rating, _), _ = rating_system.rate((1700, 100, None), (1500, 100, None), 1, timezone.now())
+        self.assertTrue(1700 - favorite_rating > expected_rating - 1700)
+        # a deviation grows back while the player doesn't play
+        a_year_ago = timezone.now() - datetime.timedelta(days=365)
+        self.assertEqual(rating_system.current_deviation(50, a_year_ago, timezone.now()), 350)
+        self.assertAlmostEqual(rating_system.current_deviation(50, timezone.now(), timezone.now()), 50)
+        self.assertAlmostEqual(expected_score(1500, 1500, 350), 0.5)
+
+    def test_rate_game_once(self):
+        one = User.objects.create(username="one")
+        two = User.objects.create(username="two")
+        game_record = GameRecord.objects.create(date_created=datetime.datetime.now())
+        self.assertEqual(rating_for_username("one"), 1500)
+        self.assertTrue(rate_game(game_record.id, one.id, two.id, two.id))
+        self.assertFalse(rate_game(game_record.id, one.id, two.id, two.id))
+        self.assertTrue(rating_for_username("two") > 1500 > rating_for_username("one"))
+        self.assertEqual(PlayerRating.objects.get(user=two).games, 1)
+        self.assertTrue(GameRecord.objects.get(id=game_record.id).rated)
+
+        # a draw between players at the same rating doesn't move them
+        three = User.objects.create(username="three")
+        four = User.objects.create(username="four")
+        draw = GameRecord.objects.create(date_created=datetime.datetime.now())
+        self.assertTrue(rate_game(draw.id, three.id, four.id, None))
+        self.assertAlmostEqual(rating_for_username("three"), 1500)
+
+    def test_simulate_matchmaking(self):
+        users = [User.objects.create(username=f"player_{index}") for index in range(0, 4)]
+        now = timezone.now()
+        for index in range(0, 20):
+            one, two = users[index % 4], users[(index + 1) % 4]
+            date_started = now + datetime.timedelta(seconds=index * 10)
+            GameRecord.objects.create(date_created=date_started, date_started=date_started, date_finished=date_started, player_one=one, player_two=two, winner=one, game_json={"player_type": "pvp"})
+        # games against the AI have a player_two too, but never went through the queue
+        GameRecord.objects.create(date_created=now, date_started=now, date_finished=now, player_one=users[0], player_two=users[1], winner=users[0], game_json={"player_type": "pvai"})
+        out = io.StringIO()
+        call_command("simulate_matchmaking", "--json", "--rating-window", "50,400", stdout=out)
+        results = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([result["rating_window"] for result in results], [50, 400])
+        self.assertEqual(results[0]["games"], 20)
+        self.assertEqual(results[0]["arrivals"], 40)
+        self.assertTrue(results[1]["mean_wait"] <= results[0]["mean_wait"])
+
+
+class HeadlessEngineTests(TransactionTestCase):
+
+    def headless_sources(self):
+        card_info = copy_card_info(CardCatalog.shared().card_named("Stone Elemental"))
+        card_info["name"] = "Headless Test Card"
+        deck = {"title": "Headless", "url": "headless", "discipline": "magic", "cards": {"Headless Test Card": 20}}
+        return CardSource(cards=[card_info]), DeckProvider(decks={5: deck})
+
+    def test_games_use_their_card_source_and_deck_provider(self):
+        card_source, deck_provider = self.headless_sources()
+        game = Game("pvp", player_decks=[[], []], card_source=card_source, deck_provider=deck_provider)
+        game.play_move({"move_type": "JOIN", "username": "a", "deck_id": 5, "log_lines": []}, should_add_to_move_list=True)
+        game.play_move({"move_type": "JOIN", "username": "b", "log_lines": []}, should_add_to_move_list=True)
+        self.assertEqual(set([card.name for card in game.players[0].hand + game.players[0].deck]), set(["Headless Test Card"]))
+        self.assertNotIn("Headless Test Card", [card.name for card in game.players[1].hand + game.players[1].deck])
+        self.assertIsNone(CardCatalog.shared().card_named("Headless Test Card"))
+
+        # saved and loaded, copied, and replayed games keep the game's cards
+        loaded = Game("pvp", info=json.loads(json.dumps(game.as_dict(compact=True))), player_decks=[[], []], card_source=card_source, deck_provider=deck_provider)
+        self.assertTrue(loaded.players[0].hand[0].has_overlay())
+        self.assertEqual(loaded.players[0].hand[0].name, "Headless Test Card")
+        self.assertIs(copy.deepcopy(game).players[0].hand[0].catalog, game.catalog)
+        review_game, _ = GameReplay(game, [[], []]).game_at(2)
+        self.assertEqual(review_game.players[0].hand[0].name, "Headless Test Card")
+
+    def test_the_server_uses_the_database(self):
+        self.assertIsInstance(CardSource.shared(), CustomCardSource)
+        self.assertIsInstance(DeckProvider.shared(), DatabaseDeckProvider)
+        self.assertIs(Game("pvp").deck_provider, DeckProvider.shared())
+        self.assertIs(Game("pvp").catalog, CardCatalog.shared())
+
+    def test_the_engine_runs_without_django(self):
+        script = "; ".join([
+            "import sys",
+            "from battle_wizard.game.game import Game",
+            "from battle_wizard.game.replay import GameReplay",
+            "from battle_wizard.game.sources import CardSource",
+            "game = Game('pvp', player_decks=[[], []], card_source=CardSource())",
+            "[game.play_move({'move_type': 'JOIN', 'username': username, 'log_lines': []}, should_add_to_move_list=True) for username in ['a', 'b']]",
+            "print(len(game.players[1].hand) > 0, [m for m in sys.modules if m.split('.')[0] in ['django', 'channels', 'create_cards']])",
+        ])
+        env = {key: value for key, value in os.environ.items() if key != "DJANGO_SETTINGS_MODULE"}
+        result = subprocess.run([sys.executable, "-c", script], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), env=env, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.splitlines()[-1], "True []")
@@ -2,7 +2,7 @@ import datetime
 import json
 
 from battle_wizard.analytics import Analytics
-from battle_wizard.game.card import all_cards
+from battle_wizard.game.card import CardCatalog
 from battle_wizard.game.data import default_deck
 from battle_wizard.game.data import default_deck_dwarf_bard
 from battle_wizard.game.data import default_deck_dwarf_tinkerer
@@ -21,6 +21,9 @@ from django.contrib.auth import logout as logout_django
 from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist
 from django.forms.models import model_to_dict
+from django.http import HttpResponse
+from django.http import HttpResponseNotFound
+from django.http import HttpResponseNotModified
 from django.http import JsonResponse
 from django.shortcuts import redirect
 from django.shortcuts import render
@@ -129,13 +132,12 @@ def choose_deck_for_match(request):
     """
     if not request.user.is_authenticated:
         return redirect('/signup')
-    cards = all_cards(require_images=True, include_tokens=False)
-    cards = sorted(cards, key = lambda i: (i['cost'], i['card_type'], i['name']))
+    cards = CardCatalog.shared().published(require_images=True, include_tokens=False)
     
     Analytics.log_amplitude(request, "Page View - Choose Deck", {"path":"/choose_deck_for_match", "page":"choose deck for match"})
     return render(request, "choose_deck_for_match.html", 
         {
-            "all_cards": json.dumps(cards),
+            "all_cards_hash": cards.cards_hash,
             "json_decks": json.dumps(json_decks(request.user.username))
         }
     )
@@ -155,8 +157,7 @@ def choose_opponent(request, deck_id):
     """
     if not request.user.is_authenticated:
         return redirect('/signup')
-    cards = all_cards(require_images=True, include_tokens=False)
-    cards = sorted(cards, key = lambda i: (i['cost'], i['card_type'], i['name']))
+    cards = CardCatalog.shared().published(require_images=True, include_tokens=False)
     json_opponent_decks = [
         default_deck(),
         # default_deck_vampire_lich(),
@@ -167,7 +168,7 @@ def choose_opponent(request, deck_id):
     Analytics.log_amplitude(request, "Page View - Choose Opponent", {"path":"/choose_opponent/", "page":"choose opponent for match"})
     return render(request, "choose_opponent.html", 
         {
-            "all_cards": json.dumps(cards),
+            "all_cards_hash": cards.cards_hash,
             "deck_id": deck_id,
             "json_opponent_decks": json.dumps(json_opponent_decks)
         }
@@ -244,6 +245,50 @@ def play_game(request, player_type, game_record_id):
 
     return render(request, "game.html", context)
 
+def card_catalog(request, cards_hash):
+    """
+        Serve one variant of the card catalog, by the hash of its contents.
+
+        The URL changes whenever the cards do, so responses are cached forever.
+    """
+    cards = CardCatalog.shared().published_for_hash(cards_hash)
+    if not cards:
+        # an old page's hash, which the client falls back to current_card_catalog for
+        response = HttpResponseNotFound()
+        response["Cache-Control"] = "no-cache"
+        return response
+    return card_catalog_response(request, cards, "public, max-age=31536000, immutable")
+
+def current_card_catalog(request):
+    """
+        Serve the current card catalog variant given by the query parameters, for clients whose hash is out of date.
+    """
+    cards = CardCatalog.shared().published(
+        require_images=request.GET.get("require_images") == "true",
+        include_tokens=request.GET.get("include_tokens", "true") == "true",
+        include_old_cards=request.GET.get("include_old_cards", "true") == "true",
+    )
+    return card_catalog_response(request, cards, "no-cache")
+
+def card_catalog_response(request, cards, cache_control):
+    etag = f'"{cards.cards_hash}"'
+    if etag in request.headers.get("If-None-Match", ""):
+        response = HttpResponseNotModified()
+    else:
+        accept_encoding = request.headers.get("Accept-Encoding", "")
+        if cards.brotli_bytes and "br" in accept_encoding:
+            response = HttpResponse(cards.brotli_bytes, content_type="application/json")
+            response["Content-Encoding"] = "br"
+        elif "gzip" in accept_encoding:
+            response = HttpResponse(cards.gzip_bytes, content_type="application/json")
+            response["Content-Encoding"] = "gzip"
+        else:
+            response = HttpResponse(cards.json_bytes, content_type="application/json")
+    response["ETag"] = etag
+    response["Cache-Control"] = cache_control
+    response["Vary"] = "Accept-Encoding"
+    return response
+
 def build_deck(request):
     """
         A view to create and edit decks.
@@ -273,12 +318,11 @@ def build_deck(request):
             deck = global_deck_object.deck_json
             deck["title"] = global_deck_object.deck_json["title"]
 
-    cards = all_cards(require_images=True, include_tokens=False, include_old_cards=False)
-    cards = sorted(cards, key = lambda i: (i['cost'], i['card_type'], i['name']))
+    cards = CardCatalog.shared().published(require_images=True, include_tokens=False, include_old_cards=False)
     Analytics.log_amplitude(request, "Page View - View Deck", {"path":"/build_deck/", "page":"build deck", "deck_id":deck_id})
     return render(request, "build_deck.html", 
         {
-            "all_cards": json.dumps(cards),
+            "all_cards_hash": cards.cards_hash,
             "deck_id": deck_id,
             "json_deck": json.dumps(deck),
             "deck": deck,
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 16:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('create_cards', '0003_auto_20211117_1729'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customcard',
+            name='date_updated',
+            field=models.DateTimeField(auto_now=True, null=True),
+        ),
+    ]
@@ -9,6 +9,8 @@ class CustomCard(models.Model):
     """
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True)
     date_created = models.DateTimeField()
+    # so other processes can tell their card catalogs are out of date
+    date_updated = models.DateTimeField(auto_now=True, null=True)
     card_json = models.JSONField(default=dict)
 
 class CustomCardImage(models.Model):
@@ -158,4 +158,64 @@ CHANNEL_LAYERS = {
     },
 }
 
+### Method 4: several server processes, each with its own GAME_WORKER_ID, sharing the Redis server at CHANNEL_LAYER_URL
+if os.environ.get("CHANNEL_LAYER_URL"):
+    CHANNEL_LAYERS["default"] = {
+        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "CONFIG": {
+            "hosts": [os.environ.get("CHANNEL_LAYER_URL")],
+        },
+    }
+
+# each game room is owned by one worker, which clients get redirected to at its GAME_WORKER_URL, such as wss://deckzap.com/w1,
+# and workers renew their rooms' leases every GAME_WORKER_HEARTBEAT_SECONDS, which lapse after GAME_ROOM_LEASE_SECONDS
+GAME_WORKER_ID = os.environ.get("GAME_WORKER_ID", "")
+GAME_WORKER_URL = os.environ.get("GAME_WORKER_URL", "")
+# the Redis server the workers keep their leases in
+GAME_WORKER_REDIS_URL = os.environ.get("CHANNEL_LAYER_URL", "")
+GAME_WORKER_HEARTBEAT_SECONDS = 3
+GAME_ROOM_LEASE_SECONDS = 15
+
+# live games are saved in the background, after this many moves or once a move has gone unsaved for this many seconds
+GAME_FLUSH_MOVES = 10
+GAME_FLUSH_SECONDS = 5
+# a save that fails is retried after GAME_FLUSH_RETRY_SECONDS, doubling with each failure up to GAME_FLUSH_RETRY_MAX_SECONDS
+GAME_FLUSH_RETRY_SECONDS = 1
+GAME_FLUSH_RETRY_MAX_SECONDS = 60
+
+# each live game's clock is checked every GAME_CLOCK_TICK_SECONDS, and pushed to its room when the turn changes,
+# when the rope starts, and every GAME_ROPE_TICK_SECONDS during the rope,
+# players see the rope for the last GAME_ROPE_SECONDS of a turn, and the turn ends after GAME_MAX_TURN_SECONDS
+GAME_CLOCK_TICK_SECONDS = 0.5
+GAME_ROPE_TICK_SECONDS = 1
+GAME_ROPE_SECONDS = 10
+GAME_MAX_TURN_SECONDS = 60
+
+# the AI of a pvai game gets a chance to move every GAME_AI_MOVE_SECONDS
+GAME_AI_MOVE_SECONDS = 0.5
+
+# the game consumers are async, and run the game engine on this many threads per server process
+GAME_ENGINE_THREADS = 8
+
+# each server process caches the card catalog, and reloads it within CARD_CATALOG_VERSION_SECONDS of a custom card
+# being saved by another process, and keeps the CARD_CATALOG_SAVED_DEFINITIONS most recently used definitions of
+# cards that changed since a saved game was played with them
+CARD_CATALOG_VERSION_SECONDS = 5
+CARD_CATALOG_SAVED_DEFINITIONS = 1000
+
+# players waiting for a pvp match are queued in each server process's memory, or with "database" in a table
+# every worker shares, which keeps their places across restarts, and a queued player is dropped once their
+# consumer hasn't checked in for MATCH_QUEUE_EXPIRY_SECONDS
+MATCH_QUEUE = os.environ.get("MATCH_QUEUE", "database" if GAME_WORKER_ID else "memory")
+MATCH_QUEUE_EXPIRY_SECONDS = 30
+
+# a queued player is paired with whoever's waited longest within MATCH_RATING_WINDOW of their rating, and the window
+# widens by MATCH_RATING_WINDOW_PER_SECOND while they wait, up to MATCH_RATING_WINDOW_MAX, so players who've waited
+# get paired by a sweep every MATCH_QUEUE_SWEEP_SECONDS, and the queue is bucketed MATCH_RATING_BUCKET_WIDTH wide
+MATCH_RATING_WINDOW = 100
+MATCH_RATING_WINDOW_PER_SECOND = 10
+MATCH_RATING_WINDOW_MAX = 800
+MATCH_RATING_BUCKET_WIDTH = 50
+MATCH_QUEUE_SWEEP_SECONDS = 1
+
 LOGIN_REDIRECT_URL = '/'
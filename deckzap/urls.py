@@ -3,8 +3,10 @@ from django.contrib.auth.views import LoginView
 from django.urls import include
 from django.urls import path
 from battle_wizard.views import build_deck
+from battle_wizard.views import card_catalog
 from battle_wizard.views import choose_deck_for_match
 from battle_wizard.views import choose_opponent
+from battle_wizard.views import current_card_catalog
 from battle_wizard.views import find_game
 from battle_wizard.views import find_match
 from battle_wizard.views import index
@@ -29,6 +31,8 @@ urlpatterns = [
     path("find_match", find_match),
     path("build_deck", build_deck),
     path("build_deck/save", save_deck),
+    path("cards/current.json", current_card_catalog),
+    path("cards/<cards_hash>.json", card_catalog),
     path("play/<player_type>", find_game),
     path("play/<player_type>/<game_record_id>", play_game),
     path("top_decks", top_decks),
@@ -10,7 +10,7 @@ export class GameNavigator {
 
         let backButtonColor = Constants.darkGrayColor;
         // the 2 is so players can't navigate before the initial join moves
-        if ((!pixiUX.parentGame && game.moves.length > 2 ) || 
+        if ((!pixiUX.parentGame && game.move_count > 2 ) || 
             (pixiUX.parentGame && pixiUX.review_move_index > 2)) {
             backButtonColor = Constants.blueColor
         }
@@ -30,7 +30,7 @@ export class GameNavigator {
 
         let forwardButtonColor = Constants.darkGrayColor;
         if (pixiUX.is_reviewing && 
-            pixiUX.review_move_index < pixiUX.parentGame.moves.length) {
+            pixiUX.review_move_index < pixiUX.parentGame.move_count) {
             forwardButtonColor = Constants.blueColor
         }
         let forwardButton = Card.button(
@@ -43,7 +43,7 @@ export class GameNavigator {
         )
         pixiUX.app.stage.addChild(forwardButton);
         if (!pixiUX.parentGame || 
-            pixiUX.review_move_index == pixiUX.parentGame.moves.length) {
+            pixiUX.review_move_index == pixiUX.parentGame.move_count) {
             backButton.interactive = false;
         }
 
@@ -1,9 +1,18 @@
 import * as Constants from '../constants.js';
+import { applyPatch } from '../lib/jsonPatch.js';
 
 
 export class GameRoom {
 
     gameSocket = null;
+    // the game as of the last broadcast applied, and its seq
+    gameState = null;
+    seq = null;
+    // broadcasts that arrived while waiting on a SNAPSHOT, applied after it if they're newer
+    awaitingSnapshot = false;
+    pendingMessages = [];
+    // the server that owns the game, when it's not the one serving the page
+    workerUrl = null;
 
     constructor(gameUX) {
         this.gameUX = gameUX;
@@ -15,7 +24,11 @@ export class GameRoom {
         if (this.gameSocket === null) {
             this.setupSocket();
         }
-        if (this.gameSocket.readyState === WebSocket.OPEN) {
+        if (this.gameSocket.readyState === WebSocket.OPEN && this.seq !== null) {
+            // reconnected to the game's new server, which sends the game as of now
+            this.awaitingSnapshot = false;
+            this.requestSnapshot();
+        } else if (this.gameSocket.readyState === WebSocket.OPEN) {
             const deck_id = document.getElementById("data_store").getAttribute("deck_id");
             if (deck_id) {
                const opponent_deck_id = document.getElementById("data_store").getAttribute("opponent_deck_id");
@@ -25,7 +38,6 @@ export class GameRoom {
                     this.sendPlayMoveEvent("JOIN", { deck_id });                
                 }
             }
-            this.sendHeartbeatRequest()
             console.log('WebSockets connection created.');
         } else {
             setTimeout(() => {
@@ -34,13 +46,6 @@ export class GameRoom {
         }
     }
 
-    sendHeartbeatRequest() {
-        setTimeout(() => {
-            this.sendPlayMoveEvent( "GET_TIME", {});
-            this.sendHeartbeatRequest();
-        }, 500);
-    }
-
     setupSocket() {
         this.gameSocket = new WebSocket(this.roomSocketUrl());
         this.gameSocket.onclose = e => {
@@ -62,34 +67,110 @@ export class GameRoom {
                     }, 100); 
                 }
             } else if (!message["move_type"]) {
-                if (message["turn_time"] >= message["max_turn_time"]) {
-                    this.gameUX.maybeShowRope();   
-                }
+                // a tick of the turn clock, which the server pushes, and ends the turn when it runs out
+                this.gameUX.maybeShowRope(message);
+            } else if (message["move_type"] === "REDIRECT") {
+                this.reconnect(message["url"]);
+            } else if (message["move_type"] === "SNAPSHOT") {
+                this.receiveSnapshot(message);
             } else {
-                let game = message["game"];
-                if (!message["game"]) {
-                    console.log(message);                    
-                }
-                if (!this.gameUX.allCards) {
-                    this.gameUX.allCards = message["all_cards"]
-                }
-                if (this.gameUX.actionQueue.length === 0) {
-                    this.gameUX.actionQueue.push({game, message});
-                    this.gameUX.refresh(game, message);
-                } else {
-                    this.gameUX.actionQueue.push({game, message});
-                }
-                // only used for onDragMove and onDragEnd
-                this.gameUX.game = game;
+                this.receiveGameMessage(message);
             }
         };
     }
 
+    // moves the connection to the server that owns the game
+    reconnect(workerUrl) {
+        this.workerUrl = workerUrl;
+        this.gameSocket.onclose = null;
+        this.gameSocket.close();
+        this.gameSocket = null;
+        this.connect();
+    }
+
+    receiveGameMessage(message) {
+        const game = this.gameForMessage(message);
+        if (game === undefined) {
+            return;
+        }
+        if (!game) {
+            console.log(message);                    
+        }
+        if (!this.gameUX.allCards && message["all_cards_hash"]) {
+            Constants.fetchAllCards(message["all_cards_hash"])
+                .then(allCards => {
+                    this.gameUX.allCards = allCards;
+                })
+                .catch(error => {
+                    console.log(error);
+                });
+        }
+        if (this.gameUX.actionQueue.length === 0) {
+            this.gameUX.actionQueue.push({game, message});
+            this.gameUX.refresh(game, message);
+        } else {
+            this.gameUX.actionQueue.push({game, message});
+        }
+        // only used for onDragMove and onDragEnd
+        this.gameUX.game = game;
+    }
+
+    // returns the game after a broadcast, from its whole game or by patching the last one, 
+    // or undefined if the broadcast can't be applied until a SNAPSHOT arrives
+    gameForMessage(message) {
+        if (message["seq"] === undefined) {
+            return message["game"];
+        }
+        if (message["game"]) {
+            this.gameState = message["game"];
+            this.seq = message["seq"];
+            return this.gameState;
+        }
+        // broadcasts from different consumers in the room can arrive out of order, the newer one already covers this
+        if (!this.awaitingSnapshot && this.gameState !== null && message["seq"] <= this.seq) {
+            return undefined;
+        }
+        if (this.awaitingSnapshot || this.gameState === null || message["seq"] !== this.seq + 1) {
+            this.pendingMessages.push(message);
+            this.requestSnapshot();
+            return undefined;
+        }
+        this.gameState = applyPatch(this.gameState, message["game_patch"]);
+        this.seq = message["seq"];
+        return this.gameState;
+    }
+
+    requestSnapshot() {
+        if (!this.awaitingSnapshot) {
+            this.awaitingSnapshot = true;
+            this.sendPlayMoveEvent("GET_SNAPSHOT", {});
+        }
+    }
+
+    receiveSnapshot(message) {
+        if (!message["game"]) {
+            // nothing was broadcast yet, the room's first broadcast will have the whole game
+            this.awaitingSnapshot = false;
+            this.pendingMessages = [];
+            return;
+        }
+        this.awaitingSnapshot = false;
+        this.gameState = message["game"];
+        this.seq = message["seq"];
+        const pendingMessages = this.pendingMessages.filter(pending => pending["seq"] > this.seq);
+        this.pendingMessages = [];
+        this.receiveGameMessage({"move_type": "SNAPSHOT", "seq": this.seq, "game": this.gameState, "log_lines": []});
+        for (const pending of pendingMessages) {
+            this.receiveGameMessage(pending);
+        }
+    }
+
     roomSocketUrl() {
         const roomCode = document.getElementById("data_store").getAttribute("game_record_id");
         const url = new URL(window.location.href);
         let protocol = url.protocol === 'https:' ? 'wss://' : 'ws://';
-        let connectionString = protocol + window.location.host + '/ws/play/' + this.gameUX.playerType + '/' + roomCode + '/';
+        const host = this.workerUrl ? this.workerUrl : protocol + window.location.host;
+        let connectionString = host + '/ws/play/' + this.gameUX.playerType + '/' + roomCode + '/';
         const ai = document.getElementById("data_store").getAttribute("ai");
         if (ai && ai != "None") {
             connectionString += ai + '/';
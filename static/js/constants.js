@@ -202,6 +202,24 @@ export function infoListText(discipline) {
     return "Tech\n\n• 15 card deck\n• 3 mana each turn\n• new hand each turn";
 }
 
+export async function fetchAllCards(allCardsHash, variant = {}) {
+    // the catalog URL is content-addressed, so the browser can cache it forever
+    const headers = {
+      'Accept': 'application/json',
+    };
+    const response = await fetch(`/cards/${allCardsHash}.json`, { headers });
+    if (response.ok) {
+        return response.json();
+    }
+    // the hash is from before the cards changed, so get the current cards instead
+    const query = new URLSearchParams(variant).toString();
+    const currentResponse = await fetch(`/cards/current.json${query ? "?" + query : ""}`, { headers });
+    if (!currentResponse.ok) {
+        throw new Error(`Couldn't load the cards: ${currentResponse.status}`);
+    }
+    return currentResponse.json();
+}
+
 export async function postData(url, data) {
     const csrftoken = getCookie('csrftoken');
     // Default options are marked with *
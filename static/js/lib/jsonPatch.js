@@ -0,0 +1,46 @@
+// Applies an RFC 6902 JSON Patch from the server (add, remove and replace operations) to a game.
+// The game passed in is left as it was, since earlier games are still in the GameUX's actionQueue,
+// so every object on a patched path is copied, once per patch, and everything else is shared.
+export function applyPatch(document, patch) {
+    const copies = new Set();
+    const copyOf = value => {
+        if (value === null || typeof value !== "object" || copies.has(value)) {
+            return value;
+        }
+        const copy = Array.isArray(value) ? value.slice() : Object.assign({}, value);
+        copies.add(copy);
+        return copy;
+    };
+
+    let root = document;
+    for (const operation of patch) {
+        if (operation.path === "") {
+            root = operation.value;
+            continue;
+        }
+        const tokens = operation.path.split("/").slice(1).map(token => token.replace(/~1/g, "/").replace(/~0/g, "~"));
+        root = copyOf(root);
+        let parent = root;
+        for (const token of tokens.slice(0, -1)) {
+            const key = Array.isArray(parent) ? parseInt(token) : token;
+            parent[key] = copyOf(parent[key]);
+            parent = parent[key];
+        }
+        let key = tokens[tokens.length - 1];
+        if (Array.isArray(parent)) {
+            key = key === "-" ? parent.length : parseInt(key);
+            if (operation.op === "add") {
+                parent.splice(key, 0, operation.value);
+            } else if (operation.op === "remove") {
+                parent.splice(key, 1);
+            } else {
+                parent[key] = operation.value;
+            }
+        } else if (operation.op === "remove") {
+            delete parent[key];
+        } else {
+            parent[key] = operation.value;
+        }
+    }
+    return root;
+}
@@ -20,7 +20,7 @@ export class DeckBuilder {
         } else {
             this.discipline = "magic"            
         }
-        this.allCards = JSON.parse(allCards);
+        this.allCards = allCards;
         this.username = username;
         this.setUpPIXIApp();
         this.loadUX(containerID);
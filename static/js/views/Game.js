@@ -432,12 +432,13 @@ export class GameUX {
             if (!player) {
                 continue;
             }
+            // the opponent's hand is card backs, which only have an id
             for (let card of player.hand.concat(player.in_play).concat(player.artifacts)) {
                 if (refresh && card.show_level_up) {
                     IDsToAnimate.push(card.id);
                 }
                 if (show_effects) {
-                    for (let e of card.effects) {
+                    for (let e of card.effects || []) {
                         if (e.show_effect_animation) {
                             IDsToAnimate.push(card.id);
                         }
@@ -567,7 +568,7 @@ export class GameUX {
                     if (this.parentGame && this.review_move_index > 2) {
                         index = this.review_move_index - 1;
                     } else if (!this.parentGame) {
-                        index = game.moves.length - 1;
+                        index = game.move_count - 1;
                     }
                     if (index) {
                         this.gameRoom.sendPlayMoveEvent("NAVIGATE_GAME", {index});
@@ -575,7 +576,7 @@ export class GameUX {
                 }, 
                 () => {
                     let index = null;
-                    if (this.parentGame && this.review_move_index < this.parentGame.moves.length) {
+                    if (this.parentGame && this.review_move_index < this.parentGame.move_count) {
                         index = this.review_move_index + 1;
                         this.gameRoom.sendPlayMoveEvent("NAVIGATE_GAME", {index});
                     } else {
@@ -1040,7 +1041,7 @@ export class GameUX {
         let ropeTime = tickMS*4;
         this.ropeGodrayTimeTicker = () => {
             if (sprite.position.x >= ropeLength) {
-                this.gameRoom.sendPlayMoveEvent("END_TURN", {});
+                // the server ends the turn when its clock runs out
                 this.showingRope = false;
                 sprite.filters = []; 
                 this.app.ticker.remove(this.ropeGodrayTimeTicker)            
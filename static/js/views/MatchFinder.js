@@ -4,6 +4,8 @@ import * as Constants from '../constants.js';
 export class MatchFinder {
     gameSocket = null;
     constructor(containerID, deckID, username) {
+        this.deckID = deckID;
+        this.username = username;
         let container = document.getElementById(containerID);
         let controlsContainer = document.createElement("div");
         container.appendChild(controlsContainer);
@@ -13,21 +15,22 @@ export class MatchFinder {
         `;
         controlsContainer.appendChild(titleH1);
 
-        this.connect(username, deckID)
+        this.connect()
     }
 
-    connect (username, deckID) {
-        if (this.gameSocket == null) {
-            this.setupSocket(deckID);
+    connect () {
+        if (this.gameSocket == null || this.gameSocket.readyState == WebSocket.CLOSED) {
+            this.setupSocket(this.deckID);
         }
         if (this.gameSocket.readyState == WebSocket.OPEN) {
             console.log('WebSockets connection created.');
+            // after a reconnect, this keeps the player's place in the queue
             this.gameSocket.send(JSON.stringify(
-                {"username": username, "message_type": "JOIN"}
+                {"username": this.username, "message_type": "JOIN"}
             ));                
         } else {
             setTimeout(() => {
-                this.connect(username);
+                this.connect();
             }, 100);
         }
     }
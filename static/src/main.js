@@ -36,8 +36,10 @@ if (window.location.pathname.startsWith("/play")) {
     gameRoom.connect();
 } else if (window.location.pathname.startsWith("/choose_deck_for_match")) {
     const decks = JSON.parse(document.getElementById("data_store").getAttribute("json_decks"));
-    const allCards = JSON.parse(document.getElementById("data_store").getAttribute("all_cards"))
-    new DeckViewer(decks, allCards, "app");
+    Constants.fetchAllCards(document.getElementById("data_store").getAttribute("all_cards_hash"))
+        .then(allCards => {
+            new DeckViewer(decks, allCards, "app");
+        });
 } else if (window.location.pathname.startsWith("/u/")) {
     const playerRank = document.getElementById("data_store").getAttribute("player_rank");
     const accountNumber = document.getElementById("data_store").getAttribute("account_number");
@@ -49,14 +51,19 @@ if (window.location.pathname.startsWith("/play")) {
 } else if (window.location.pathname.startsWith("/choose_opponent")) {
     const opponentDecks = JSON.parse(document.getElementById("data_store").getAttribute("json_opponent_decks"));
     const deckID = JSON.parse(document.getElementById("data_store").getAttribute("deck_id"));
-    const allCards = JSON.parse(document.getElementById("data_store").getAttribute("all_cards"))
-    new OpponentChooser(opponentDecks, allCards, "app", deckID);
+    Constants.fetchAllCards(document.getElementById("data_store").getAttribute("all_cards_hash"))
+        .then(allCards => {
+            new OpponentChooser(opponentDecks, allCards, "app", deckID);
+        });
 } else if (window.location.pathname.startsWith("/find_match")) {
     const deckID = JSON.parse(document.getElementById("data_store").getAttribute("deck_id"));
     const username = document.getElementById("data_store").getAttribute("username");
     new MatchFinder("app", deckID, username);
 } else if (window.location.pathname.startsWith("/build_deck")) {
-    new DeckBuilder("app", document.getElementById("data_store").getAttribute("deck"), document.getElementById("data_store").getAttribute("username"), document.getElementById("data_store").getAttribute("all_cards"));
+    Constants.fetchAllCards(document.getElementById("data_store").getAttribute("all_cards_hash"))
+        .then(allCards => {
+            new DeckBuilder("app", document.getElementById("data_store").getAttribute("deck"), document.getElementById("data_store").getAttribute("username"), allCards);
+        });
 } else if (window.location.pathname.startsWith("/top_players")) {
     new TopPlayers("app", JSON.parse(document.getElementById("data_store").getAttribute("players")));
 } else if (window.location.pathname.startsWith("/top_decks")) {